@@ -0,0 +1,2 @@
+from benchmarks.generator import *
+from benchmarks.runner import *
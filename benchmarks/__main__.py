@@ -0,0 +1,89 @@
+import sys
+import argparse
+
+from benchmarks.runner import CASES, run_suite, compare_results
+from visdatcompy.utils import color_print
+
+
+# ==================================================================================================================================
+# |                                                              CLI                                                               |
+# ==================================================================================================================================
+
+
+def main(argv: list[str] = None) -> int:
+    """
+    Командная строка бенчмарков:
+        - python -m benchmarks run [--sizes 50 200] [--cases "hash/*"] [--repeat 3]
+        - python -m benchmarks compare <base> <head> [--tolerance 0.1]
+        - python -m benchmarks list
+
+    Returns:
+        - int: код возврата (1 - найдены регрессии).
+    """
+
+    parser = argparse.ArgumentParser(prog="python -m benchmarks")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    run = commands.add_parser("run", help="запустить бенчмарки")
+    run.add_argument("--sizes", type=int, nargs="+", default=[50, 200])
+    run.add_argument("--resolution", type=int, nargs=2, default=[256, 256])
+    run.add_argument("--cases", nargs="+", default=None, help="glob-шаблоны сценариев")
+    run.add_argument("--repeat", type=int, default=1)
+    run.add_argument("--seed", type=int, default=0)
+    run.add_argument("--data", default="benchmarks/data")
+    run.add_argument("--output", default="benchmarks/results.jsonl")
+    run.add_argument("--no-limit", action="store_true")
+
+    compare = commands.add_parser("compare", help="сравнить результаты двух коммитов")
+    compare.add_argument("base")
+    compare.add_argument("head")
+    compare.add_argument("--results", default="benchmarks/results.jsonl")
+    compare.add_argument("--tolerance", type=float, default=0.1)
+
+    commands.add_parser("list", help="вывести список сценариев")
+
+    args = parser.parse_args(argv)
+
+    if args.command == "list":
+        for case, (_, max_pairs, _) in CASES.items():
+            limit = f" (не более {max_pairs} пар)" if max_pairs else ""
+            print(f"{case}{limit}")
+
+        return 0
+
+    if args.command == "run":
+        run_suite(
+            sizes=args.sizes,
+            resolution=tuple(args.resolution),
+            cases=args.cases,
+            repeat=args.repeat,
+            data_path=args.data,
+            output=args.output,
+            seed=args.seed,
+            no_limit=args.no_limit,
+        )
+        print()
+
+        return 0
+
+    comparison = compare_results(args.base, args.head, args.results, args.tolerance)
+    print(comparison.to_string(index=False))
+
+    regressions = comparison[comparison["regression"]]
+
+    if not regressions.empty:
+        color_print(
+            "fail", "fail", f"Найдено регрессий: {len(regressions)}", True
+        )
+        print()
+
+        return 1
+
+    color_print("done", "done", "Регрессий не найдено.")
+    print()
+
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
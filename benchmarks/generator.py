@@ -0,0 +1,220 @@
+import os
+import json
+import shutil
+import cv2
+import numpy as np
+import pandas as pd
+
+
+__all__ = ["generate_dataset", "load_ground_truth", "TRANSFORMS"]
+
+# Преобразования, которыми из оригинала получается дубликат.
+TRANSFORMS = ("exact", "jpeg", "resize", "crop", "brightness")
+
+# Параметры преобразований.
+_JPEG_QUALITY = 70
+_RESIZE_SCALE = 0.5
+_CROP_FRACTION = 0.1
+_BRIGHTNESS_SHIFT = 40
+
+# Версия генератора: меняется при любом изменении изображений, чтобы не переиспользовать
+# сгенерированные старой версией датасеты.
+_GENERATOR_VERSION = 1
+
+
+# ==================================================================================================================================
+# |                                                       SYNTHETIC DATASETS                                                       |
+# ==================================================================================================================================
+
+
+def generate_dataset(
+    root: str,
+    n_images: int,
+    resolution: tuple = (256, 256),
+    transforms: tuple = TRANSFORMS,
+    unique_fraction: float = 0.2,
+    seed: int = 0,
+    same_names: bool = False,
+) -> pd.DataFrame:
+    """
+    Генерирует пару датасетов с известными дубликатами: root/originals - оригиналы,
+    root/candidates - их дубликаты (точные копии, JPEG-перекодирование, уменьшение,
+    обрезка, изменение яркости) и посторонние изображения. Часть оригиналов не имеет
+    дубликатов, поэтому ложные совпадения возможны в обе стороны.
+
+    Изображения детерминированы при одинаковых параметрах и seed. Если в root уже есть
+    датасет с теми же параметрами, он не генерируется заново.
+
+    Parameters:
+        - root (str): директория датасета.
+        - n_images (int): количество оригиналов.
+        - resolution (tuple): размер оригиналов (ширина, высота).
+        - transforms (tuple): преобразования дубликатов (см. TRANSFORMS), применяются
+        к оригиналам по очереди.
+        - unique_fraction (float): доля оригиналов без дубликатов; столько же посторонних
+        изображений добавляется к кандидатам.
+        - seed (int): зерно генератора случайных чисел.
+        - same_names (bool): называть кандидатов так же, как оригиналы (дубликат - как
+        свой оригинал, посторонний кандидат - как оригинал без дубликата), чтобы проверить,
+        что изображения разных датасетов с одинаковыми именами сравниваются. JPEG-дубликат
+        в этом случае записывается под именем оригинала с расширением .png.
+
+    Returns:
+        - pd.DataFrame: разметка со столбцами "original", "candidate" и "transform"
+        (пути относительно датасетов; у посторонних кандидатов "original" пустой,
+        у оригиналов без дубликатов пустой "candidate").
+    """
+
+    params = {
+        "n_images": n_images,
+        "resolution": list(resolution),
+        "transforms": list(transforms),
+        "unique_fraction": unique_fraction,
+        "seed": seed,
+        "same_names": same_names,
+        "version": _GENERATOR_VERSION,
+    }
+
+    params_path = os.path.join(root, "params.json")
+    truth_path = os.path.join(root, "ground_truth.csv")
+
+    if os.path.exists(params_path) and os.path.exists(truth_path):
+        with open(params_path, encoding="utf-8") as file:
+            if json.load(file) == params:
+                return load_ground_truth(root)
+
+    originals_path = os.path.join(root, "originals")
+    candidates_path = os.path.join(root, "candidates")
+
+    for path in (originals_path, candidates_path):
+        shutil.rmtree(path, ignore_errors=True)
+        os.makedirs(path)
+
+    rng = np.random.default_rng(seed)
+    n_unique = int(round(n_images * unique_fraction))
+
+    # Кандидаты перемешиваются, чтобы порядок и имена файлов не выдавали разметку
+    candidate_ids = rng.permutation(n_images)
+
+    rows = []
+
+    for i in range(n_images):
+        image = _synthetic_image(rng, resolution)
+        original = f"original_{i:06d}.png"
+        cv2.imwrite(os.path.join(originals_path, original), image)
+
+        candidate_id = candidate_ids[i]
+
+        if i < n_unique:
+            # Оригинал без дубликата и посторонний кандидат вместо дубликата
+            candidate = original if same_names else f"candidate_{candidate_id:06d}.png"
+            cv2.imwrite(
+                os.path.join(candidates_path, candidate),
+                _synthetic_image(rng, resolution),
+            )
+
+            rows.append((original, "", "unique"))
+            rows.append(("", candidate, "unrelated"))
+            continue
+
+        transform = transforms[(i - n_unique) % len(transforms)]
+        extension = "jpg" if transform == "jpeg" else "png"
+        candidate = (
+            original if same_names else f"candidate_{candidate_id:06d}.{extension}"
+        )
+
+        _write_variant(
+            os.path.join(originals_path, original),
+            os.path.join(candidates_path, candidate),
+            image,
+            transform,
+        )
+
+        rows.append((original, candidate, transform))
+
+    ground_truth = pd.DataFrame(rows, columns=["original", "candidate", "transform"])
+    ground_truth.to_csv(truth_path, index=False)
+
+    with open(params_path, "w", encoding="utf-8") as file:
+        json.dump(params, file)
+
+    return ground_truth
+
+
+def load_ground_truth(root: str) -> pd.DataFrame:
+    """
+    Загружает разметку датасета, созданного generate_dataset.
+
+    Parameters:
+        - root (str): директория датасета.
+
+    Returns:
+        - pd.DataFrame: разметка (см. generate_dataset).
+    """
+
+    return pd.read_csv(
+        os.path.join(root, "ground_truth.csv"), keep_default_na=False, dtype=str
+    )
+
+
+# ==================================================================================================================================
+
+
+def _synthetic_image(rng: np.random.Generator, resolution: tuple) -> np.ndarray:
+    """
+    Создаёт изображение BGR из плавного цветного фона, случайных фигур и шума: фон
+    различает изображения для хэшей и метрик, углы фигур дают ключевые точки для SIFT и ORB.
+    """
+
+    width, height = resolution
+
+    background = rng.integers(0, 256, size=(6, 6, 3), dtype=np.uint8)
+    image = cv2.resize(background, (width, height), interpolation=cv2.INTER_CUBIC)
+
+    for _ in range(int(rng.integers(6, 12))):
+        color = tuple(int(value) for value in rng.integers(0, 256, size=3))
+        x1, x2 = sorted(int(value) for value in rng.integers(0, width, size=2))
+        y1, y2 = sorted(int(value) for value in rng.integers(0, height, size=2))
+
+        if rng.random() < 0.5:
+            cv2.rectangle(image, (x1, y1), (x2, y2), color, thickness=-1)
+        else:
+            radius = max(2, (x2 - x1) // 2)
+            cv2.circle(image, (x1, y1), radius, color, thickness=-1)
+
+    noise = rng.normal(0, 6, size=image.shape)
+
+    return np.clip(image + noise, 0, 255).astype(np.uint8)
+
+
+def _write_variant(
+    original_path: str, path: str, image: np.ndarray, transform: str
+) -> None:
+    """
+    Записывает дубликат изображения, полученный преобразованием transform.
+    """
+
+    height, width = image.shape[:2]
+
+    if transform == "exact":
+        shutil.copyfile(original_path, path)
+
+    elif transform == "jpeg":
+        # Формат задаётся явно: расширение файла может не совпадать с форматом
+        _, data = cv2.imencode(".jpg", image, [cv2.IMWRITE_JPEG_QUALITY, _JPEG_QUALITY])
+        data.tofile(path)
+
+    elif transform == "resize":
+        size = (int(width * _RESIZE_SCALE), int(height * _RESIZE_SCALE))
+        cv2.imwrite(path, cv2.resize(image, size, interpolation=cv2.INTER_AREA))
+
+    elif transform == "crop":
+        dx, dy = int(width * _CROP_FRACTION), int(height * _CROP_FRACTION)
+        cv2.imwrite(path, image[dy : height - dy, dx : width - dx])
+
+    elif transform == "brightness":
+        shifted = np.clip(image.astype(np.int16) + _BRIGHTNESS_SHIFT, 0, 255)
+        cv2.imwrite(path, shifted.astype(np.uint8))
+
+    else:
+        raise ValueError(f"Неизвестное преобразование: {transform}")
@@ -0,0 +1,464 @@
+import io
+import os
+import json
+import time
+import fnmatch
+import platform
+import subprocess
+import contextlib
+import multiprocessing
+from functools import partial
+from concurrent.futures import ProcessPoolExecutor
+
+import cv2
+import numpy as np
+import pandas as pd
+
+from benchmarks.generator import generate_dataset, load_ground_truth
+from visdatcompy import (
+    Dataset,
+    Hash,
+    Metrics,
+    FeatureExtractor,
+    VisDatCompare,
+    Stats,
+    set_stats,
+    peak_rss,
+)
+from visdatcompy.utils import color_print
+
+
+__all__ = [
+    "CASES",
+    "run_case",
+    "run_suite",
+    "evaluate",
+    "load_results",
+    "compare_results",
+    "git_commit",
+]
+
+
+# ==================================================================================================================================
+# |                                                             CASES                                                              |
+# ==================================================================================================================================
+
+
+def _top_k_pairs(dataset1: Dataset, dataset2: Dataset, matches: tuple) -> list[tuple]:
+    query_idx, match_idx, _ = matches
+
+    return [
+        (dataset1.images[i].relpath, dataset2.images[j].relpath)
+        for i, j in zip(query_idx.tolist(), match_idx.tolist())
+    ]
+
+
+def _hash_case(
+    compare_method: str, threshold: float, dataset1: Dataset, dataset2: Dataset
+) -> list[tuple]:
+    matches = Hash(dataset1, dataset2).top_k(1, threshold, compare_method)
+
+    return _top_k_pairs(dataset1, dataset2, matches)
+
+
+def _metrics_case(
+    metric_name: str,
+    backend: str,
+    threshold: float,
+    dataset1: Dataset,
+    dataset2: Dataset,
+) -> list[tuple]:
+    matches = Metrics(dataset1, dataset2, backend=backend).top_k(
+        1, threshold, metric_name, resize_images=False
+    )
+
+    return _top_k_pairs(dataset1, dataset2, matches)
+
+
+def _features_case(
+    extractor: str, threshold: float, dataset1: Dataset, dataset2: Dataset
+) -> list[tuple]:
+    matches = FeatureExtractor(dataset1, dataset2, extractor).top_k(1, threshold)
+
+    return _top_k_pairs(dataset1, dataset2, matches)
+
+
+def _cascade_case(
+    hash_method: str,
+    hash_radius: float,
+    metric_name: str,
+    dataset1: Dataset,
+    dataset2: Dataset,
+) -> list[tuple]:
+    duplicates = VisDatCompare(dataset1, dataset2).run_cascade(
+        hash_method=hash_method,
+        hash_radius=hash_radius,
+        metric_name=metric_name,
+        metric_range="duplicate",
+        resize_images=False,
+        echo=False,
+    )
+
+    return [
+        (original.relpath, duplicate.relpath)
+        for original, image_duplicates in duplicates.items()
+        for duplicate in image_duplicates
+    ]
+
+
+def _build_cases() -> dict:
+    """
+    Набор сценариев: название -> (функция, максимальное количество пар изображений
+    или None, одинаковые имена оригиналов и кандидатов). Функция принимает датасеты
+    оригиналов и кандидатов и возвращает найденные пары дубликатов. Пороги подобраны
+    по синтетическим датасетам generate_dataset.
+    """
+
+    cases = {}
+
+    hash_thresholds = {
+        "average": 12,
+        "p": 16,
+        "marr_hildreth": 200,
+        "radial_variance": 0.9,
+        "block_mean": 60,
+        "color_moment": 1.0,
+    }
+
+    for method, threshold in hash_thresholds.items():
+        cases[f"hash/{method}"] = (partial(_hash_case, method, threshold), None, False)
+
+    metric_thresholds = {
+        "mse": 3000,
+        "psnr": 13,
+        "nrmse": 0.4,
+        "mae": 40,
+        "ssim": 0.45,
+    }
+
+    for metric, threshold in metric_thresholds.items():
+        for backend, max_pairs in (("batched", None), ("pairwise", 40000)):
+            cases[f"metrics/{metric}/{backend}"] = (
+                partial(_metrics_case, metric, backend, threshold),
+                max_pairs,
+                False,
+            )
+
+    for extractor, threshold in (("orb", 0.6), ("sift", 0.8)):
+        cases[f"features/{extractor}"] = (
+            partial(_features_case, extractor, threshold),
+            40000,
+            False,
+        )
+
+    cases["cascade/p-ssim"] = (partial(_cascade_case, "p", 16, "ssim"), None, False)
+
+    # Дубликаты под теми же именами, что и оригиналы: пары с одинаковыми именами
+    # из разных датасетов не должны отбрасываться каскадом
+    cases["cascade/p-ssim/same-names"] = (
+        partial(_cascade_case, "p", 16, "ssim"),
+        None,
+        True,
+    )
+
+    return cases
+
+
+# Сценарии бенчмарков: название -> (функция, максимальное количество пар или None,
+# одинаковые имена оригиналов и кандидатов).
+CASES = _build_cases()
+
+
+# ==================================================================================================================================
+# |                                                             RUNNER                                                             |
+# ==================================================================================================================================
+
+
+def evaluate(pairs: list[tuple], ground_truth: pd.DataFrame) -> dict:
+    """
+    Сравнивает найденные пары дубликатов с разметкой.
+
+    Parameters:
+        - pairs (list[tuple]): найденные пары (оригинал, кандидат).
+        - ground_truth (pd.DataFrame): разметка generate_dataset.
+
+    Returns:
+        - dict: точность (precision), полнота (recall), F1, количество верных, ложных
+        и пропущенных пар и полнота для каждого преобразования.
+    """
+
+    duplicates = ground_truth[
+        (ground_truth["original"] != "") & (ground_truth["candidate"] != "")
+    ]
+    truth = dict(
+        zip(
+            zip(duplicates["original"], duplicates["candidate"]),
+            duplicates["transform"],
+        )
+    )
+    found = set(pairs)
+
+    true_positives = len(found & truth.keys())
+    precision = true_positives / len(found) if found else 1.0
+    recall = true_positives / len(truth) if truth else 1.0
+
+    recall_by_transform = {}
+    for transform in sorted(set(truth.values())):
+        expected = {pair for pair, kind in truth.items() if kind == transform}
+        recall_by_transform[transform] = len(found & expected) / len(expected)
+
+    return {
+        "precision": precision,
+        "recall": recall,
+        "f1": (
+            2 * precision * recall / (precision + recall)
+            if precision + recall
+            else 0.0
+        ),
+        "true_positives": true_positives,
+        "false_positives": len(found) - true_positives,
+        "false_negatives": len(truth) - true_positives,
+        "recall_by_transform": recall_by_transform,
+    }
+
+
+def run_case(case: str, root: str) -> dict:
+    """
+    Выполняет сценарий на сгенерированном датасете в текущем процессе и измеряет время,
+    пропускную способность, память и качество поиска. Вывод движков в консоль подавляется.
+
+    Parameters:
+        - case (str): название сценария (см. CASES).
+        - root (str): директория датасета generate_dataset.
+
+    Returns:
+        - dict: результаты измерения.
+    """
+
+    function = CASES[case][0]
+    baseline_rss = peak_rss()
+
+    stats = set_stats(Stats())
+
+    try:
+        with contextlib.redirect_stdout(io.StringIO()):
+            started = time.perf_counter()
+
+            dataset1 = Dataset(os.path.join(root, "originals"))
+            dataset2 = Dataset(os.path.join(root, "candidates"))
+            pairs = function(dataset1, dataset2)
+
+            wall_time = time.perf_counter() - started
+
+    finally:
+        set_stats(None)
+
+    summary = stats.as_dict()
+    n_pairs = dataset1.image_count * dataset2.image_count
+
+    return {
+        "case": case,
+        "wall_time": wall_time,
+        "pairs": n_pairs,
+        "pairs_per_second": n_pairs / wall_time if wall_time > 0 else 0.0,
+        "peak_rss": summary["peak_rss"],
+        "baseline_rss": baseline_rss,
+        "stages": summary["stages"],
+        "counters": summary["counters"],
+        **evaluate(pairs, load_ground_truth(root)),
+    }
+
+
+def run_suite(
+    sizes: list[int] = (50, 200),
+    resolution: tuple = (256, 256),
+    cases: list[str] = None,
+    repeat: int = 1,
+    data_path: str = "benchmarks/data",
+    output: str = "benchmarks/results.jsonl",
+    seed: int = 0,
+    no_limit: bool = False,
+) -> list[dict]:
+    """
+    Запускает сценарии на синтетических датасетах нескольких размеров и дописывает
+    результаты в файл JSON Lines. Каждое измерение выполняется в отдельном процессе,
+    чтобы пиковый объём памяти и кэши не зависели от предыдущих сценариев. Записи
+    помечаются коммитом git, поэтому результаты разных версий можно сравнить
+    (см. compare_results).
+
+    Parameters:
+        - sizes (list[int]): количества оригиналов в датасетах.
+        - resolution (tuple): размер изображений (ширина, высота).
+        - cases (list[str]): glob-шаблоны названий сценариев (по умолчанию - все).
+        - repeat (int): количество повторов каждого измерения.
+        - data_path (str): директория для сгенерированных датасетов.
+        - output (str): файл для записи результатов (None - не записывать).
+        - seed (int): зерно генератора датасетов.
+        - no_limit (bool): не пропускать медленные сценарии на больших датасетах.
+
+    Returns:
+        - list[dict]: результаты измерений.
+    """
+
+    selected = [
+        case
+        for case in CASES
+        if cases is None or any(fnmatch.fnmatch(case, pattern) for pattern in cases)
+    ]
+
+    commit, dirty = git_commit()
+    environment = _environment()
+    records = []
+
+    for n_images in sizes:
+        for case in selected:
+            _, max_pairs, same_names = CASES[case]
+
+            if not no_limit and max_pairs is not None and n_images**2 > max_pairs:
+                color_print("warning", "warning", f"{case} (n={n_images}): пропущен")
+                continue
+
+            root = os.path.join(
+                data_path,
+                f"n{n_images}_{resolution[0]}x{resolution[1]}_seed{seed}"
+                + ("_same_names" if same_names else ""),
+            )
+            generate_dataset(
+                root, n_images, resolution, seed=seed, same_names=same_names
+            )
+
+            for attempt in range(repeat):
+                # Новый процесс на каждое измерение: пиковый объём памяти процесса
+                # не сбрасывается, а кэши не должны переходить между сценариями
+                with ProcessPoolExecutor(
+                    max_workers=1, mp_context=multiprocessing.get_context("spawn")
+                ) as executor:
+                    result = executor.submit(run_case, case, root).result()
+
+                record = {
+                    "commit": commit,
+                    "dirty": dirty,
+                    "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+                    "n_images": n_images,
+                    "resolution": list(resolution),
+                    "seed": seed,
+                    "attempt": attempt,
+                    **result,
+                    **environment,
+                }
+                records.append(record)
+
+                color_print(
+                    "log",
+                    "log",
+                    f"{case} (n={n_images}): {record['wall_time']:.2f} с, "
+                    f"{record['pairs_per_second']:.0f} пар/с, "
+                    f"precision {record['precision']:.3f}, recall {record['recall']:.3f}",
+                )
+
+                if output:
+                    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+
+                    with open(output, "a", encoding="utf-8") as file:
+                        file.write(json.dumps(record, ensure_ascii=False) + "\n")
+
+    return records
+
+
+# ==================================================================================================================================
+
+
+def load_results(path: str = "benchmarks/results.jsonl") -> pd.DataFrame:
+    """
+    Загружает результаты бенчмарков из файла JSON Lines.
+    """
+
+    with open(path, encoding="utf-8") as file:
+        return pd.DataFrame([json.loads(line) for line in file if line.strip()])
+
+
+def compare_results(
+    base: str,
+    head: str,
+    path: str = "benchmarks/results.jsonl",
+    tolerance: float = 0.1,
+) -> pd.DataFrame:
+    """
+    Сравнивает результаты двух коммитов по каждому сценарию и размеру датасета (по лучшему
+    из повторов). Регрессией считается рост времени больше чем на tolerance или снижение
+    точности либо полноты.
+
+    Parameters:
+        - base (str): коммит (или его начало) для сравнения.
+        - head (str): проверяемый коммит.
+        - path (str): файл с результатами run_suite.
+        - tolerance (float): допустимый относительный рост времени выполнения.
+
+    Returns:
+        - pd.DataFrame: время, память, точность и полнота обоих коммитов, отношение
+        времени head / base и признак регрессии.
+    """
+
+    results = load_results(path)
+    results["resolution"] = results["resolution"].map(tuple)
+    keys = ["case", "n_images", "resolution"]
+
+    def best(commit: str) -> pd.DataFrame:
+        selected = results[results["commit"].str.startswith(commit)]
+
+        if selected.empty:
+            raise ValueError(f"Нет результатов для коммита: {commit}")
+
+        return selected.groupby(keys).agg(
+            wall_time=("wall_time", "min"),
+            peak_rss=("peak_rss", "max"),
+            precision=("precision", "mean"),
+            recall=("recall", "mean"),
+        )
+
+    comparison = best(base).join(
+        best(head), lsuffix="_base", rsuffix="_head", how="inner"
+    )
+    comparison["time_ratio"] = (
+        comparison["wall_time_head"] / comparison["wall_time_base"]
+    )
+    comparison["regression"] = (
+        (comparison["time_ratio"] > 1 + tolerance)
+        | (comparison["precision_head"] < comparison["precision_base"])
+        | (comparison["recall_head"] < comparison["recall_base"])
+    )
+
+    return comparison.reset_index()
+
+
+def git_commit() -> tuple:
+    """
+    Возвращает текущий коммит git и признак незафиксированных изменений
+    (None, False - вне репозитория git).
+    """
+
+    try:
+        commit = subprocess.run(
+            ["git", "rev-parse", "HEAD"], capture_output=True, text=True, check=True
+        ).stdout.strip()
+        status = subprocess.run(
+            ["git", "status", "--porcelain", "--untracked-files=no"],
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.strip()
+
+    except (OSError, subprocess.CalledProcessError):
+        return None, False
+
+    return commit, bool(status)
+
+
+def _environment() -> dict:
+    return {
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "opencv": cv2.__version__,
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+    }
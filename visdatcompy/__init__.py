@@ -1,5 +1,10 @@
+from visdatcompy.cache import *
+from visdatcompy.checkpoint import *
 from visdatcompy.feature_extractor import *
 from visdatcompy.hash import *
+from visdatcompy.image_cache import *
 from visdatcompy.image_handler import *
+from visdatcompy.instrumentation import *
 from visdatcompy.metrics import *
+from visdatcompy.results import *
 from visdatcompy.visdatcompare import *
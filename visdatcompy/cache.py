@@ -0,0 +1,234 @@
+import os
+import json
+import sqlite3
+import hashlib
+import threading
+import numpy as np
+from typing import Callable
+
+from visdatcompy.image_handler import Image
+from visdatcompy.instrumentation import count
+from visdatcompy.utils import color_print, file_digest
+
+
+__all__ = ["FeatureCache"]
+
+
+# ==================================================================================================================================
+# |                                                          FEATURE CACHE                                                         |
+# ==================================================================================================================================
+
+
+class FeatureCache(object):
+    """
+    Постоянный кэш признаков изображений (хэшей, дескрипторов, уменьшенных копий) между запусками.
+
+    Записи хранятся в базе SQLite, а сами массивы - в файлах .npy рядом с ней. Ключом записи
+    является путь к файлу, название метода и его параметры; при изменении размера или времени
+    модификации файла (или его содержимого, если включена проверка по дайджесту) запись
+    считается устаревшей и пересчитывается.
+
+    Parameters:
+        - cache_path (str): директория для хранения кэша.
+        - use_digest (bool): дополнительно сверять BLAKE2-дайджест содержимого файла,
+        если время модификации изменилось (например, после копирования датасета).
+
+    Attributes:
+        - cache_path (str): директория кэша.
+        - hits (int): количество найденных в кэше записей.
+        - misses (int): количество вычисленных заново записей.
+    """
+
+    def __init__(self, cache_path: str, use_digest: bool = False):
+        self.cache_path = cache_path
+        self.use_digest = use_digest
+
+        self.hits = 0
+        self.misses = 0
+
+        self._blobs_path = os.path.join(self.cache_path, "blobs")
+        os.makedirs(self._blobs_path, exist_ok=True)
+
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(
+            os.path.join(self.cache_path, "cache.sqlite"), check_same_thread=False
+        )
+        self._connection.execute(
+            """
+            CREATE TABLE IF NOT EXISTS entries (
+                path TEXT NOT NULL,
+                method TEXT NOT NULL,
+                params TEXT NOT NULL,
+                size INTEGER NOT NULL,
+                mtime_ns INTEGER NOT NULL,
+                digest TEXT,
+                blob TEXT NOT NULL,
+                PRIMARY KEY (path, method, params)
+            )
+            """
+        )
+        self._connection.commit()
+
+    def get(self, image: Image, method: str, params: dict = None) -> np.ndarray:
+        """
+        Возвращает сохранённый массив для изображения или None, если записи нет или она устарела.
+
+        Parameters:
+            - image (Image): объект изображения.
+            - method (str): название метода, которым получен массив.
+            - params (dict): параметры метода.
+
+        Returns:
+            - np.ndarray: сохранённый массив или None.
+        """
+
+        path, params_key = os.path.abspath(image.path), self._params_key(params)
+
+        with self._lock:
+            row = self._connection.execute(
+                "SELECT size, mtime_ns, digest, blob FROM entries "
+                "WHERE path = ? AND method = ? AND params = ?",
+                (path, method, params_key),
+            ).fetchone()
+
+        if row is None:
+            count("cache_misses")
+            return None
+
+        size, mtime_ns, digest, blob = row
+
+        try:
+            stat = os.stat(path)
+        except OSError:
+            count("cache_misses")
+            return None
+
+        if stat.st_size != size:
+            count("cache_misses")
+            return None
+
+        if stat.st_mtime_ns != mtime_ns:
+            if not self.use_digest or self._file_digest(path) != digest:
+                count("cache_misses")
+                return None
+
+            with self._lock:
+                self._connection.execute(
+                    "UPDATE entries SET mtime_ns = ? "
+                    "WHERE path = ? AND method = ? AND params = ?",
+                    (stat.st_mtime_ns, path, method, params_key),
+                )
+                self._connection.commit()
+
+        try:
+            value = np.load(os.path.join(self._blobs_path, blob), allow_pickle=False)
+        except (OSError, ValueError):
+            count("cache_misses")
+            return None
+
+        count("cache_hits")
+
+        return value
+
+    def put(
+        self, image: Image, method: str, value: np.ndarray, params: dict = None
+    ) -> None:
+        """
+        Сохраняет массив для изображения, заменяя предыдущую запись.
+
+        Parameters:
+            - image (Image): объект изображения.
+            - method (str): название метода, которым получен массив.
+            - value (np.ndarray): сохраняемый массив.
+            - params (dict): параметры метода.
+        """
+
+        path, params_key = os.path.abspath(image.path), self._params_key(params)
+
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return
+
+        digest = self._file_digest(path) if self.use_digest else None
+        blob = hashlib.sha1(f"{path}|{method}|{params_key}".encode()).hexdigest()
+        blob = f"{blob}.npy"
+
+        np.save(os.path.join(self._blobs_path, blob), np.asarray(value))
+
+        with self._lock:
+            self._connection.execute(
+                "INSERT OR REPLACE INTO entries VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (
+                    path,
+                    method,
+                    params_key,
+                    stat.st_size,
+                    stat.st_mtime_ns,
+                    digest,
+                    blob,
+                ),
+            )
+            self._connection.commit()
+
+    def get_or_compute(
+        self,
+        image: Image,
+        method: str,
+        compute: Callable[[], np.ndarray],
+        params: dict = None,
+    ) -> np.ndarray:
+        """
+        Возвращает массив из кэша, а при его отсутствии вычисляет и сохраняет.
+
+        Parameters:
+            - image (Image): объект изображения.
+            - method (str): название метода.
+            - compute (Callable): функция без аргументов, вычисляющая массив.
+            - params (dict): параметры метода.
+
+        Returns:
+            - np.ndarray: массив признаков изображения.
+        """
+
+        value = self.get(image, method, params)
+
+        if value is not None:
+            self.hits += 1
+            return value
+
+        self.misses += 1
+        value = compute()
+
+        if value is not None:
+            self.put(image, method, value, params)
+
+        return value
+
+    def clear(self) -> None:
+        """
+        Удаляет все записи кэша.
+        """
+
+        with self._lock:
+            self._connection.execute("DELETE FROM entries")
+            self._connection.commit()
+
+        for blob in os.listdir(self._blobs_path):
+            os.remove(os.path.join(self._blobs_path, blob))
+
+        color_print("done", "done", f"Кэш очищен: {self.cache_path}")
+
+    def close(self) -> None:
+        """
+        Закрывает соединение с базой кэша.
+        """
+
+        with self._lock:
+            self._connection.close()
+
+    def _params_key(self, params: dict) -> str:
+        return json.dumps(params or {}, sort_keys=True)
+
+    def _file_digest(self, path: str) -> str:
+        return file_digest(path, digest_size=64)
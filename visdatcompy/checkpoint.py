@@ -0,0 +1,192 @@
+import os
+import json
+import time
+import threading
+import numpy as np
+
+from visdatcompy.utils import color_print
+
+
+__all__ = ["Checkpoint"]
+
+
+# ==================================================================================================================================
+# |                                                           CHECKPOINT                                                           |
+# ==================================================================================================================================
+
+
+class Checkpoint(object):
+    """
+    Сохранение промежуточных результатов длительного попарного сравнения для продолжения
+    после сбоя. Матрица результатов хранится в файле matrix.npy, отображённом в память,
+    а координаты готовых тайлов дописываются в журнал tiles.log пакетами: матрица
+    сбрасывается на диск один раз на пакет, после чего в журнал записываются все тайлы
+    пакета. После прерывания пересчитываются только тайлы, не попавшие в журнал
+    (не более одного пакета).
+
+    Вместе с состоянием сохраняется отпечаток вычисления (отпечатки датасетов и параметры
+    метода). Если при продолжении отпечаток не совпадает, например датасет изменился,
+    сохранённые результаты отбрасываются и вычисление начинается заново.
+
+    Parameters:
+        - state_path (str): директория состояния вычисления.
+        - shape (tuple): размер матрицы результатов.
+        - dtype (object): тип элементов матрицы.
+        - fingerprint (dict): отпечаток вычисления (сериализуемый в JSON).
+        - resume (bool): продолжить вычисление по сохранённому состоянию.
+        - commit_tiles (int): количество готовых тайлов в пакете.
+        - commit_seconds (float): максимальное время между записями пакетов в секундах.
+
+    Attributes:
+        - matrix (np.memmap): матрица результатов.
+        - done (set[tuple]): координаты готовых тайлов (строки и столбцы начала и конца).
+    """
+
+    def __init__(
+        self,
+        state_path: str,
+        shape: tuple,
+        dtype: object,
+        fingerprint: dict,
+        resume: bool = False,
+        commit_tiles: int = 1024,
+        commit_seconds: float = 10.0,
+    ):
+        self.state_path = state_path
+        self.commit_tiles = commit_tiles
+        self.commit_seconds = commit_seconds
+        os.makedirs(self.state_path, exist_ok=True)
+
+        self._matrix_path = os.path.join(self.state_path, "matrix.npy")
+        self._log_path = os.path.join(self.state_path, "tiles.log")
+        self._state_file = os.path.join(self.state_path, "state.json")
+        self._lock = threading.Lock()
+
+        # Готовые тайлы, ещё не записанные в журнал, и открытый файл журнала
+        self._pending: list[tuple] = []
+        self._log = None
+        self._flushed = time.monotonic()
+
+        state = {
+            "fingerprint": fingerprint,
+            "shape": list(shape),
+            "dtype": np.dtype(dtype).str,
+        }
+
+        self.done: set[tuple] = set()
+
+        if resume and self._read_state() == state and os.path.exists(self._matrix_path):
+            self.matrix = np.load(self._matrix_path, mmap_mode="r+")
+            self.done = self._read_log()
+
+            color_print(
+                "log",
+                "log",
+                f"Продолжение вычисления: готово тайлов - {len(self.done)} ({self.state_path}).",
+            )
+            return
+
+        if resume and os.path.exists(self._state_file):
+            color_print(
+                "warning",
+                "warning",
+                f"Сохранённое состояние не соответствует датасетам или параметрам, вычисление начинается заново: {self.state_path}",
+            )
+
+        # Файл состояния удаляется первым, чтобы прерванная инициализация не считалась
+        # сохранённым состоянием со старым журналом
+        if os.path.exists(self._state_file):
+            os.remove(self._state_file)
+
+        self.matrix = np.lib.format.open_memmap(
+            self._matrix_path, mode="w+", dtype=dtype, shape=tuple(shape)
+        )
+        open(self._log_path, "w").close()
+
+        with open(self._state_file, "w", encoding="utf-8") as file:
+            json.dump(state, file)
+
+    def is_done(self, rows: slice, cols: slice) -> bool:
+        """
+        Проверяет, сохранён ли тайл с указанными срезами строк и столбцов.
+        """
+
+        return (rows.start, rows.stop, cols.start, cols.stop) in self.done
+
+    def commit(self, rows: slice, cols: slice) -> None:
+        """
+        Отмечает тайл как готовый. Вызывается после записи значений тайла (и его отражения)
+        в matrix; тайл попадает в журнал с очередным пакетом (см. flush).
+        """
+
+        key = (rows.start, rows.stop, cols.start, cols.stop)
+
+        with self._lock:
+            self._pending.append(key)
+
+            if (
+                len(self._pending) >= self.commit_tiles
+                or time.monotonic() - self._flushed >= self.commit_seconds
+            ):
+                self._flush()
+
+    def flush(self) -> None:
+        """
+        Сбрасывает матрицу на диск и записывает в журнал все отмеченные тайлы.
+        """
+
+        with self._lock:
+            self._flush()
+
+    def close(self) -> None:
+        """
+        Записывает отмеченные тайлы и закрывает журнал (матрица остаётся доступной).
+        """
+
+        with self._lock:
+            self._flush()
+
+            if self._log is not None:
+                self._log.close()
+                self._log = None
+
+    def _flush(self) -> None:
+        if self._pending:
+            self.matrix.flush()
+
+            if self._log is None:
+                self._log = open(self._log_path, "a")
+
+            self._log.write(
+                "".join(" ".join(map(str, key)) + "\n" for key in self._pending)
+            )
+            self._log.flush()
+            os.fsync(self._log.fileno())
+
+            self.done.update(self._pending)
+            self._pending.clear()
+
+        self._flushed = time.monotonic()
+
+    def _read_state(self) -> dict:
+        try:
+            with open(self._state_file, encoding="utf-8") as file:
+                return json.load(file)
+        except (OSError, ValueError):
+            return None
+
+    def _read_log(self) -> set[tuple]:
+        done = set()
+
+        try:
+            with open(self._log_path) as log:
+                for line in log:
+                    values = line.split()
+
+                    # Последняя строка может быть записана не полностью
+                    if line.endswith("\n") and len(values) == 4:
+                        done.add(tuple(int(value) for value in values))
+        except OSError:
+            pass
+
+        return done
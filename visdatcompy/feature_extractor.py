@@ -1,15 +1,31 @@
+import os
 import cv2
 import numpy as np
+import multiprocessing
 import matplotlib.pyplot as plt
 from scipy import stats
 from typing import Dict
+from concurrent.futures import ProcessPoolExecutor
 
+from visdatcompy.cache import FeatureCache
 from visdatcompy.utils import color_print
 from visdatcompy.image_handler import Image, Dataset
+from visdatcompy.instrumentation import stage, count
+from visdatcompy.pairwise import TopK, run_top_k, run_blocks
+from visdatcompy.vocabulary import VisualVocabulary, similarity_shortlist
 
 
 __all__ = ["FeatureExtractor"]
 
+# Количество дескрипторов датасета, обрабатываемых за один шаг при поиске схожего изображения.
+_DESCRIPTORS_BLOCK = 65536
+
+# Порог косинусного сходства нормализованных дескрипторов для "хорошего" совпадения.
+_SIMILARITY_THRESHOLD = 0.9
+
+# Порог расстояния Хэмминга (из 256 бит) для "хорошего" совпадения бинарных дескрипторов.
+_HAMMING_THRESHOLD = 64
+
 
 # ==================================================================================================================================
 # |                                                         FEATURE EXTRACTOR                                                      |
@@ -17,7 +33,17 @@ __all__ = ["FeatureExtractor"]
 
 
 class FeatureExtractor(object):
-    def __init__(self, dataset1: Dataset, dataset2: Dataset, extractor: str = "sift"):
+    def __init__(
+        self,
+        dataset1: Dataset,
+        dataset2: Dataset,
+        extractor: str = "sift",
+        cache: FeatureCache = None,
+        matcher: str = "auto",
+        n_workers: int = 1,
+        lazy: bool = False,
+        memory_budget: int = None,
+    ):
         """
         Класс для поиска схожих изображений с помощью SIFT, ORB и FAST.
 
@@ -25,14 +51,30 @@ class FeatureExtractor(object):
             - dataset1 (Dataset): Объект класса Dataset.
             - dataset2 (Dataset): Объект класса Dataset.
             - extractor (string): метод сравнения (sift, orb или fast).
+            - cache (FeatureCache): кэш нормализованных дескрипторов между запусками.
+            - matcher (string): способ сопоставления дескрипторов:
+                - "auto": "flann" для SIFT и "bf" для бинарных дескрипторов ORB и FAST.
+                - "flann": приближённый поиск FLANN (KD-деревья для SIFT, LSH для ORB и FAST).
+                - "bf": полный перебор OpenCV (L2 для SIFT, расстояние Хэмминга для ORB и FAST).
+                - "dense": скалярные произведения со всеми дескрипторами датасета.
+            - n_workers (int): количество процессов для извлечения дескрипторов (None - по
+            количеству ядер процессора). Процессы запускаются методом "spawn", поэтому код,
+            создающий объект, должен находиться под защитой if __name__ == "__main__".
+            - lazy (bool): не извлекать дескрипторы при создании объекта; извлечение
+            выполняется методом extract() или при первом поиске.
+            - memory_budget (int): допустимый объём дескрипторов в памяти в байтах. Если задан,
+            дескрипторы при создании объекта не извлекаются, а top_k сопоставляет изображения
+            блоками, дескрипторы которых умещаются в этот объём (см. pairwise.run_blocks).
 
         Methods:
-            - extract_features(dataset: Dataset): Извлекает дескрипторы из датасета
-            и помещает их в атрибуты датасета.
+            - extract(): Извлекает дескрипторы из обоих датасетов
+            и помещает их в атрибуты датасетов.
             - find_similar_image(target_image: Image, dataset: Dataset): ищет схожее
             изображение в датасете.
             - visualize_similar_images(target_image: Image, dataset: Dataset): ищет
             схожие изображения и визуализирует найденную пару.
+            - build_vocabulary(n_words, encoding): обучает визуальный словарь для быстрого
+            отбора кандидатов в find_similars(shortlist=...).
         """
 
         # = = = = = = = = = = = = = = = = = = = = = = = = = = = = = = = =
@@ -49,35 +91,54 @@ class FeatureExtractor(object):
             "fast": cv2.FastFeatureDetector_create(),
         }
 
-        self.desc_arr_shapes = {
-            "sift": (10000000, 128),
-            "orb": (10000000, 32),
-            "fast": (10000000, 32),
+        self.descriptor_sizes = {
+            "sift": 128,
+            "orb": 32,
+            "fast": 32,
+        }
+
+        # SIFT хранится нормализованным во float32, бинарные дескрипторы ORB - в исходном uint8
+        self.descriptor_dtypes = {
+            "sift": np.float32,
+            "orb": np.uint8,
+            "fast": np.uint8,
         }
 
-        self.desc_arr_shape = self.desc_arr_shapes[extractor]
+        self.descriptor_size = self.descriptor_sizes[extractor]
+        self.descriptor_dtype = self.descriptor_dtypes[extractor]
 
         self.extractor_name = extractor
         self.extractor = self.extractors[extractor]
 
+        self.cache = cache
+
+        if matcher not in ("auto", "flann", "bf", "dense"):
+            raise ValueError(f"Неизвестный способ сопоставления дескрипторов: {matcher}")
+
+        if matcher == "auto":
+            matcher = "bf" if self.descriptor_dtype == np.uint8 else "flann"
+
+        self.matcher = matcher
+
+        # Сопоставители дескрипторов, построенные один раз для каждого датасета
+        self._matchers: dict[int, cv2.DescriptorMatcher] = {}
+
+        # Визуальный словарь и глобальные сигнатуры изображений датасетов
+        self.vocabulary: VisualVocabulary = None
+        self._signatures: dict[int, object] = {}
+
         # = = = = = = = = = = = = = = = = = = = = = = = = = = = = = = = = = = = = = = =
 
-        self.dataset1 = dataset1
+        self.n_workers = n_workers or os.cpu_count() or 1
 
-        color_print("done", "done", "Извлечение дескрипторов")
-        color_print("status", "status", f"Датасет 1: {dataset1.name}")
-        self._extract_features_from_dataset(dataset1)
+        self.dataset1 = dataset1
+        self.dataset2 = dataset2 if dataset2.path != dataset1.path else dataset1
 
-        if dataset2.path != dataset1.path:
-            self.dataset2 = dataset2
-            print("\n")
-            color_print("status", "status", f"Датасет 2: {dataset2.name}")
-            self._extract_features_from_dataset(dataset2)
+        self.memory_budget = memory_budget
+        self.extracted = False
 
-        else:
-            self.dataset2 = dataset1
-            color_print("status", "status", f"Второй датасет дублирует первый.")
-            print("\n")
+        if not lazy and memory_budget is None:
+            self.extract()
 
         # = = = = = = = = = = = = = = = = = = = = = = = = = = = = = = = = = = = = = = =
 
@@ -88,169 +149,882 @@ class FeatureExtractor(object):
         elif self.extractor_name == "fast":
             self.fast_similars: Dict[Image, Image] = {}
 
-    def find_similars(self) -> Dict[Image, Image]:
+    def extract(self) -> None:
+        """
+        Извлекает дескрипторы из обоих датасетов (второй датасет пропускается,
+        если он совпадает с первым).
+        """
+
+        color_print("done", "done", "Извлечение дескрипторов")
+        color_print("status", "status", f"Датасет 1: {self.dataset1.name}")
+        self._extract_features_from_dataset(self.dataset1)
+
+        if self.dataset2 is not self.dataset1:
+            print("\n")
+            color_print("status", "status", f"Датасет 2: {self.dataset2.name}")
+            self._extract_features_from_dataset(self.dataset2)
+
+        else:
+            color_print("status", "status", f"Второй датасет дублирует первый.")
+            print("\n")
+
+        self._matchers = {}
+        self._signatures = {}
+        self.extracted = True
+
+    def find_similars(self, shortlist: int = None) -> Dict[Image, Image]:
         """
         Находит схожие изображения для каждого изображения из первого датасета во втором датасете
         и записывает их в словарь.
 
+        Parameters:
+            - shortlist (int): количество кандидатов, отбираемых по глобальным сигнатурам
+            визуального словаря (см. build_vocabulary). Сопоставление дескрипторов выполняется
+            только с кандидатами. По умолчанию - сопоставление со всем датасетом.
+
         Returns:
             - dict: Словарь, где ключи - объекты изображений из первого датасета,
             а значения - объекты изображений из второго датасета, являющиеся схожими.
         """
 
+        if not self.extracted:
+            self.extract()
+
         similars_dict: Dict[Image, Image] = {}
 
-        for image in self.dataset1.images:
-            similar_image = self._find_similar_image(image, self.dataset2)
-            similars_dict[image] = similar_image
+        if shortlist is not None:
+            if self.vocabulary is None:
+                self.build_vocabulary()
+
+            candidates = similarity_shortlist(
+                self._get_signatures(self.dataset1),
+                self._get_signatures(self.dataset2),
+                shortlist,
+                exclude_diagonal=self.dataset1 is self.dataset2,
+            )
+
+            with stage("compare"):
+                for image, image_candidates in zip(self.dataset1.images, candidates):
+                    similars_dict[image] = self._rerank(
+                        image, self.dataset1, self.dataset2, image_candidates
+                    )
+
+            count("pairs", sum(len(image_candidates) for image_candidates in candidates))
+
+        else:
+            with stage("compare"):
+                for image in self.dataset1.images:
+                    similar_image = self._find_similar_image(image, self.dataset2)
+                    similars_dict[image] = similar_image
+
+            count("pairs", self.dataset1.image_count * self.dataset2.image_count)
 
         setattr(self, self.extractor_name + "_similars", similars_dict)
 
         return similars_dict
 
-    def _extract_features_from_image(self, image: Image) -> np.ndarray:
-        img = image._read_image_as_rgb()
-        img_gray = cv2.cvtColor(img, cv2.COLOR_RGB2GRAY)
-        kp = self.extractor.detect(img_gray, None)
+    def match_pairs(self, pairs: np.ndarray) -> np.ndarray:
+        """
+        Сопоставляет дескрипторы только для указанных пар изображений (например, пар-кандидатов,
+        найденных хэшами и метриками). Если дескрипторы датасетов ещё не извлечены,
+        они вычисляются только для изображений из пар.
 
-        if self.extractor_name != "fast":
-            kp, descriptors = self.extractor.compute(img_gray, kp)
+        Parameters:
+            - pairs (np.ndarray): массив размера (кол-во пар, 2) с индексами изображений
+            первого и второго датасетов.
+
+        Returns:
+            - np.ndarray: доля дескрипторов изображения первого датасета, для которых
+            во втором изображении пары нашлось "хорошее" совпадение (от 0 до 1).
+        """
+
+        pairs = np.asarray(pairs, dtype=np.int64).reshape(-1, 2)
+
+        descriptors1 = self._pair_descriptors(self.dataset1, np.unique(pairs[:, 0]))
+        descriptors2 = self._pair_descriptors(self.dataset2, np.unique(pairs[:, 1]))
+
+        matcher = self._pair_matcher()
+        scores = np.zeros(len(pairs), dtype=np.float64)
+
+        with stage("compare"):
+            for k, (i, j) in enumerate(pairs.tolist()):
+                scores[k] = self._match_score(matcher, descriptors1[i], descriptors2[j])
+
+        count("pairs", len(pairs))
+
+        return scores
+
+    def top_k(
+        self,
+        k: int = 5,
+        threshold: float = None,
+        shortlist: int = None,
+        tile_size: int = 32,
+    ) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """
+        Находит для каждого изображения первого датасета k наиболее похожих изображений
+        второго датасета по доле "хороших" совпадений дескрипторов (см. match_pairs).
+        Пары сопоставляются по тайлам, и после каждого тайла остаются только k лучших
+        совпадений для каждого изображения.
+
+        Parameters:
+            - k (int): количество наиболее похожих изображений.
+            - threshold (float): минимальная доля совпавших дескрипторов (от 0 до 1).
+            - shortlist (int): количество кандидатов, отбираемых по глобальным сигнатурам
+            визуального словаря (см. build_vocabulary). По умолчанию - все пары изображений.
+            - tile_size (int): размер стороны тайла матрицы пар.
+
+        Returns:
+            - tuple[np.ndarray, np.ndarray, np.ndarray]: индексы изображений первого датасета,
+            индексы найденных изображений второго датасета и доли совпадений, от наиболее
+            к наименее похожему для каждого изображения. При сравнении датасета с самим
+            собой изображение не считается совпадением с самим собой.
+        """
+
+        same = self.dataset1 is self.dataset2
+        n_rows, n_cols = self.dataset1.image_count, self.dataset2.image_count
+
+        if self.memory_budget is not None and shortlist is None:
+            top = TopK(n_rows, k, largest=True, threshold=threshold)
+
+            self._run_blocks(
+                lambda rows, cols, values: top.push(rows, cols, values, same),
+                tile_size,
+            )
+
+            return top.result()
+
+        if not self.extracted:
+            self.extract()
+
+        if shortlist is None:
+
+            def match_tile(rows: slice, cols: slice) -> np.ndarray:
+                pairs = np.stack(
+                    np.meshgrid(
+                        np.arange(rows.start, rows.stop),
+                        np.arange(cols.start, cols.stop),
+                        indexing="ij",
+                    ),
+                    axis=-1,
+                )
+
+                return self.match_pairs(pairs).reshape(pairs.shape[:2])
+
+            return run_top_k(
+                match_tile,
+                n_rows,
+                n_cols,
+                k,
+                tile_size,
+                n_workers=1,
+                largest=True,
+                threshold=threshold,
+                exclude_diagonal=same,
+            )
+
+        if self.vocabulary is None:
+            self.build_vocabulary()
+
+        candidates = similarity_shortlist(
+            self._get_signatures(self.dataset1),
+            self._get_signatures(self.dataset2),
+            shortlist,
+            exclude_diagonal=same,
+        )
+
+        top = TopK(n_rows, k, largest=True, threshold=threshold)
+
+        for start in range(0, n_rows, tile_size):
+            rows = slice(start, min(start + tile_size, n_rows))
+            block = candidates[rows]
+            queries = np.arange(rows.start, rows.stop)[:, None]
+            pairs = np.stack([np.broadcast_to(queries, block.shape), block], axis=-1)
+
+            top.push(rows, block, self.match_pairs(pairs).reshape(block.shape))
+
+        return top.result()
+
+    def _run_blocks(self, sink: object, tile_size: int = 32) -> int:
+        """
+        Сопоставляет все пары изображений блоками, дескрипторы которых умещаются
+        в memory_budget, и передаёт доли совпадений тайлов в sink. Если дескрипторы
+        не извлечены, они вычисляются (или читаются из кэша) при загрузке блока.
+
+        Returns:
+            - int: количество загрузок блоков.
+        """
+
+        if not self.dataset1.images or not self.dataset2.images:
+            return 0
+
+        def loader(dataset: Dataset):
+            def load(block: slice) -> list[np.ndarray]:
+                descriptors = self._pair_descriptors(
+                    dataset, np.arange(block.start, block.stop)
+                )
+
+                return [descriptors[i] for i in range(block.start, block.stop)]
+
+            return load
+
+        matcher = self._pair_matcher()
+
+        def prepare(first: list, second: list):
+            def match_tile(rows: slice, cols: slice) -> np.ndarray:
+                queries, trains = first[rows], second[cols]
+                scores = np.zeros((len(queries), len(trains)), dtype=np.float64)
+
+                for i, query in enumerate(queries):
+                    for j, train in enumerate(trains):
+                        scores[i, j] = self._match_score(matcher, query, train)
+
+                return scores
+
+            return match_tile
+
+        # Объём дескрипторов изображения оценивается по первому изображению
+        item_bytes = max(1, loader(self.dataset1)(slice(0, 1))[0].nbytes)
+
+        return run_blocks(
+            loader(self.dataset1),
+            loader(self.dataset2),
+            prepare,
+            self.dataset1.image_count,
+            self.dataset2.image_count,
+            item_bytes,
+            item_bytes,
+            self.memory_budget,
+            sink,
+            tile_size,
+            n_workers=1,
+        )
+
+    def _pair_matcher(self) -> cv2.DescriptorMatcher:
+        binary = self.descriptor_dtype == np.uint8
+
+        return cv2.BFMatcher(cv2.NORM_HAMMING if binary else cv2.NORM_L2)
+
+    def _match_score(
+        self, matcher: cv2.DescriptorMatcher, query: np.ndarray, train: np.ndarray
+    ) -> float:
+        """
+        Доля дескрипторов query, для которых в train нашлось "хорошее" совпадение.
+        """
+
+        if len(query) == 0 or len(train) == 0:
+            return 0.0
+
+        distances = np.array(
+            [match.distance for match in matcher.match(query, train)],
+            dtype=np.float64,
+        )
+
+        if self.descriptor_dtype == np.uint8:
+            good = distances <= _HAMMING_THRESHOLD
         else:
-            kp, descriptors = self.extractors["orb"].compute(img_gray, kp)
+            # Для единичных векторов скалярное произведение равно 1 - d² / 2
+            good = 1 - distances**2 / 2 > _SIMILARITY_THRESHOLD
+
+        return good.sum() / len(query)
+
+    def build_vocabulary(
+        self,
+        n_words: int = None,
+        encoding: str = "bovw",
+        sample_size: int = 100000,
+    ) -> VisualVocabulary:
+        """
+        Обучает визуальный словарь на дескрипторах второго датасета и кодирует оба
+        датасета в глобальные сигнатуры фиксированной длины.
+
+        Parameters:
+            - n_words (int): количество визуальных слов (по умолчанию 1024 для "bovw"
+            и 64 для "vlad").
+            - encoding (str): способ кодирования ("bovw" - TF-IDF гистограмма слов, "vlad" - VLAD).
+            - sample_size (int): максимальное количество дескрипторов для обучения словаря.
+
+        Returns:
+            - VisualVocabulary: обученный словарь.
+        """
+
+        if not self.extracted:
+            self.extract()
+
+        descriptors = getattr(self.dataset2, self.extractor_name + "_descriptors")
+        offsets = getattr(self.dataset2, self.extractor_name + "_descriptors_offsets")
+
+        self.vocabulary = VisualVocabulary(n_words, encoding, sample_size).fit(
+            descriptors, offsets
+        )
+        self._signatures = {}
+
+        return self.vocabulary
+
+    def _get_signatures(self, dataset: Dataset):
+        """
+        Возвращает глобальные сигнатуры изображений датасета, вычисляя их при первом вызове.
+        """
+
+        key = id(dataset)
+
+        if key not in self._signatures:
+            self._signatures[key] = self.vocabulary.encode(
+                getattr(dataset, self.extractor_name + "_descriptors"),
+                getattr(dataset, self.extractor_name + "_descriptors_offsets"),
+            )
+
+        return self._signatures[key]
+
+    def _rerank(
+        self,
+        target_image: Image,
+        target_dataset: Dataset,
+        dataset: Dataset,
+        candidates: np.ndarray,
+    ) -> Image:
+        """
+        Выбирает среди кандидатов изображение, наиболее похожее на целевое, по голосованию
+        сопоставленных дескрипторов (полный перебор только по дескрипторам кандидатов).
+        """
+
+        if candidates.size == 0:
+            return False
+
+        descriptors = getattr(dataset, self.extractor_name + "_descriptors")
+        offsets = getattr(dataset, self.extractor_name + "_descriptors_offsets")
+
+        target_offsets = getattr(
+            target_dataset, self.extractor_name + "_descriptors_offsets"
+        )
+        target_index = target_dataset.images.index(target_image)
+        target_descriptors = getattr(
+            target_dataset, self.extractor_name + "_descriptors"
+        )[target_offsets[target_index] : target_offsets[target_index + 1]]
+
+        candidate_descriptors = [
+            descriptors[offsets[candidate] : offsets[candidate + 1]]
+            for candidate in candidates
+        ]
+        candidate_offsets = np.zeros(len(candidates) + 1, dtype=np.int64)
+        np.cumsum([len(d) for d in candidate_descriptors], out=candidate_offsets[1:])
+
+        if target_descriptors.size == 0 or candidate_offsets[-1] == 0:
+            return dataset.images[candidates[0]]
+
+        binary = self.descriptor_dtype == np.uint8
+        matcher = cv2.BFMatcher(cv2.NORM_HAMMING if binary else cv2.NORM_L2)
+        matcher.add([np.concatenate(candidate_descriptors)])
+
+        labels, scores, good = self._knn_votes(
+            matcher, target_descriptors, candidate_offsets
+        )
+
+        if labels.size == 0:
+            return dataset.images[candidates[0]]
+
+        return dataset.images[candidates[_vote(labels, scores, good)]]
+
+    def _pair_descriptors(self, dataset: Dataset, indices: np.ndarray) -> dict:
+        """
+        Возвращает дескрипторы изображений датасета с указанными индексами: из извлечённого
+        хранилища датасета или, если извлечение не выполнялось, вычисляя их (с кэшем).
+        """
 
-        if descriptors is None:
-            return np.array(
-                []
-            )  # Возвращает пустой массив, если не удается получить дескрипторы
+        descriptors = {}
+
+        if self.extracted:
+            stored = getattr(dataset, self.extractor_name + "_descriptors")
+            offsets = getattr(dataset, self.extractor_name + "_descriptors_offsets")
+
+            for i in indices.tolist():
+                descriptors[i] = stored[offsets[i] : offsets[i + 1]]
+
+        else:
+            for i in indices.tolist():
+                descriptors[i] = self._image_descriptors(dataset.images[i])
+
+        if self.descriptor_dtype != np.uint8:
+            descriptors = {i: _normalize(value) for i, value in descriptors.items()}
 
         return descriptors
 
+    def _extract_features_from_image(self, image: Image) -> np.ndarray:
+        if self.extractor_name != "fast":
+            describer = self.extractor
+        else:
+            describer = self.extractors["orb"]
+
+        return _detect_and_compute(image, self.extractor, describer)
+
+    def _image_descriptors(self, image: Image) -> np.ndarray:
+        """
+        Возвращает дескрипторы изображения в формате хранения (нормализованные float32
+        для SIFT, исходные uint8 для ORB и FAST), используя кэш при его наличии.
+        """
+
+        def compute():
+            with stage("extract"):
+                return _to_storage(
+                    self._extract_features_from_image(image),
+                    self.descriptor_size,
+                    self.descriptor_dtype,
+                )
+
+        if self.cache is None:
+            return compute()
+
+        return self.cache.get_or_compute(image, *self._cache_key(), compute)
+
+    def _cache_key(self) -> tuple:
+        return (
+            f"descriptors/{self.extractor_name}",
+            {"dtype": np.dtype(self.descriptor_dtype).name, "decode": "reduced-jpeg"},
+        )
+
     def _extract_features_from_dataset(
         self, dataset: Dataset, echo: bool = True
-    ) -> tuple:
-        # Инициализация переменных для хранения дескрипторов и меток
-        descriptor_count = 0
-        descriptors_array = np.zeros(self.desc_arr_shape)
-        labels_array = np.zeros((10000000,))
+    ) -> None:
+        """
+        Извлекает дескрипторы всех изображений датасета и сохраняет их в атрибуты датасета
+        в формате CSR: общий массив дескрипторов и массив смещений, где дескрипторы
+        изображения i занимают строки offsets[i]:offsets[i + 1].
+
+        Изображения, отсутствующие в кэше, обрабатываются в пуле процессов, у каждого из
+        которых свой экземпляр детектора OpenCV; результаты возвращаются в исходном порядке.
+
+        Creates:
+            - <extractor>_descriptors (np.ndarray): дескрипторы всех изображений.
+            - <extractor>_descriptors_offsets (np.ndarray): смещения изображений (int64).
+        """
+
+        descriptors_list = [None] * len(dataset.images)
+
+        if self.cache is not None:
+            for i, image in enumerate(dataset.images):
+                descriptors_list[i] = self.cache.get(image, *self._cache_key())
 
-        for i, image in enumerate(dataset.images):
+        missing = [i for i, value in enumerate(descriptors_list) if value is None]
 
-            img = image._read_image_as_rgb()
-            img_gray = cv2.cvtColor(img, cv2.COLOR_RGB2GRAY)
+        # Время извлечения в пуле процессов учитывается целиком в этапе "extract"
+        with stage("extract"):
+            if self.n_workers > 1 and len(missing) > self.n_workers:
+                paths = [dataset.images[i].path for i in missing]
+                chunksize = max(1, len(paths) // (self.n_workers * 4))
 
-            kp = self.extractor.detect(img_gray, None)
+                with ProcessPoolExecutor(
+                    max_workers=self.n_workers,
+                    mp_context=multiprocessing.get_context("spawn"),
+                    initializer=_init_extraction_worker,
+                    initargs=(self.extractor_name,),
+                ) as executor:
+                    results = executor.map(
+                        _extract_in_worker, paths, chunksize=chunksize
+                    )
+
+                    for i, descriptors in zip(missing, results):
+                        descriptors_list[i] = descriptors
 
-            if self.extractor_name != "fast":
-                kp, descriptors = self.extractor.compute(img_gray, kp)
             else:
-                kp, descriptors = self.extractors["orb"].compute(img_gray, kp)
+                for i in missing:
+                    descriptors_list[i] = _to_storage(
+                        self._extract_features_from_image(dataset.images[i]),
+                        self.descriptor_size,
+                        self.descriptor_dtype,
+                    )
 
-            current_descriptors_count = descriptors.shape[0]
+        count("images_extracted", len(missing))
 
-            for desc in range(current_descriptors_count):
-                current_descriptor = descriptors[desc, :]
+        if self.cache is not None:
+            method, params = self._cache_key()
 
-                # Нормализация дескриптора и запись его в массив descriptors_array
-                descriptors_array[descriptor_count, :] = (
-                    current_descriptor / np.linalg.norm(current_descriptor)
-                )
+            for i in missing:
+                self.cache.put(dataset.images[i], method, descriptors_list[i], params)
 
-                # Присвоение метки i для текущего дескриптора в массиве labels_array
-                labels_array[descriptor_count] = i
-                descriptor_count += 1
+        offsets = np.zeros(len(descriptors_list) + 1, dtype=np.int64)
+        np.cumsum([len(descriptors) for descriptors in descriptors_list], out=offsets[1:])
 
-        # Обрезка массивов дескрипторов и меток до фактического размера
-        extracted_descriptors = descriptors_array[0:descriptor_count, :]
-        extracted_labels = labels_array[0:descriptor_count]
+        extracted_descriptors = np.concatenate(
+            [np.empty((0, self.descriptor_size), dtype=self.descriptor_dtype)]
+            + descriptors_list
+        )
 
         if echo:
             color_print(
                 "done",
                 "done",
-                f"Количество дескрипторов в {str(dataset.image_count)} изображениях: {str(descriptor_count)}",
+                f"Количество дескрипторов в {str(dataset.image_count)} изображениях: {str(offsets[-1])}",
             )
 
         setattr(dataset, self.extractor_name + "_descriptors", extracted_descriptors)
-        setattr(dataset, self.extractor_name + "_descriptors_labels", extracted_labels)
+        setattr(dataset, self.extractor_name + "_descriptors_offsets", offsets)
 
     def _find_similar_image(self, target_image: Image, dataset: Dataset) -> Image:
         descriptors = getattr(dataset, self.extractor_name + "_descriptors")
-        descriptors_labels = getattr(
-            dataset, self.extractor_name + "_descriptors_labels"
-        )
+        offsets = getattr(dataset, self.extractor_name + "_descriptors_offsets")
 
         try:
             # Попробуем найти индекс целевого изображения в датасете
             target_image_index = dataset.images.index(target_image)
 
-            # Индексы дескрипторов из того же изображения
-            same_class_indices = np.where(descriptors_labels == target_image_index)[0]
-
-            # Индексы дескрипторов из других изображений
-            different_class_indices = np.where(
-                descriptors_labels != target_image_index
-            )[0]
-
             # Дескрипторы целевого изображения
-            target_descriptors = descriptors[same_class_indices, :]
+            target_descriptors = descriptors[
+                offsets[target_image_index] : offsets[target_image_index + 1]
+            ]
 
         except ValueError:
             # Если целевого изображения нет в датасете
-            target_descriptors = self._extract_features_from_image(target_image)
+            target_image_index = None
+            target_descriptors = self._image_descriptors(target_image)
 
-            if target_descriptors is None or target_descriptors.size == 0:
-                color_print(
-                    "fail",
-                    "fail",
-                    "Не удалось извлечь дескрипторы из целевого изображения.",
-                )
-                return False
+        if target_descriptors.size == 0 or descriptors.size == 0:
+            color_print(
+                "fail",
+                "fail",
+                "Не удалось извлечь дескрипторы из целевого изображения.",
+            )
+            return False
 
-            different_class_indices = np.arange(len(descriptors_labels))
+        if self.matcher == "dense":
+            labels, scores, good = self._match_dense(
+                target_descriptors, descriptors, offsets, target_image_index
+            )
+        else:
+            labels, scores, good = self._match_knn(
+                target_descriptors, dataset, offsets, target_image_index
+            )
 
-        # Дескрипторы других изображений
-        other_descriptors = descriptors[different_class_indices, :]
-        other_labels = descriptors_labels[different_class_indices]
+        if labels.size == 0:
+            return False
 
-        # Вычисление попарного скалярного произведения между дескрипторами целевого и других изображений
-        dot_products = np.dot(other_descriptors, target_descriptors.T)
+        return dataset.images[_vote(labels, scores, good)]
+
+    def _match_dense(
+        self,
+        target_descriptors: np.ndarray,
+        descriptors: np.ndarray,
+        offsets: np.ndarray,
+        target_image_index: int = None,
+    ) -> tuple:
+        """
+        Для каждого дескриптора цели находит дескриптор датасета с максимальным
+        скалярным произведением (кроме дескрипторов самого целевого изображения).
+
+        Returns:
+            - tuple: (метки изображений, сходство, маска хороших совпадений).
+        """
+
+        target_descriptors = _normalize(target_descriptors)
+
+        if target_image_index is None:
+            target_start = target_end = 0
+        else:
+            target_start = offsets[target_image_index]
+            target_end = offsets[target_image_index + 1]
 
         # Количество дескрипторов целевого изображения
         num_test_descriptors = target_descriptors.shape[0]
 
-        # Массивы для хранения максимальных значений скалярного произведения и меток изображений
-        max_dot_products = np.zeros((num_test_descriptors,))
-        corresponding_labels = []
+        # Максимальные значения скалярного произведения и индексы соответствующих дескрипторов
+        max_dot_products = np.full((num_test_descriptors,), -np.inf)
+        max_indices = np.zeros((num_test_descriptors,), dtype=np.int64)
+
+        # Скалярные произведения считаются блоками дескрипторов датасета,
+        # чтобы не создавать матрицу размера (все дескрипторы, дескрипторы цели)
+        for start in range(0, len(descriptors), _DESCRIPTORS_BLOCK):
+            end = min(start + _DESCRIPTORS_BLOCK, len(descriptors))
+
+            block = descriptors[start:end]
+            if block.dtype == np.uint8:
+                block = _normalize(block)
+
+            dot_products = block @ target_descriptors.T
+
+            # Дескрипторы того же изображения не учитываются
+            own_start, own_end = max(target_start, start), min(target_end, end)
+            if own_start < own_end:
+                dot_products[own_start - start : own_end - start] = -np.inf
 
-        # Выбор наиболее похожего изображения на основе скалярного произведения
-        for k in range(num_test_descriptors):
-            dot_product_values = dot_products[:, k]
-            max_value = dot_product_values.max()
-            max_dot_products[k] = max_value
-            max_index = np.where(dot_product_values == max_value)
-            corresponding_labels.extend(other_labels[max_index[0]])
+            block_indices = np.argmax(dot_products, axis=0)
+            block_max = dot_products[block_indices, np.arange(num_test_descriptors)]
 
-        # Преобразование corresponding_labels в одномерный массив
-        corresponding_labels = np.array(corresponding_labels, dtype=int)
+            better = block_max > max_dot_products
+            max_dot_products[better] = block_max[better]
+            max_indices[better] = block_indices[better] + start
 
-        # Определение наиболее часто встречающейся метки среди изображений с высокой похожестью
-        high_similarity_indices = np.where(max_dot_products > 0.9)[0]
+        # Метки изображений, которым принадлежат наиболее похожие дескрипторы
+        valid = np.isfinite(max_dot_products)
+        labels = np.searchsorted(offsets, max_indices[valid], side="right") - 1
+        scores = max_dot_products[valid]
 
-        if high_similarity_indices.size > 0:
-            most_common_label = stats.mode(
-                corresponding_labels[high_similarity_indices]
+        return labels, scores, scores > _SIMILARITY_THRESHOLD
+
+    def _match_knn(
+        self,
+        target_descriptors: np.ndarray,
+        dataset: Dataset,
+        offsets: np.ndarray,
+        target_image_index: int = None,
+    ) -> tuple:
+        """
+        Для каждого дескриптора цели находит ближайший дескриптор датасета с помощью
+        сопоставителя OpenCV. Если целевое изображение входит в датасет, его дескрипторы
+        исключаются из поиска: для "bf" сопоставитель строится по остальным дескрипторам
+        датасета, а индекс "flann" (строится один раз для датасета) повторно опрашивается
+        с k больше количества дескрипторов цели для тех дескрипторов, все найденные
+        соседи которых принадлежат самой цели.
+
+        Returns:
+            - tuple: (метки изображений, сходство, маска хороших совпадений).
+        """
+
+        if target_image_index is None:
+            return self._knn_votes(
+                self._get_matcher(dataset), target_descriptors, offsets
             )
 
-            if isinstance(most_common_label.mode, np.ndarray):
-                most_similar_index = int(most_common_label.mode[0])
+        if self.matcher == "bf":
+            descriptors = getattr(dataset, self.extractor_name + "_descriptors")
+            start = offsets[target_image_index]
+            end = offsets[target_image_index + 1]
+
+            # Дескрипторы до и после целевого изображения (без копирования)
+            parts = [
+                (part_start, part)
+                for part_start, part in (
+                    (0, descriptors[:start]),
+                    (end, descriptors[end:]),
+                )
+                if len(part) > 0
+            ]
+
+            if not parts:
+                return _no_matches()
 
-            else:
-                most_similar_index = int(most_common_label.mode)
+            binary = self.descriptor_dtype == np.uint8
+            matcher = cv2.BFMatcher(cv2.NORM_HAMMING if binary else cv2.NORM_L2)
+            matcher.add([part for _, part in parts])
+
+            return self._knn_votes(
+                matcher,
+                target_descriptors,
+                offsets,
+                train_starts=[part_start for part_start, _ in parts],
+            )
 
+        return self._knn_votes(
+            self._get_matcher(dataset), target_descriptors, offsets, target_image_index
+        )
+
+    def _knn_votes(
+        self,
+        matcher: cv2.DescriptorMatcher,
+        target_descriptors: np.ndarray,
+        offsets: np.ndarray,
+        target_image_index: int = None,
+        train_starts: list[int] = (0,),
+    ) -> tuple:
+        """
+        Сопоставляет дескрипторы цели с обученным сопоставителем и переводит найденных
+        соседей в метки изображений. Если указан target_image_index, берётся ближайший
+        сосед из другого изображения: сначала среди 3 ближайших, а для дескрипторов,
+        у которых их нет, - среди (кол-во дескрипторов цели + 1) ближайших, среди которых
+        обязательно есть дескриптор другого изображения.
+
+        Parameters:
+            - train_starts (list[int]): смещения обучающих наборов сопоставителя
+            в дескрипторах датасета (для сопоставителя из нескольких частей датасета).
+
+        Returns:
+            - tuple: (метки изображений, сходство, маска хороших совпадений).
+        """
+
+        binary = self.descriptor_dtype == np.uint8
+        query = target_descriptors if binary else _normalize(target_descriptors)
+
+        nearest = np.full(len(query), -1, dtype=np.int64)
+        distances = np.zeros(len(query), dtype=np.float64)
+
+        if target_image_index is None:
+            own_start = own_end = 0
         else:
-            most_similar_index = corresponding_labels[np.argmax(max_dot_products)]
+            own_start = offsets[target_image_index]
+            own_end = offsets[target_image_index + 1]
+
+        pending = np.arange(len(query))
+        k = 1 if own_end == own_start else 3
+
+        while pending.size > 0:
+            for row, matches in zip(pending, matcher.knnMatch(query[pending], k=k)):
+                for match in matches:
+                    index = train_starts[match.imgIdx] + match.trainIdx
+
+                    if not own_start <= index < own_end:
+                        nearest[row] = index
+                        distances[row] = match.distance
+                        break
+
+            if k > own_end - own_start:
+                break
+
+            pending = pending[nearest[pending] < 0]
+            k = own_end - own_start + 1
+
+        found = nearest >= 0
+        labels = np.searchsorted(offsets, nearest[found], side="right") - 1
+        distances = distances[found]
+
+        if binary:
+            return labels, -distances, distances <= _HAMMING_THRESHOLD
+
+        # Для единичных векторов скалярное произведение равно 1 - d² / 2
+        scores = 1 - distances**2 / 2
+
+        return labels, scores, scores > _SIMILARITY_THRESHOLD
+
+    def _get_matcher(self, dataset: Dataset) -> cv2.DescriptorMatcher:
+        """
+        Возвращает сопоставитель дескрипторов датасета, создавая и обучая его при первом вызове.
+        """
+
+        key = id(dataset)
+
+        if key not in self._matchers:
+            descriptors = getattr(dataset, self.extractor_name + "_descriptors")
+            binary = self.descriptor_dtype == np.uint8
+
+            if self.matcher == "flann":
+                if binary:
+                    index_params = dict(
+                        algorithm=6, table_number=6, key_size=12, multi_probe_level=1
+                    )
+                else:
+                    index_params = dict(algorithm=1, trees=5)
+
+                matcher = cv2.FlannBasedMatcher(index_params, dict(checks=50))
+            else:
+                matcher = cv2.BFMatcher(cv2.NORM_HAMMING if binary else cv2.NORM_L2)
+
+            matcher.add([descriptors])
+            matcher.train()
+
+            self._matchers[key] = matcher
+
+        return self._matchers[key]
+
+
+# ==================================================================================================================================
+
+
+# Состояние процесса-обработчика: собственные экземпляры детектора и дескриптора OpenCV.
+_worker_state: dict = {}
+
+
+def _create_extractors(extractor_name: str) -> tuple:
+    """
+    Создаёт детектор ключевых точек и вычислитель дескрипторов для метода extractor_name.
+    """
+
+    if extractor_name == "sift":
+        detector = cv2.SIFT_create()
+        return detector, detector
+
+    if extractor_name == "orb":
+        detector = cv2.ORB_create()
+        return detector, detector
+
+    return cv2.FastFeatureDetector_create(), cv2.ORB_create()
+
+
+def _init_extraction_worker(extractor_name: str) -> None:
+    # Каждый процесс использует одно ядро, параллелизм обеспечивается пулом
+    cv2.setNumThreads(1)
+
+    detector, describer = _create_extractors(extractor_name)
+
+    _worker_state["detector"] = detector
+    _worker_state["describer"] = describer
+    _worker_state["size"] = 128 if extractor_name == "sift" else 32
+    _worker_state["dtype"] = np.float32 if extractor_name == "sift" else np.uint8
+
+
+def _extract_in_worker(image_path: str) -> np.ndarray:
+    descriptors = _detect_and_compute(
+        Image(image_path), _worker_state["detector"], _worker_state["describer"]
+    )
+
+    return _to_storage(descriptors, _worker_state["size"], _worker_state["dtype"])
+
+
+def _detect_and_compute(image: Image, detector: object, describer: object) -> np.ndarray:
+    """
+    Находит ключевые точки изображения и вычисляет их дескрипторы.
+    """
+
+    img = image._read_image_as_rgb()
+    img_gray = cv2.cvtColor(img, cv2.COLOR_RGB2GRAY)
+    kp = detector.detect(img_gray, None)
+    kp, descriptors = describer.compute(img_gray, kp)
+
+    if descriptors is None:
+        return np.array(
+            []
+        )  # Возвращает пустой массив, если не удается получить дескрипторы
+
+    return descriptors
+
+
+def _to_storage(descriptors: np.ndarray, size: int, dtype: object) -> np.ndarray:
+    """
+    Приводит дескрипторы к формату хранения: uint8 для бинарных, нормализованные float32 для SIFT.
+    """
+
+    descriptors = descriptors.reshape(-1, size)
+
+    if dtype == np.uint8:
+        return descriptors.astype(np.uint8, copy=False)
+
+    return _normalize(descriptors)
+
+
+def _no_matches() -> tuple:
+    """
+    Пустой результат сопоставления: (метки изображений, сходство, маска хороших совпадений).
+    """
+
+    return (
+        np.empty(0, dtype=np.int64),
+        np.empty(0, dtype=np.float64),
+        np.empty(0, dtype=bool),
+    )
+
+
+def _vote(labels: np.ndarray, scores: np.ndarray, good: np.ndarray) -> int:
+    """
+    Определяет наиболее часто встречающуюся метку среди хороших совпадений,
+    а при их отсутствии - метку совпадения с максимальным сходством.
+    """
+
+    if good.any():
+        most_common_label = stats.mode(labels[good])
+
+        if isinstance(most_common_label.mode, np.ndarray):
+            return int(most_common_label.mode[0])
+
+        return int(most_common_label.mode)
+
+    return int(labels[np.argmax(scores)])
+
+
+def _normalize(descriptors: np.ndarray) -> np.ndarray:
+    """
+    Приводит дескрипторы к единичной длине (float32).
+    """
+
+    descriptors = descriptors.astype(np.float32)
+    descriptors /= np.linalg.norm(descriptors, axis=1, keepdims=True)
 
-        return dataset.images[most_similar_index]
+    return descriptors
 
 
 # ==================================================================================================================================
@@ -1,11 +1,51 @@
+import os
+import math
+import time
+
 import cv2
+import numpy as np
 import pandas as pd
 
-from visdatcompy.image_handler import Dataset
+from visdatcompy.cache import FeatureCache
+from visdatcompy.checkpoint import Checkpoint
+from visdatcompy.image_handler import Image, Dataset
+from visdatcompy.instrumentation import stage
+from visdatcompy.pairwise import (
+    TopK,
+    iter_tiles,
+    run_tiles,
+    run_top_k,
+    run_blocks,
+    is_self_comparison,
+)
+from visdatcompy.results import allocate_matrix, save_matrix, RESULT_FORMATS
 from visdatcompy.utils import color_print
 
 
-__all__ = ["Hash"]
+__all__ = ["Hash", "HashIndex", "compare_hashes"]
+
+# Хэши, сравниваемые по расстоянию Хэмминга (упакованные биты в uint8).
+BINARY_METHODS = {"average", "p", "marr_hildreth", "block_mean"}
+
+# Таблица количества единичных бит для каждого значения байта.
+_POPCOUNT = np.array([bin(i).count("1") for i in range(256)], dtype=np.uint8)
+
+# Размер, до которого алгоритмы хэширования уменьшают изображение (None - исходный размер).
+# Изображения декодируются в уменьшенном разрешении, но не меньше этого размера.
+_HASH_INPUT_SIZES = {
+    "average": 8,
+    "p": 32,
+    "marr_hildreth": 512,
+    "radial_variance": None,
+    "block_mean": 256,
+    "color_moment": 512,
+}
+
+# Ограничение на размер промежуточного массива при попарном сравнении (в байтах).
+_TILE_BYTES = 64 * 1024 * 1024
+
+# Размер тайла матрицы расстояний при поблочном сравнении хэшей.
+_TILE_SIZE = 1024
 
 # ==================================================================================================================================
 # |                                                               HASH                                                             |
@@ -19,10 +59,36 @@ class Hash(object):
     Parameters:
         - Dataset1: объект класса Dataset с первым датасетом.
         - Dataset2: объект класса Dataset со вторым датасетом.
-        - results_path: путь для сохранения файлов .csv с результатами.
+        - results_path: путь для сохранения файлов с результатами.
+        - cache: объект класса FeatureCache для хранения хэшей между запусками.
+        - memmap_path: директория для матриц расстояний, отображённых в память (np.memmap,
+        файлы <метод>_matrix.npy) - для матриц, не помещающихся в оперативную память.
+        - results_format: формат сохранения матриц ("csv", "npy", "npz", "parquet").
+        - memory_budget: допустимый объём хэшей в памяти в байтах. Если задан, матрица
+        и top_k вычисляются блоками изображений (см. pairwise.run_blocks), а хэши
+        датасетов целиком не хранятся.
+        - state_path: директория для сохранения промежуточных результатов: матрицы
+        расстояний find_similars и matrix сохраняются по тайлам в <state_path>/<метод>_...
+        (см. Checkpoint).
+        - resume: продолжить прерванные вычисления по сохранённому состоянию (готовые
+        тайлы не пересчитываются, если датасеты не изменились).
     """
 
-    def __init__(self, Dataset1: Dataset, Dataset2: Dataset, results_path: str = ""):
+    def __init__(
+        self,
+        Dataset1: Dataset,
+        Dataset2: Dataset,
+        results_path: str = "",
+        cache: FeatureCache = None,
+        memmap_path: str = None,
+        results_format: str = "csv",
+        memory_budget: int = None,
+        state_path: str = None,
+        resume: bool = False,
+    ):
+        if results_format not in RESULT_FORMATS:
+            raise ValueError(f"Неизвестный формат сохранения: {results_format}")
+
         self.methods = {
             "average": cv2.img_hash.AverageHash_create(),
             "p": cv2.img_hash.PHash_create(),
@@ -36,6 +102,15 @@ class Hash(object):
         self.Dataset2: Dataset = Dataset2
 
         self.results_path = results_path
+        self.cache = cache
+        self.memmap_path = memmap_path
+        self.results_format = results_format
+        self.memory_budget = memory_budget
+        self.state_path = state_path
+        self.resume = resume
+
+        # Кэш вычисленных хэшей: (метод, пути изображений) -> массив хэшей
+        self._hashes: dict[tuple, np.ndarray] = {}
 
     def find_similars(
         self,
@@ -53,7 +128,8 @@ class Hash(object):
             - echo (bool): логирование в консоль.
 
         Returns:
-            - pd.DataFrame: пары схожих изображений.
+            - pd.DataFrame: для каждого изображения первого датасета - ближайшее изображение
+            второго. Матрица расстояний целиком не хранится в памяти (см. top_k).
 
         compare_methods:
             - "average": Рассчитывает хэш-значение на основе среднего значения пикселей,
@@ -69,46 +145,51 @@ class Hash(object):
             представленного в той же статье, что и RadialVarianceHash.
         """
 
-        results = pd.DataFrame()
-
         try:
-            hash_function = self.methods[compare_method]
-
-            for first_image in self.Dataset1.images:
-                min_similarity = float("inf")
-                similar_image_name = ""
-
-                for second_image in self.Dataset2.images:
-                    if first_image.filename != second_image.filename:
-                        first_image_hash = hash_function.compute(first_image.read())
-                        second_image_hash = hash_function.compute(second_image.read())
-
-                        if echo:
-                            color_print(
-                                "log",
-                                "log",
-                                f"Сравнение [{first_image.filename} - {second_image.filename}]:",
-                            )
-
-                        similarity = hash_function.compare(
-                            first_image_hash, second_image_hash
-                        )
-
-                        if echo:
-                            color_print("none", "status", f"Хэш: {similarity}", False)
-
-                        if similarity < min_similarity:
-                            min_similarity = similarity
-                            similar_image_name = second_image.filename
+            started = time.perf_counter()
+            n1, n2 = self.Dataset1.image_count, self.Dataset2.image_count
+            checkpoint = self._checkpoint(f"{compare_method}_distances", np.float64)
+
+            if checkpoint is None:
+                # Ближайшее изображение ищется потоково (как в top_k), без матрицы N x M
+                query_idx, match_idx, _ = self.top_k(1, None, compare_method)
+            else:
+                # Сохраняемая матрица расстояний хранится на диске и просматривается по тайлам
+                distances = self._distances(compare_method, checkpoint=checkpoint)
+
+                symmetric = is_self_comparison(self.Dataset1, self.Dataset2)
+                top = TopK(n1, 1, largest=compare_method == "radial_variance")
+
+                for rows, cols in iter_tiles(n1, n2, _TILE_SIZE):
+                    top.push(rows, cols, distances[rows, cols], symmetric)
+
+                query_idx, match_idx, _ = top.result()
+
+            images1, images2 = self.Dataset1.images, self.Dataset2.images
+
+            # При сравнении датасета с самим собой изображение не считается схожим с собой
+            similars = {
+                images1[i].relpath: images2[j].relpath
+                for i, j in zip(query_idx.tolist(), match_idx.tolist())
+            }
+
+            if echo:
+                color_print(
+                    "log",
+                    "log",
+                    f"Сравнено пар изображений: {n1 * n2} за "
+                    f"{time.perf_counter() - started:.2f} с, найдено схожих изображений: {len(similars)}.",
+                )
 
-                        results.loc[first_image.filename, "similar_image_name"] = (
-                            similar_image_name
-                        )
+            results = pd.DataFrame.from_dict(
+                similars, orient="index", columns=["similar_image_name"]
+            )
 
             if to_csv:
-                results.to_csv(
-                    f"{self.results_path}/{compare_method}.csv", encoding="utf-8"
-                )
+                with stage("export"):
+                    results.to_csv(
+                        f"{self.results_path}/{compare_method}.csv", encoding="utf-8"
+                    )
 
             if return_df:
                 return results
@@ -129,11 +210,14 @@ class Hash(object):
 
         Parameters:
             - compare_method: метод сравнения.
-            - to_csv (bool): опция экспорта результатов в csv файл.
+            - return_df (bool): вернуть pd.DataFrame с названиями изображений
+            (иначе - матрицу np.ndarray типа float32).
+            - to_csv (bool): опция сохранения матрицы в файл (в формате results_format).
             - echo (bool): логирование в консоль.
 
         Returns:
-
+            - pd.DataFrame | np.ndarray: матрица расстояний между хэшами изображений
+            первого (строки) и второго (столбцы) датасетов.
 
         compare_methods:
             - "average": Рассчитывает хэш-значение на основе среднего значения пикселей,
@@ -149,41 +233,120 @@ class Hash(object):
             представленного в той же статье, что и RadialVarianceHash.
         """
 
-        results = pd.DataFrame()
-
         try:
-            hash_function = self.methods[compare_method]
+            checkpoint = self._checkpoint(f"{compare_method}_matrix", np.float32)
+            path = None
+
+            if self.memmap_path:
+                path = os.path.join(self.memmap_path, f"{compare_method}_matrix.npy")
+
+            distances = self._distances(
+                compare_method,
+                out=(
+                    checkpoint.matrix
+                    if checkpoint is not None
+                    else allocate_matrix(
+                        (self.Dataset1.image_count, self.Dataset2.image_count),
+                        np.float32,
+                        path,
+                    )
+                ),
+                checkpoint=checkpoint,
+            )
+
+            if echo:
+                color_print(
+                    "log",
+                    "log",
+                    f"Сравнено пар изображений: {distances.size}",
+                )
 
-            for first_image in self.Dataset1.images:
-                for second_image in self.Dataset2.images:
-                    first_image_hash = hash_function.compute(first_image.read())
-                    second_image_hash = hash_function.compute(second_image.read())
+            if to_csv:
+                save_matrix(
+                    f"{self.results_path}{compare_method}_matrix",
+                    distances,
+                    self.Dataset1.relpaths,
+                    self.Dataset2.relpaths,
+                    self.results_format,
+                )
 
-                    if echo:
-                        color_print(
-                            "log",
-                            "log",
-                            f"Сравнение [{first_image.filename} - {second_image.filename}]:",
-                        )
+            if return_df:
+                return pd.DataFrame(
+                    distances,
+                    index=self.Dataset1.relpaths,
+                    columns=self.Dataset2.relpaths,
+                    copy=False,
+                )
+            return distances
 
-                    similarity = hash_function.compare(
-                        first_image_hash, second_image_hash
-                    )
+        except Exception as e:
+            color_print("fail", "fail", f"Ошибка сравнения: {e}")
+
+    def find_within(
+        self,
+        compare_method: str = "average",
+        max_distance: float = 10,
+        return_df: bool = True,
+        to_csv: bool = False,
+        echo: bool = False,
+    ) -> pd.DataFrame:
+        """
+        Функция для нахождения всех пар изображений, расстояние между хэшами которых
+        не превышает max_distance. Поиск выполняется через HashIndex второго датасета
+        без полного перебора всех пар.
 
-                    if echo:
-                        color_print("none", "status", f"Хэш: {similarity}", False)
+        Parameters:
+            - compare_method (str): метод сравнения (кроме "radial_variance").
+            - max_distance (float): максимальное расстояние между хэшами.
+            - to_csv (bool): опция экспорта результатов в csv файл.
+            - echo (bool): логирование в консоль.
 
-                    if first_image.filename not in results:
-                        results[first_image.filename] = {}
+        Returns:
+            - pd.DataFrame: пары схожих изображений со столбцами
+            "image_name", "similar_image_name" и "distance". При сравнении датасета
+            с самим собой изображение не считается парой самому себе.
+        """
 
-                    results.loc[first_image.filename, second_image.filename] = (
-                        similarity
-                    )
+        try:
+            started = time.perf_counter()
+            index = HashIndex(self.Dataset2, compare_method, self)
+            hashes1 = self.compute(compare_method, self.Dataset1)
+
+            # При сравнении датасета с самим собой изображение не сравнивается с собой;
+            # изображения разных датасетов с одинаковыми именами сравниваются
+            symmetric = is_self_comparison(self.Dataset1, self.Dataset2)
+            images2 = self.Dataset2.images
+
+            rows = []
+
+            for i, (first_image, first_hash) in enumerate(
+                zip(self.Dataset1.images, hashes1)
+            ):
+                for j, distance in index.query_indices(first_hash, max_distance):
+                    if symmetric and i == j:
+                        continue
+
+                    rows.append((first_image.relpath, images2[j].relpath, distance))
+
+            if echo:
+                color_print(
+                    "log",
+                    "log",
+                    f"Найдено пар схожих изображений: {len(rows)} за "
+                    f"{time.perf_counter() - started:.2f} с.",
+                )
+
+            results = pd.DataFrame(
+                rows, columns=["image_name", "similar_image_name", "distance"]
+            )
 
             if to_csv:
-                results.to_csv(
-                    f"{self.results_path}{compare_method}_matrix.csv", encoding="utf-8"
-                )
+                with stage("export"):
+                    results.to_csv(
+                        f"{self.results_path}/{compare_method}_within.csv",
+                        encoding="utf-8",
+                        index=False,
+                    )
 
             if return_df:
                 return results
@@ -192,6 +355,537 @@ class Hash(object):
         except Exception as e:
             color_print("fail", "fail", f"Ошибка сравнения: {e}")
 
+    def top_k(
+        self,
+        k: int = 5,
+        threshold: float = None,
+        compare_method: str = "average",
+    ) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """
+        Находит для каждого изображения первого датасета k ближайших изображений второго
+        датасета. Матрица расстояний не хранится целиком: она вычисляется по тайлам,
+        и после каждого тайла остаются только k лучших совпадений для каждого изображения.
+
+        Parameters:
+            - k (int): количество ближайших изображений.
+            - threshold (float): максимальное расстояние между хэшами (для "radial_variance" -
+            минимальная корреляция).
+            - compare_method (str): метод сравнения (см. find_similars).
+
+        Returns:
+            - tuple[np.ndarray, np.ndarray, np.ndarray]: индексы изображений первого датасета,
+            индексы найденных изображений второго датасета и расстояния между их хэшами,
+            от ближайшего к дальнему для каждого изображения. При сравнении датасета
+            с самим собой изображение не считается совпадением с самим собой.
+        """
+
+        symmetric = is_self_comparison(self.Dataset1, self.Dataset2)
+
+        # Для "radial_variance" мерой сходства является корреляция
+        largest = compare_method == "radial_variance"
+
+        if self.memory_budget is not None:
+            top = TopK(self.Dataset1.image_count, k, largest, threshold)
+            self._run_blocks(
+                compare_method,
+                lambda rows, cols, values: top.push(rows, cols, values, symmetric),
+            )
+
+            return top.result()
+
+        hashes1 = self.compute(compare_method, self.Dataset1)
+        hashes2 = hashes1 if symmetric else self.compute(compare_method, self.Dataset2)
+
+        return run_top_k(
+            lambda rows, cols: compare_hashes(
+                hashes1[rows], hashes2[cols], compare_method
+            ),
+            len(hashes1),
+            len(hashes2),
+            k,
+            tile_size=_TILE_SIZE,
+            n_workers=1,
+            largest=largest,
+            threshold=threshold,
+            symmetric=symmetric,
+            exclude_diagonal=symmetric,
+        )
+
+    def compute(self, compare_method: str, dataset: Dataset) -> np.ndarray:
+        """
+        Вычисляет хэши всех изображений датасета, декодируя каждое изображение один раз.
+
+        Parameters:
+            - compare_method (str): метод хэширования.
+            - dataset (Dataset): датасет, для изображений которого вычисляются хэши.
+
+        Returns:
+            - np.ndarray: массив хэшей размера (кол-во изображений, длина хэша).
+            Для бинарных хэшей - упакованные биты в uint8, для "color_moment" - float64.
+        """
+
+        key = (compare_method, tuple(image.path for image in dataset.images))
+
+        if key not in self._hashes:
+            hash_function = self.methods[compare_method]
+            dtype = np.float64 if compare_method == "color_moment" else np.uint8
+
+            hashes = [
+                self._compute_image_hash(hash_function, compare_method, image)
+                for image in dataset.images
+            ]
+
+            self._hashes[key] = (
+                np.vstack(hashes).astype(dtype, copy=False)
+                if hashes
+                else np.empty((0, 0), dtype=dtype)
+            )
+
+        return self._hashes[key]
+
+    def _compute_image_hash(
+        self, hash_function: object, compare_method: str, image: Image
+    ) -> np.ndarray:
+        size = _HASH_INPUT_SIZES[compare_method]
+
+        def compute():
+            with stage("hash"):
+                if size is None:
+                    return hash_function.compute(image.read()).ravel()
+
+                return hash_function.compute(image.read_reduced(size, size)).ravel()
+
+        if self.cache is None:
+            return compute()
+
+        return self.cache.get_or_compute(
+            image, f"hash/{compare_method}", compute, {"decode": "reduced-jpeg"}
+        )
+
+    def _distances(
+        self,
+        compare_method: str,
+        out: np.ndarray = None,
+        checkpoint: Checkpoint = None,
+    ) -> np.ndarray:
+        """
+        Строит матрицу расстояний между хэшами первого и второго датасетов.
+
+        Parameters:
+            - compare_method (str): метод хэширования.
+            - out (np.ndarray): матрица для записи результата (например, np.memmap);
+            по умолчанию создаётся матрица float64.
+            - checkpoint (Checkpoint): состояние вычисления (результат записывается
+            в checkpoint.matrix, готовые тайлы пропускаются).
+
+        Returns:
+            - np.ndarray: матрица размера (кол-во изображений 1, кол-во изображений 2).
+        """
+
+        if checkpoint is not None:
+            out = checkpoint.matrix
+
+        if self.memory_budget is not None:
+            if out is None:
+                out = np.empty(
+                    (self.Dataset1.image_count, self.Dataset2.image_count),
+                    dtype=np.float64,
+                )
+
+            def store(rows: slice, cols: slice, values: np.ndarray) -> None:
+                out[rows, cols] = values
+
+            self._run_blocks(compare_method, store, checkpoint)
+
+            return out
+
+        hashes1 = self.compute(compare_method, self.Dataset1)
+        symmetric = is_self_comparison(self.Dataset1, self.Dataset2)
+        hashes2 = hashes1 if symmetric else self.compute(compare_method, self.Dataset2)
+
+        # Все меры сходства хэшей симметричны: при сравнении датасета с самим собой
+        # считается только верхний треугольник
+        return run_tiles(
+            lambda rows, cols: compare_hashes(
+                hashes1[rows], hashes2[cols], compare_method
+            ),
+            len(hashes1),
+            len(hashes2),
+            tile_size=_TILE_SIZE,
+            n_workers=1,
+            symmetric=symmetric,
+            out=out,
+            checkpoint=checkpoint,
+        )
+
+    def _checkpoint(self, name: str, dtype: object) -> Checkpoint:
+        """
+        Создаёт состояние вычисления матрицы расстояний (или None, если state_path не задан).
+        """
+
+        if self.state_path is None:
+            return None
+
+        fingerprint = {
+            "datasets": [self.Dataset1.fingerprint(), self.Dataset2.fingerprint()],
+            "name": name,
+            "tile_size": _TILE_SIZE,
+            "memory_budget": self.memory_budget,
+        }
+
+        return Checkpoint(
+            os.path.join(self.state_path, name),
+            (self.Dataset1.image_count, self.Dataset2.image_count),
+            dtype,
+            fingerprint,
+            self.resume,
+        )
+
+    def _run_blocks(
+        self, compare_method: str, sink: object, checkpoint: Checkpoint = None
+    ) -> int:
+        """
+        Вычисляет матрицу расстояний блоками изображений, хэши которых умещаются
+        в memory_budget, и передаёт значения тайлов в sink.
+
+        Parameters:
+            - compare_method (str): метод хэширования.
+            - sink (object): функция, принимающая срезы строк и столбцов и значения тайла.
+            - checkpoint (Checkpoint): состояние вычисления.
+
+        Returns:
+            - int: количество загрузок блоков.
+        """
+
+        images1, images2 = self.Dataset1.images, self.Dataset2.images
+
+        if not images1 or not images2:
+            return 0
+
+        hash_function = self.methods[compare_method]
+        dtype = np.float64 if compare_method == "color_moment" else np.uint8
+
+        def loader(images: list[Image]):
+            def load(block: slice) -> np.ndarray:
+                return np.vstack(
+                    [
+                        self._compute_image_hash(hash_function, compare_method, image)
+                        for image in images[block]
+                    ]
+                ).astype(dtype, copy=False)
+
+            return load
+
+        item_bytes = loader(images1)(slice(0, 1)).nbytes
+
+        return run_blocks(
+            loader(images1),
+            loader(images2),
+            lambda first, second: lambda rows, cols: compare_hashes(
+                first[rows], second[cols], compare_method
+            ),
+            len(images1),
+            len(images2),
+            item_bytes,
+            item_bytes,
+            self.memory_budget,
+            sink,
+            tile_size=_TILE_SIZE,
+            n_workers=1,
+            symmetric=is_self_comparison(self.Dataset1, self.Dataset2),
+            checkpoint=checkpoint,
+        )
+
+
+# ==================================================================================================================================
+
+
+class HashIndex(object):
+    """
+    Индекс для поиска близких изображений по перцептивным хэшам на основе BK-дерева.
+    Позволяет находить все изображения в заданном радиусе без полного перебора датасета.
+
+    Parameters:
+        - dataset (Dataset): датасет, по изображениям которого строится индекс.
+        - compare_method (str): метод хэширования (кроме "radial_variance",
+        так как его мера сходства не является метрикой).
+        - hasher (Hash): объект класса Hash, хэши которого используются повторно
+        (по умолчанию создаётся новый).
+
+    Attributes:
+        - dataset (Dataset): проиндексированный датасет.
+        - compare_method (str): метод хэширования.
+        - hashes (np.ndarray): хэши изображений датасета.
+    """
+
+    def __init__(
+        self, dataset: Dataset, compare_method: str = "average", hasher: Hash = None
+    ):
+        if compare_method == "radial_variance":
+            raise ValueError(
+                "Метод 'radial_variance' не поддерживается: его мера сходства не является метрикой."
+            )
+
+        self.dataset = dataset
+        self.compare_method = compare_method
+
+        self._hasher = hasher if hasher is not None else Hash(dataset, dataset)
+        self.hashes = self._hasher.compute(compare_method, dataset)
+
+        # Узлы BK-дерева: код хэша, индексы изображений с этим кодом и потомки,
+        # где ключ потомка - целая часть расстояния до узла
+        self._codes: list = []
+        self._items: list[list[int]] = []
+        self._children: list[dict[int, int]] = []
+
+        for i, image_hash in enumerate(self.hashes):
+            self._insert(self._to_code(image_hash), i)
+
+    def __len__(self) -> int:
+        return len(self.hashes)
+
+    def query(self, image: Image, max_distance: float) -> list[tuple[Image, float]]:
+        """
+        Находит все изображения индекса, расстояние до хэша которых не превышает max_distance.
+
+        Parameters:
+            - image (Image): объект изображения для поиска.
+            - max_distance (float): радиус поиска.
+
+        Returns:
+            - list[tuple[Image, float]]: пары (изображение, расстояние), отсортированные по расстоянию.
+        """
+
+        image_hash = self._hasher._compute_image_hash(
+            self._hasher.methods[self.compare_method], self.compare_method, image
+        )
+
+        return self.query_hash(image_hash, max_distance)
+
+    def query_hash(
+        self, image_hash: np.ndarray, max_distance: float
+    ) -> list[tuple[Image, float]]:
+        """
+        Находит все изображения индекса в радиусе max_distance от переданного хэша.
+
+        Parameters:
+            - image_hash (np.ndarray): хэш, вычисленный тем же методом, что и индекс.
+            - max_distance (float): радиус поиска.
+
+        Returns:
+            - list[tuple[Image, float]]: пары (изображение, расстояние), отсортированные по расстоянию.
+        """
+
+        images = self.dataset.images
+
+        return [
+            (images[i], distance)
+            for i, distance in self.query_indices(image_hash, max_distance)
+        ]
+
+    def query_indices(
+        self, image_hash: np.ndarray, max_distance: float
+    ) -> list[tuple[int, float]]:
+        """
+        Находит индексы изображений индекса в радиусе max_distance от переданного хэша.
+
+        Parameters:
+            - image_hash (np.ndarray): хэш, вычисленный тем же методом, что и индекс.
+            - max_distance (float): радиус поиска.
+
+        Returns:
+            - list[tuple[int, float]]: пары (индекс изображения в датасете, расстояние),
+            отсортированные по расстоянию.
+        """
+
+        matches = [
+            (i, distance)
+            for node, distance in self._search(self._to_code(image_hash), max_distance)
+            for i in self._items[node]
+        ]
+        matches.sort(key=lambda match: match[1])
+
+        return matches
+
+    def all_pairs_within(self, radius: float) -> list[tuple[Image, Image, float]]:
+        """
+        Находит все пары изображений индекса, расстояние между хэшами которых не превышает radius.
+
+        Parameters:
+            - radius (float): радиус поиска.
+
+        Returns:
+            - list[tuple[Image, Image, float]]: тройки (изображение, изображение, расстояние),
+            каждая пара встречается один раз.
+        """
+
+        images = self.dataset.images
+        pairs = []
+
+        for node, code in enumerate(self._codes):
+            items = self._items[node]
+
+            # Изображения с одинаковым хэшем
+            for a in range(len(items)):
+                for b in range(a + 1, len(items)):
+                    pairs.append((images[items[a]], images[items[b]], 0))
+
+            for other, distance in self._search(code, radius):
+                if other <= node:
+                    continue
+
+                for a in items:
+                    for b in self._items[other]:
+                        pairs.append((images[a], images[b], distance))
+
+        return pairs
+
+    def _to_code(self, image_hash: np.ndarray):
+        if self.compare_method in BINARY_METHODS:
+            return int.from_bytes(np.asarray(image_hash, dtype=np.uint8).tobytes())
+
+        return tuple(np.asarray(image_hash, dtype=np.float64).ravel().tolist())
+
+    def _distance(self, code1, code2) -> float:
+        if self.compare_method in BINARY_METHODS:
+            return (code1 ^ code2).bit_count()
+
+        return math.dist(code1, code2) * 10000
+
+    def _insert(self, code, item: int) -> None:
+        if not self._codes:
+            self._add_node(code, item)
+            return
+
+        node = 0
+
+        while True:
+            distance = self._distance(code, self._codes[node])
+
+            if distance == 0:
+                self._items[node].append(item)
+                return
+
+            key = int(distance)
+            child = self._children[node].get(key)
+
+            if child is None:
+                self._children[node][key] = self._add_node(code, item)
+                return
+
+            node = child
+
+    def _add_node(self, code, item: int) -> int:
+        self._codes.append(code)
+        self._items.append([item])
+        self._children.append({})
+
+        return len(self._codes) - 1
+
+    def _search(self, code, max_distance: float) -> list[tuple[int, float]]:
+        found = []
+
+        if not self._codes:
+            return found
+
+        stack = [0]
+
+        while stack:
+            node = stack.pop()
+            distance = self._distance(code, self._codes[node])
+
+            if distance <= max_distance:
+                found.append((node, distance))
+
+            # По неравенству треугольника искомые узлы лежат только в поддеревьях
+            # с ключами из диапазона [distance - max_distance, distance + max_distance]
+            lower = math.floor(distance - max_distance)
+            upper = math.floor(distance + max_distance)
+
+            for key, child in self._children[node].items():
+                if lower <= key <= upper:
+                    stack.append(child)
+
+        return found
+
+
+# ==================================================================================================================================
+
+
+def compare_hashes(
+    hashes1: np.ndarray, hashes2: np.ndarray, compare_method: str
+) -> np.ndarray:
+    """
+    Векторизованное попарное сравнение двух наборов хэшей. Значения совпадают
+    с результатом `compare` соответствующего алгоритма из cv2.img_hash.
+
+    Parameters:
+        - hashes1 (np.ndarray): хэши первого набора, размер (N, L).
+        - hashes2 (np.ndarray): хэши второго набора, размер (M, L).
+        - compare_method (str): метод хэширования.
+
+    Returns:
+        - np.ndarray: матрица расстояний (N, M) типа float64.
+
+    compare_methods:
+        - бинарные хэши: расстояние Хэмминга.
+        - "color_moment": евклидово расстояние (умноженное на 10000, как в OpenCV).
+        - "radial_variance": максимум взаимной корреляции по циклическим сдвигам.
+    """
+
+    n, m = len(hashes1), len(hashes2)
+    distances = np.empty((n, m), dtype=np.float64)
+
+    if n == 0 or m == 0:
+        return distances
+
+    if compare_method in BINARY_METHODS:
+        # Сравнение блоками строк, чтобы ограничить размер массива XOR (N, M, L)
+        step = max(1, _TILE_BYTES // (m * hashes1.shape[1]))
+
+        for start in range(0, n, step):
+            xor = np.bitwise_xor(hashes1[start : start + step, None, :], hashes2)
+            distances[start : start + step] = _POPCOUNT[xor].sum(
+                axis=2, dtype=np.int64
+            )
+
+    elif compare_method == "color_moment":
+        step = max(1, _TILE_BYTES // (8 * m * hashes1.shape[1]))
+
+        for start in range(0, n, step):
+            difference = hashes1[start : start + step, None, :] - hashes2
+            distances[start : start + step] = (
+                np.sqrt(np.einsum("ijk,ijk->ij", difference, difference)) * 10000
+            )
+
+    elif compare_method == "radial_variance":
+        length = hashes1.shape[1]
+
+        centered1 = hashes1 - hashes1.mean(axis=1, keepdims=True)
+        centered2 = hashes2 - hashes2.mean(axis=1, keepdims=True)
+
+        std1 = hashes1.std(axis=1)
+        std2 = hashes2.std(axis=1)
+
+        # Все циклические сдвиги второго набора: (M * L, L)
+        shifts = np.arange(length)
+        rolled = centered2[:, (np.arange(length)[None, :] - shifts[:, None]) % length]
+        rolled = rolled.reshape(m * length, length)
+
+        step = max(1, _TILE_BYTES // (8 * m * length))
+
+        for start in range(0, n, step):
+            block = centered1[start : start + step]
+            covariance = (block @ rolled.T).reshape(len(block), m, length) / length
+            distances[start : start + step] = covariance.max(axis=2) / (
+                std1[start : start + step, None] * std2[None, :] + 1e-20
+            )
+
+    else:
+        raise KeyError(compare_method)
+
+    return distances
+
 
 # ==================================================================================================================================
 
@@ -0,0 +1,202 @@
+import threading
+import numpy as np
+from typing import Callable, Hashable
+from collections import OrderedDict
+
+from visdatcompy.instrumentation import count
+
+
+__all__ = ["ImageCache", "set_cache", "get_cache"]
+
+
+# ==================================================================================================================================
+# |                                                           IMAGE CACHE                                                          |
+# ==================================================================================================================================
+
+
+class ImageCache(object):
+    """
+    Ограниченный по объёму памяти LRU-кэш декодированных изображений и производных
+    от них массивов (BGR, RGB 512 px, уменьшенная копия и т.д.) в пределах процесса.
+
+    Массивы хранятся в режиме только для чтения, поэтому одна и та же копия может
+    безопасно использоваться несколькими движками и потоками.
+
+    Parameters:
+        - max_bytes (int): максимальный суммарный объём массивов в кэше в байтах.
+
+    Attributes:
+        - max_bytes (int): максимальный объём кэша.
+        - current_bytes (int): текущий объём массивов в кэше.
+        - hits (int): количество найденных в кэше массивов.
+        - misses (int): количество вычисленных заново массивов.
+        - evictions (int): количество вытесненных из кэша массивов.
+    """
+
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self.current_bytes = 0
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+        self._entries: OrderedDict = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: Hashable) -> np.ndarray:
+        """
+        Возвращает массив по ключу или None, если его нет в кэше.
+
+        Parameters:
+            - key (Hashable): ключ записи, например (путь к файлу, форма массива).
+
+        Returns:
+            - np.ndarray: массив из кэша или None.
+        """
+
+        with self._lock:
+            value = self._entries.get(key)
+
+            if value is None:
+                self.misses += 1
+            else:
+                self._entries.move_to_end(key)
+                self.hits += 1
+
+        count("image_cache_hits" if value is not None else "image_cache_misses")
+
+        return value
+
+    def put(self, key: Hashable, value: np.ndarray) -> np.ndarray:
+        """
+        Сохраняет массив в кэш, вытесняя давно не использованные записи.
+        Массивы больше max_bytes не сохраняются.
+
+        Parameters:
+            - key (Hashable): ключ записи.
+            - value (np.ndarray): сохраняемый массив.
+
+        Returns:
+            - np.ndarray: сохранённый массив (только для чтения).
+        """
+
+        value.setflags(write=False)
+
+        if value.nbytes > self.max_bytes:
+            return value
+
+        with self._lock:
+            previous = self._entries.pop(key, None)
+
+            if previous is not None:
+                self.current_bytes -= previous.nbytes
+
+            self._entries[key] = value
+            self.current_bytes += value.nbytes
+
+            while self.current_bytes > self.max_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self.current_bytes -= evicted.nbytes
+                self.evictions += 1
+
+        return value
+
+    def get_or_compute(
+        self, key: Hashable, compute: Callable[[], np.ndarray]
+    ) -> np.ndarray:
+        """
+        Возвращает массив из кэша, а при его отсутствии вычисляет и сохраняет.
+
+        Parameters:
+            - key (Hashable): ключ записи.
+            - compute (Callable): функция без аргументов, вычисляющая массив.
+
+        Returns:
+            - np.ndarray: массив (только для чтения).
+        """
+
+        value = self.get(key)
+
+        if value is not None:
+            return value
+
+        value = compute()
+
+        if value is None:
+            return None
+
+        return self.put(key, value)
+
+    def invalidate(self, path: str = None) -> None:
+        """
+        Удаляет из кэша все массивы изображения (или все записи, если путь не указан).
+
+        Parameters:
+            - path (str): путь к файлу изображения.
+        """
+
+        with self._lock:
+            if path is None:
+                self._entries.clear()
+                self.current_bytes = 0
+                return
+
+            for key in [key for key in self._entries if key[0] == path]:
+                self.current_bytes -= self._entries.pop(key).nbytes
+
+    def stats(self) -> dict:
+        """
+        Возвращает статистику использования кэша.
+
+        Returns:
+            - dict: количество попаданий, промахов, вытеснений, записей и занятый объём.
+        """
+
+        with self._lock:
+            requests = self.hits + self.misses
+
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / requests if requests else 0.0,
+                "evictions": self.evictions,
+                "entries": len(self._entries),
+                "current_bytes": self.current_bytes,
+                "max_bytes": self.max_bytes,
+            }
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+
+# ==================================================================================================================================
+
+
+_image_cache: ImageCache = None
+
+
+def set_cache(max_bytes: int = 1 << 30) -> ImageCache:
+    """
+    Включает кэш декодированных изображений для всего процесса (или выключает его при max_bytes=0).
+
+    Parameters:
+        - max_bytes (int): максимальный объём кэша в байтах (по умолчанию 1 ГБ).
+
+    Returns:
+        - ImageCache: созданный кэш или None, если кэш выключен.
+    """
+
+    global _image_cache
+
+    _image_cache = ImageCache(max_bytes) if max_bytes else None
+
+    return _image_cache
+
+
+def get_cache() -> ImageCache:
+    """
+    Возвращает текущий кэш декодированных изображений или None, если он выключен.
+    """
+
+    return _image_cache
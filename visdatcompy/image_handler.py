@@ -1,14 +1,87 @@
 import os
 import cv2
+import fnmatch
+import hashlib
 import numpy as np
 import pandas as pd
-from PIL.ExifTags import TAGS
-from PIL import Image as PIL_Image
-
-from visdatcompy.utils import color_print
-
-
-__all__ = ["Image", "Dataset"]
+from PIL.ExifTags import TAGS, IFD
+from PIL.TiffImagePlugin import IFDRational
+from PIL import Image as PIL_Image, ImageOps
+
+from typing import Iterator
+from concurrent.futures import ThreadPoolExecutor
+
+from visdatcompy.utils import color_print, walk_files, file_digest
+from visdatcompy.image_cache import get_cache
+from visdatcompy.instrumentation import get_stats, stage
+
+
+__all__ = [
+    "Image",
+    "Dataset",
+    "discover_images",
+    "IMAGE_EXTENSIONS",
+    "EXIF_IGNORED_TAGS",
+]
+
+
+# Расширения файлов, которые может прочитать cv2.imread
+IMAGE_EXTENSIONS = frozenset(
+    {
+        ".bmp",
+        ".dib",
+        ".jpg",
+        ".jpeg",
+        ".jpe",
+        ".jp2",
+        ".png",
+        ".webp",
+        ".avif",
+        ".pbm",
+        ".pgm",
+        ".ppm",
+        ".pxm",
+        ".pnm",
+        ".pfm",
+        ".sr",
+        ".ras",
+        ".tif",
+        ".tiff",
+        ".exr",
+        ".hdr",
+        ".pic",
+    }
+)
+
+# Теги метаданных, не учитываемые при сравнении изображений по EXIF
+EXIF_IGNORED_TAGS = frozenset(
+    {"Filename", "FileExtension", "DateTimeDigitized", "MakerNote"}
+)
+
+# Флаги cv2.imread для декодирования с уменьшением в 2, 4 и 8 раз
+_REDUCED_FLAGS = {
+    (2, False): cv2.IMREAD_REDUCED_COLOR_2,
+    (4, False): cv2.IMREAD_REDUCED_COLOR_4,
+    (8, False): cv2.IMREAD_REDUCED_COLOR_8,
+    (2, True): cv2.IMREAD_REDUCED_GRAYSCALE_2,
+    (4, True): cv2.IMREAD_REDUCED_GRAYSCALE_4,
+    (8, True): cv2.IMREAD_REDUCED_GRAYSCALE_8,
+}
+
+# Сигнатуры (магические байты) в начале файлов изображений
+_SIGNATURES = (
+    b"\xff\xd8\xff",  # JPEG
+    b"\x89PNG\r\n\x1a\n",  # PNG
+    b"BM",  # BMP
+    b"II*\x00",  # TIFF (little-endian)
+    b"MM\x00*",  # TIFF (big-endian)
+    b"\x00\x00\x00\x0cjP  ",  # JPEG 2000
+    b"\xffO\xffQ",  # JPEG 2000 (codestream)
+    b"\x59\xa6\x6a\x95",  # Sun Raster
+    b"\x76\x2f\x31\x01",  # OpenEXR
+    b"#?RADIANCE",  # HDR
+    b"#?RGBE",  # HDR
+)
 
 
 # ==================================================================================================================================
@@ -21,10 +94,36 @@ class Image(object):
         self.path = image_path
 
         self.filename = os.path.basename(self.path)
+        self.relpath = self.filename
 
-    def info(self):
-        self.height, self.width, self.channel = self.read().shape
+        self._header: dict = None
+
+    @property
+    def width(self) -> int:
+        """Ширина изображения (с учётом поворота по EXIF), читается из заголовка файла."""
+        return self._read_header()["width"]
+
+    @property
+    def height(self) -> int:
+        """Высота изображения (с учётом поворота по EXIF), читается из заголовка файла."""
+        return self._read_header()["height"]
+
+    @property
+    def channel(self) -> int:
+        """Количество каналов изображения в файле."""
+        return self._read_header()["channel"]
 
+    @property
+    def format(self) -> str:
+        """Формат файла изображения (например, "JPEG" или "PNG")."""
+        return self._read_header()["format"]
+
+    @property
+    def orientation(self) -> int:
+        """Значение тега EXIF Orientation (1, если тег отсутствует)."""
+        return self._read_header()["orientation"]
+
+    def info(self):
         color_print("done", "done", "Image Information:")
 
         color_print("log", "log", "Название изображения:")
@@ -40,11 +139,81 @@ class Image(object):
         )
 
     def read(self):
-        image = cv2.imread(self.path)
-        self.height, self.width, self.channel = image.shape
+        image = self._cached("bgr", self._decode)
 
         if image is None:
-            color_print("fail", "fail", f"Ошибка чтения изображения: {self.image_name}")
+            color_print("fail", "fail", f"Ошибка чтения изображения: {self.filename}")
+
+        return image
+
+    def read_reduced(
+        self,
+        min_width: int = 0,
+        min_height: int = 0,
+        grayscale: bool = False,
+        use_thumbnail: bool = False,
+    ) -> np.ndarray:
+        """
+        Читает изображение в уменьшенном разрешении, но не меньше запрошенного. Для JPEG
+        уменьшение в 2, 4 или 8 раз выполняется при декодировании (масштабированием DCT),
+        что в несколько раз быстрее полного декодирования с последующим cv2.resize.
+        Остальные форматы при уменьшенном декодировании не ускоряются, поэтому читаются
+        в исходном разрешении.
+
+        Parameters:
+            - min_width (int): минимальная требуемая ширина изображения.
+            - min_height (int): минимальная требуемая высота изображения.
+            - grayscale (bool): читать изображение в оттенках серого.
+            - use_thumbnail (bool): использовать встроенную в EXIF миниатюру, если её
+            размер достаточен, а пропорции совпадают с изображением (миниатюры есть
+            не у всех копий файла, поэтому для сравнения изображений они не используются).
+
+        Returns:
+            - np.ndarray: изображение BGR (или в оттенках серого) размером не меньше
+            min_width x min_height, если исходное изображение не меньше этого размера.
+        """
+
+        width, height = self.width, self.height
+        factor = 1
+
+        if width is not None:
+            if self.format == "JPEG":
+                for candidate in (8, 4, 2):
+                    if (
+                        width // candidate >= min_width
+                        and height // candidate >= min_height
+                    ):
+                        factor = candidate
+                        break
+
+            if use_thumbnail:
+                thumbnail = self._cached(
+                    f"thumbnail/{'gray' if grayscale else 'bgr'}",
+                    lambda: self._read_exif_thumbnail(grayscale),
+                )
+
+                if thumbnail is not None and _same_aspect(
+                    thumbnail.shape[1], thumbnail.shape[0], width, height
+                ):
+                    if thumbnail.shape[1] >= min_width and thumbnail.shape[0] >= min_height:
+                        return thumbnail
+
+        if factor == 1:
+            image = self.read()
+
+            if grayscale and image is not None:
+                image = self._cached(
+                    "gray", lambda: cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+                )
+
+            return image
+
+        flags = _REDUCED_FLAGS[(factor, grayscale)]
+        form = f"{'gray' if grayscale else 'bgr'}/{factor}"
+        image = self._cached(form, lambda: self._decode(flags))
+
+        if image is None:
+            color_print("fail", "fail", f"Ошибка чтения изображения: {self.filename}")
 
         return image
 
@@ -56,25 +225,51 @@ class Image(object):
         Returns:
             - img_array: NumPy-массив открытого изображения.
         """
-        self.read()
 
-        rate = 600 / self.height
-        new_width = int(self.width * rate)
-        new_height = int(self.height * rate)
+        if self.height is None:
+            return None
 
-        with PIL_Image.open(self.path) as image:
-            image_resized = image.resize((new_width, new_height))
-            image_array = np.array(image_resized)
+        def resize():
+            rate = 600 / self.height
+            new_width = int(self.width * rate)
+            new_height = int(self.height * rate)
 
-        return image_array.flatten()
+            # Формат не поддерживается PIL: изображение декодируется OpenCV
+            if self.format is None:
+                with stage("resize"):
+                    image_resized = cv2.resize(self.read(), (new_width, new_height))
 
-    def visualize(self):
-        image = self.read()
+                # Порядок каналов RGB, как у изображений, прочитанных PIL
+                return cv2.cvtColor(image_resized, cv2.COLOR_BGR2RGB).flatten()
+
+            # Изображение декодируется один раз; размер известен из заголовка
+            with PIL_Image.open(self.path) as image:
+                # Для JPEG уменьшает изображение при декодировании (не меньше нужного размера)
+                draft_size = (new_width, new_height)
+                if self.orientation in (5, 6, 7, 8):
+                    draft_size = (new_height, new_width)
+
+                with stage("decode"):
+                    image.draft(image.mode, draft_size)
+                    image_decoded = ImageOps.exif_transpose(image)
+                    image_decoded.load()
 
+                self._count_decoded()
+
+                with stage("resize"):
+                    image_resized = image_decoded.resize((new_width, new_height))
+                    image_array = np.array(image_resized)
+
+            return image_array.flatten()
+
+        return self._cached("resize600", resize)
+
+    def visualize(self):
         rate = 600 / self.height
         new_width = int(self.width * rate)
         new_height = int(self.height * rate)
 
+        image = self.read_reduced(new_width, new_height)
         resized_image = cv2.resize(image, (new_width, new_height))
 
         cv2.imshow(self.filename, resized_image)
@@ -89,84 +284,293 @@ class Image(object):
             - exif_data (dict[str, str]): словарь с метаданными изображения.
         """
 
-        exif_dict = {}
-
         try:
-            with PIL_Image.open(self.path) as image:
-                exif_data = image._getexif()
-
-                if exif_data:
-                    for tag, value in exif_data.items():
-                        tag_name = TAGS.get(tag, tag)
-                        exif_dict[tag_name] = value
-                else:
-                    color_print(
-                        "warning",
-                        "warning",
-                        f"Метаданные изображения '{self.filename}' не найдены.",
-                    )
-
-                    return None
+            exif_dict = self._read_exif()
 
         except FileNotFoundError:
             color_print("fail", "fail", "Изображение не найдено.")
             return None
 
+        if not exif_dict:
+            color_print(
+                "warning",
+                "warning",
+                f"Метаданные изображения '{self.filename}' не найдены.",
+            )
+
+            return None
+
         self.exif_data = exif_dict
 
         return exif_dict
 
+    def exif_fingerprint(self) -> str:
+        """
+        Возвращает отпечаток метаданных EXIF изображения - дайджест канонического
+        представления всех тегов, кроме EXIF_IGNORED_TAGS. Изображения с одинаковыми
+        метаданными имеют одинаковый отпечаток, поэтому дубликаты по EXIF находятся
+        группировкой по нему. Метаданные читаются из заголовка без декодирования пикселей.
+
+        Returns:
+            - str: отпечаток метаданных или None, если метаданных нет.
+        """
+
+        if not hasattr(self, "_exif_fingerprint"):
+            try:
+                exif_dict = self._read_exif()
+            except OSError:
+                exif_dict = None
+
+            fingerprint = None
+
+            if exif_dict:
+                items = sorted(
+                    (str(tag), _canonical_exif_value(value))
+                    for tag, value in exif_dict.items()
+                    if tag not in EXIF_IGNORED_TAGS
+                )
+                fingerprint = hashlib.blake2b(
+                    repr(items).encode(), digest_size=16
+                ).hexdigest()
+
+            self._exif_fingerprint = fingerprint
+
+        return self._exif_fingerprint
+
+    def file_digest(self) -> str:
+        """
+        Возвращает BLAKE2-дайджест содержимого файла (вычисляется один раз).
+
+        Returns:
+            - str: дайджест файла.
+        """
+
+        if not hasattr(self, "_file_digest"):
+            self._file_digest = file_digest(self.path)
+
+        return self._file_digest
+
+    def pixel_digest(self) -> str:
+        """
+        Возвращает BLAKE2-дайджест декодированных пикселей изображения (вычисляется
+        один раз). Совпадает у попиксельно одинаковых изображений, даже если они
+        сохранены в разных форматах или с разными метаданными.
+
+        Returns:
+            - str: дайджест пикселей или None, если изображение не удалось прочитать.
+        """
+
+        if not hasattr(self, "_pixel_digest"):
+            image = self.read()
+            digest = None
+
+            if image is not None:
+                digest = hashlib.blake2b(repr(image.shape).encode(), digest_size=32)
+                digest.update(np.ascontiguousarray(image).data)
+                digest = digest.hexdigest()
+
+            self._pixel_digest = digest
+
+        return self._pixel_digest
+
+    def _read_exif(self) -> dict:
+        """
+        Читает теги EXIF из заголовка файла (без декодирования пикселей).
+        """
+
+        exif_dict = {}
+
+        with PIL_Image.open(self.path) as image:
+            exif_data = image._getexif() if hasattr(image, "_getexif") else None
+
+            if exif_data:
+                for tag, value in exif_data.items():
+                    exif_dict[TAGS.get(tag, tag)] = value
+
+        return exif_dict
+
     def _read_flatten(self):
-        image = cv2.imread(self.path)
-        self.height, self.width, self.channel = image.shape
+        image = self.read()
 
         if image is None:
-            color_print("fail", "fail", f"Ошибка чтения изображения: {self.filename}")
+            return None
 
-        return image.flatten()
+        # Представление кэшированного BGR-массива без копирования
+        return image.ravel()
 
     def _read_image_as_rgb(self) -> np.ndarray:
-        color_print("create", "create", f"Чтение изображения: {self.filename}")
+        def read_as_rgb():
+            color_print("create", "create", f"Чтение изображения: {self.filename}")
+
+            image = self.read_reduced(min_width=512)
+            rgb_image = cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
+
+            new_width = 512
+            new_height = int(image.shape[0] * (new_width / image.shape[1]))
 
-        rgb_image = cv2.cvtColor(self.read(), cv2.COLOR_BGR2RGB)
+            with stage("resize"):
+                return cv2.resize(rgb_image, (new_width, new_height))
 
-        new_width = 512
-        new_height = int(self.height * (new_width / self.width))
+        return self._cached("rgb512", read_as_rgb)
 
-        resized_image = cv2.resize(rgb_image, (new_width, new_height))
+    def _read_header(self) -> dict:
+        """
+        Читает размер, количество каналов, формат и ориентацию изображения из заголовка
+        файла без декодирования пикселей. Если PIL не поддерживает формат файла, размер
+        определяется полным декодированием OpenCV (формат при этом не определяется).
+        Результат сохраняется в объекте изображения.
+        """
+
+        if self._header is not None:
+            return self._header
+
+        header = dict(width=None, height=None, channel=None, format=None, orientation=1)
+
+        try:
+            with PIL_Image.open(self.path) as image:
+                width, height = image.size
+                orientation = image.getexif().get(0x0112, 1)
 
-        return resized_image
+                # Поворот по EXIF меняет местами ширину и высоту (как при чтении cv2.imread)
+                if orientation in (5, 6, 7, 8):
+                    width, height = height, width
+
+                header.update(
+                    width=width,
+                    height=height,
+                    channel=len(image.getbands()),
+                    format=image.format,
+                    orientation=orientation,
+                )
+
+        except Exception:
+            # Формат не поддерживается PIL (например, EXR или HDR): размер берётся
+            # из изображения, декодированного OpenCV (оно сохраняется в кэше, если он включён)
+            image = self.read()
+
+            if image is not None:
+                header.update(width=image.shape[1], height=image.shape[0], channel=3)
+
+        self._header = header
+
+        return header
+
+    def _read_exif_thumbnail(self, grayscale: bool = False) -> np.ndarray:
+        """
+        Декодирует встроенную в EXIF миниатюру JPEG или возвращает None, если её нет.
+        """
+
+        try:
+            with PIL_Image.open(self.path) as image:
+                raw_exif = image.info.get("exif")
+                thumbnail_ifd = image.getexif().get_ifd(IFD.IFD1)
+
+        except Exception:
+            return None
+
+        offset = thumbnail_ifd.get(0x0201)
+        length = thumbnail_ifd.get(0x0202)
+
+        if not raw_exif or offset is None or not length:
+            return None
+
+        # Смещение миниатюры отсчитывается от заголовка TIFF после "Exif\0\0"
+        start = 6 + offset if raw_exif.startswith(b"Exif") else offset
+        data = np.frombuffer(raw_exif[start : start + length], dtype=np.uint8)
+
+        flags = cv2.IMREAD_GRAYSCALE if grayscale else cv2.IMREAD_COLOR
+
+        return cv2.imdecode(data, flags) if data.size else None
+
+    def _decode(self, flags: int = cv2.IMREAD_COLOR) -> np.ndarray:
+        """
+        Декодирует файл изображения с флагами cv2.imread; время и объём прочитанных файлов
+        учитываются в статистике выполнения (см. instrumentation.set_stats).
+        """
+
+        with stage("decode"):
+            image = cv2.imread(self.path, flags)
+
+        if image is not None:
+            self._count_decoded()
+
+        return image
+
+    def _count_decoded(self) -> None:
+        stats = get_stats()
+
+        if stats is not None:
+            stats.count("images_decoded")
+            stats.count("bytes_read", os.path.getsize(self.path))
+
+    def _cached(self, form: str, compute) -> np.ndarray:
+        """
+        Возвращает производную форму изображения из кэша декодированных изображений
+        (см. visdatcompy.set_cache), если он включён, иначе вычисляет её.
+        """
+
+        cache = get_cache()
+
+        if cache is None:
+            return compute()
+
+        return cache.get_or_compute((self.path, form), compute)
 
 
 # ==================================================================================================================================
 
 
 class Dataset(object):
-    def __init__(self, dataset_path: str):
+    def __init__(
+        self,
+        dataset_path: str,
+        recursive: bool = False,
+        include: list[str] = None,
+        exclude: list[str] = None,
+        check_signature: bool = False,
+        n_workers: int = 1,
+    ):
         """
         Класс датасета, объект класса представляет собой датасет, состоящий из изображений
-        внутри указанного пути.
+        внутри указанного пути. Файлы, не являющиеся изображениями, пропускаются.
+
+        Список изображений строится полностью при создании объекта: движки сравнения
+        работают с индексами изображений и не начинают обработку до окончания обхода.
+        Чтобы обрабатывать изображения во время сканирования, используйте discover_images.
 
         Parameters:
             - dataset_path: путь к датасету (или изобрежению для создания датасета с одним изображением).
+            - recursive (bool): искать изображения во вложенных директориях.
+            - include (list[str]): glob-шаблоны путей (относительно датасета), которые нужно включить.
+            - exclude (list[str]): glob-шаблоны путей, которые нужно исключить.
+            - check_signature (bool): проверять сигнатуру файла вместо расширения.
+            - n_workers (int): количество потоков для параллельного обхода вложенных директорий.
 
         Attributes:
             - path: путь к датасету.
             - name: название датасета (имя папки).
             - images (list[Image]): список с объектами изображений (объектов класса Image).
+            - filenames (list[str]): имена файлов изображений.
+            - relpaths (list[str]): пути изображений относительно датасета.
             - image_generator: генератор для получения объектов изображений по одному.
             - image_count: кол-во найденных изображений в датасете.
         """
 
         try:
             self.path = dataset_path
-            self.name = os.path.basename(self.path)
+            self.name = os.path.basename(os.path.normpath(self.path))
+
+            self.recursive = recursive
+            self.include = include
+            self.exclude = exclude
+            self.check_signature = check_signature
+            self.n_workers = n_workers
 
             self.images: list[Image]
             self.filenames, self.images = self._get_images()
             self.image_generator = self._image_generator()
 
-            self.image_count = len(self.images)
+            self._build_index()
 
         except Exception as e:
             color_print("fail", "fail", f"Ошибка: {e}")
@@ -193,29 +597,86 @@ class Dataset(object):
 
     def get_image(self, filename: str) -> Image:
         """
-        Возвращает объект изображения по названию файла.
+        Возвращает объект изображения по названию файла или пути относительно датасета.
 
         Parameters:
-            - filename (str): Имя изображения с его расширением.
+            - filename (str): Имя изображения с его расширением (или относительный путь,
+            если в разных поддиректориях есть файлы с одинаковыми именами).
 
         Returns:
             - Image: объект изображения с указаным именем файла.
         """
 
-        image_index = self.filenames.index(filename)
-        return self.images[image_index]
+        return self.images[self.index_of(filename)]
+
+    def index_of(self, filename: str) -> int:
+        """
+        Возвращает индекс изображения в датасете по относительному пути или имени файла.
+
+        Parameters:
+            - filename (str): относительный путь или имя файла изображения.
+
+        Returns:
+            - int: индекс изображения в списке images.
+        """
+
+        if filename in self._index:
+            return self._index[filename]
+
+        positions = self._filename_index.get(filename)
+
+        if not positions:
+            raise KeyError(f"Изображение не найдено в датасете: {filename}")
+
+        if len(positions) > 1:
+            raise KeyError(
+                f"Имя файла {filename} встречается в датасете {len(positions)} раз, "
+                "используйте путь относительно датасета."
+            )
+
+        return positions[0]
 
     def delete_image(self, image: Image):
-        if image.filename in self.filenames:
-            image_index = self.filenames.index(image.filename)
+        self.remove_many([image])
+
+    def remove_many(self, images: list[Image]) -> int:
+        """
+        Удаляет изображения из датасета за один проход по спискам изображений.
+
+        Parameters:
+            - images (list[Image]): изображения для удаления (повторы и
+            отсутствующие в датасете изображения пропускаются).
+
+        Returns:
+            - int: количество удалённых изображений.
+        """
+
+        removed = {
+            self._index[image.relpath] for image in images if image.relpath in self._index
+        }
+
+        if not removed:
+            return 0
 
-            del self.images[image_index]
-            del self.filenames[image_index]
-            self.image_count -= 1
+        kept = [image for i, image in enumerate(self.images) if i not in removed]
 
-    def get_exif_data(self) -> list[str]:
+        # Списки изменяются на месте, чтобы не сломать уже созданный image_generator
+        self.images[:] = kept
+        self.filenames[:] = [image.filename for image in kept]
+        self._build_index()
+
+        return len(removed)
+
+    def __contains__(self, image: Image) -> bool:
+        return image.relpath in self._index
+
+    def get_exif_data(self, n_workers: int = None) -> list[str]:
         """
         Собирает метаданные со всех изображений в датасете и сохраняет их в атрибут exif_data.
+        Метаданные читаются из заголовков файлов параллельно в пуле потоков.
+
+        Parameters:
+            - n_workers (int): количество потоков (по умолчанию - как у ThreadPoolExecutor).
 
         Creates:
             - exif_data (pd.DataFrame): датафрейм с метаданными датасета.
@@ -223,45 +684,122 @@ class Dataset(object):
 
         exif_data = []
 
-        try:
-            for image in self.images:
-                image_exif_data = image.get_exif_data()
-
-                if image_exif_data is not None:
-                    filename, file_extension = os.path.splitext(str(image.filename))
-                    image_exif_data.update(
-                        {"Filename": filename, "FileExtension": file_extension}
-                    )
+        def read(image):
+            try:
+                return image._read_exif()
+            except OSError:
+                return None
 
-                    exif_data.append(image_exif_data)
+        with ThreadPoolExecutor(max_workers=n_workers) as executor:
+            images_exif_data = list(executor.map(read, self.images))
 
-            exif_df = pd.DataFrame(data=exif_data)
-            exif_df = exif_df.drop(columns="MakerNote")
+        for image, image_exif_data in zip(self.images, images_exif_data):
+            if image_exif_data:
+                filename, file_extension = os.path.splitext(str(image.filename))
+                image_exif_data.update(
+                    {"Filename": filename, "FileExtension": file_extension}
+                )
 
-            self.exif_data = exif_df
+                image.exif_data = image_exif_data
+                exif_data.append(image_exif_data)
 
-        except KeyError:
+        if not exif_data:
             color_print(
                 "warning",
                 "warning",
                 f"Метаданные изображений в датасете '{self.name}' не обнаружены.",
             )
+            return
+
+        exif_df = pd.DataFrame(data=exif_data)
+        exif_df = exif_df.drop(columns="MakerNote", errors="ignore")
+
+        self.exif_data = exif_df
+
+    def exif_fingerprints(self, n_workers: int = None) -> list[str]:
+        """
+        Вычисляет отпечатки метаданных EXIF всех изображений датасета (см. Image.exif_fingerprint).
+        Заголовки файлов читаются параллельно в пуле потоков.
+
+        Parameters:
+            - n_workers (int): количество потоков (по умолчанию - как у ThreadPoolExecutor).
+
+        Returns:
+            - list[str]: отпечатки в порядке изображений датасета (None - метаданных нет).
+        """
+
+        if n_workers == 1:
+            return [image.exif_fingerprint() for image in self.images]
+
+        with ThreadPoolExecutor(max_workers=n_workers) as executor:
+            return list(executor.map(Image.exif_fingerprint, self.images))
+
+    def fingerprint(self) -> str:
+        """
+        Вычисляет отпечаток состава датасета: BLAKE2-дайджест относительных путей,
+        размеров и времени модификации файлов в порядке изображений. Содержимое
+        файлов не читается.
+
+        Returns:
+            - str: шестнадцатеричный дайджест (изменяется при добавлении, удалении,
+            переупорядочивании или изменении изображений).
+        """
+
+        digest = hashlib.blake2b(digest_size=16)
+
+        for image in self.images:
+            try:
+                stat = os.stat(image.path)
+                info = f"{stat.st_size}:{stat.st_mtime_ns}"
+            except OSError:
+                info = "missing"
+
+            digest.update(f"{image.relpath}\0{info}\n".encode())
+
+        return digest.hexdigest()
+
+    @property
+    def image_count(self) -> int:
+        return len(self.images)
+
+    @property
+    def relpaths(self) -> list[str]:
+        return [image.relpath for image in self.images]
+
+    def _build_index(self):
+        """
+        Строит словари для поиска изображений по относительному пути и по имени файла.
+        """
+
+        self._index: dict[str, int] = {}
+        self._filename_index: dict[str, list[int]] = {}
+
+        for i, image in enumerate(self.images):
+            self._index[image.relpath] = i
+            self._filename_index.setdefault(image.filename, []).append(i)
 
     def _get_images(self):
         filenames = []
         images = []
 
-        if os.path.isdir(self.path):
-            for image_name in os.listdir(self.path):
-                image = Image(os.path.join(self.path, image_name))
+        with stage("list"):
+            if os.path.isdir(self.path):
+                for image in discover_images(
+                    self.path,
+                    recursive=self.recursive,
+                    include=self.include,
+                    exclude=self.exclude,
+                    check_signature=self.check_signature,
+                    n_workers=self.n_workers,
+                ):
+                    filenames.append(image.filename)
+                    images.append(image)
+
+            elif os.path.isfile(self.path):
+                image = Image(self.path)
                 filenames.append(image.filename)
                 images.append(image)
 
-        elif os.path.isfile(self.path):
-            image = Image(self.path)
-            filenames.append(image.filename)
-            images.append(image)
-
         return filenames, images
 
     def _image_generator(self):
@@ -279,6 +817,108 @@ class Dataset(object):
 # ==================================================================================================================================
 
 
+def discover_images(
+    directory: str,
+    recursive: bool = False,
+    include: list[str] = None,
+    exclude: list[str] = None,
+    extensions: set[str] = IMAGE_EXTENSIONS,
+    check_signature: bool = False,
+    n_workers: int = 1,
+) -> Iterator[Image]:
+    """
+    Генератор изображений директории. Изображения выдаются по мере обхода файловой
+    системы, поэтому обработку можно начинать до окончания сканирования больших директорий.
+    Dataset собирает все изображения генератора в список до возврата из конструктора,
+    поэтому это возможно только при использовании генератора напрямую.
+
+    Parameters:
+        - directory (str): путь к директории.
+        - recursive (bool): обходить вложенные директории.
+        - include (list[str]): glob-шаблоны путей относительно директории (например, "*.jpg"
+        или "train/*"), хотя бы одному из которых должен соответствовать файл.
+        - exclude (list[str]): glob-шаблоны путей, файлы по которым пропускаются.
+        - extensions (set[str]): допустимые расширения файлов (в нижнем регистре).
+        - check_signature (bool): определять изображения по магическим байтам в начале
+        файла, а не по расширению.
+        - n_workers (int): количество потоков для параллельного обхода вложенных директорий
+        (порядок изображений при этом не сохраняется).
+
+    Returns:
+        - Image: объект очередного найденного изображения.
+    """
+
+    for path in walk_files(directory, recursive=recursive, n_workers=n_workers):
+        relpath = os.path.relpath(path, directory).replace(os.sep, "/")
+
+        if include and not any(fnmatch.fnmatch(relpath, pattern) for pattern in include):
+            continue
+
+        if exclude and any(fnmatch.fnmatch(relpath, pattern) for pattern in exclude):
+            continue
+
+        if check_signature:
+            if not _has_image_signature(path):
+                continue
+
+        elif os.path.splitext(path)[1].lower() not in extensions:
+            continue
+
+        image = Image(path)
+        image.relpath = relpath
+
+        yield image
+
+
+def _canonical_exif_value(value: object) -> object:
+    """
+    Приводит значение тега EXIF к сравнимому представлению, не зависящему от типов PIL.
+    """
+
+    if isinstance(value, IFDRational):
+        return (value.numerator, value.denominator)
+
+    if isinstance(value, (tuple, list)):
+        return tuple(_canonical_exif_value(item) for item in value)
+
+    if isinstance(value, dict):
+        return tuple(
+            sorted((str(key), _canonical_exif_value(item)) for key, item in value.items())
+        )
+
+    if isinstance(value, str):
+        return value.rstrip("\x00")
+
+    return value
+
+
+def _same_aspect(width1: int, height1: int, width2: int, height2: int) -> bool:
+    return abs(width1 * height2 - width2 * height1) <= 0.01 * width2 * height1
+
+
+def _has_image_signature(path: str) -> bool:
+    try:
+        with open(path, "rb") as file:
+            header = file.read(16)
+    except OSError:
+        return False
+
+    if header[:4] == b"RIFF" and header[8:12] == b"WEBP":
+        return True
+
+    if header[4:12] in (b"ftypavif", b"ftypavis"):
+        return True
+
+    # Форматы Netpbm: P1-P7, PF, Pf
+    if header[:1] == b"P" and header[1:2] in b"1234567Ff":
+        return header[2:3] in (b" ", b"\t", b"\n", b"\r")
+
+    return header.startswith(_SIGNATURES)
+
+
+# ==================================================================================================================================
+
+
 if __name__ == "__main__":
     # Создаём объект класса Image для работы с одним изображением:
     img = Image("datasets/drone/0_1.jpg")
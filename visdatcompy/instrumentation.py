@@ -0,0 +1,341 @@
+import sys
+import json
+import time
+import threading
+from functools import wraps
+from typing import Callable
+from contextlib import nullcontext
+
+from visdatcompy.utils import color_print
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+
+__all__ = ["Stats", "set_stats", "get_stats", "timed", "peak_rss"]
+
+# Этапы обработки, на которые движки разбивают время вычислений.
+STAGES = ("list", "decode", "resize", "hash", "extract", "compare", "export")
+
+# Пустой контекст для выключенной статистики (переиспользуется без создания объектов).
+_NULL_STAGE = nullcontext()
+
+
+# ==================================================================================================================================
+# |                                                         INSTRUMENTATION                                                        |
+# ==================================================================================================================================
+
+
+class Stats(object):
+    """
+    Статистика выполнения: время по этапам обработки, счётчики и ход вычислений.
+
+    Время этапа учитывается двумя способами: полное (вместе с вложенными этапами, например
+    декодированием внутри сравнения тайла) и собственное - без вложенных этапов, поэтому
+    собственное время этапов одного потока в сумме не превышает время выполнения.
+    При вычислении в нескольких потоках время этапов суммируется по потокам.
+
+    Parameters:
+        - progress (Callable): функция, вызываемая при продвижении вычисления
+        с аргументами (этап, выполнено, всего), например для индикатора прогресса.
+
+    Attributes:
+        - timers (dict): этап -> [кол-во вызовов, полное время, собственное время] в секундах.
+        - counters (dict): счётчики (например, "pairs" - сравнённые пары изображений,
+        "bytes_read" - прочитанные байты файлов, "cache_hits" - попадания в FeatureCache).
+        - started (float): время создания (или сброса) статистики по time.perf_counter.
+    """
+
+    def __init__(self, progress: Callable[[str, int, int], None] = None):
+        self.progress = progress
+
+        self._lock = threading.Lock()
+        self._local = threading.local()
+
+        self.reset()
+
+    def reset(self) -> None:
+        """
+        Обнуляет таймеры, счётчики и ход вычислений.
+        """
+
+        with self._lock:
+            self.timers: dict[str, list] = {}
+            self.counters: dict[str, int] = {}
+            self._totals: dict[str, int] = {}
+            self._done: dict[str, int] = {}
+            self.started = time.perf_counter()
+
+    def stage(self, name: str) -> "_Stage":
+        """
+        Контекстный менеджер для замера времени этапа.
+
+        Parameters:
+            - name (str): название этапа (см. STAGES).
+        """
+
+        return _Stage(self, name)
+
+    def count(self, name: str, value: int = 1) -> None:
+        """
+        Увеличивает счётчик на value.
+        """
+
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    def start(self, name: str, total: int) -> None:
+        """
+        Начинает отслеживание хода этапа из total единиц работы (например, пар изображений).
+        """
+
+        with self._lock:
+            self._totals[name] = total
+            self._done[name] = 0
+
+        if self.progress is not None:
+            self.progress(name, 0, total)
+
+    def advance(self, name: str, value: int) -> None:
+        """
+        Отмечает выполнение value единиц работы этапа и вызывает функцию progress.
+        """
+
+        with self._lock:
+            done = self._done.get(name, 0) + value
+            self._done[name] = done
+            total = self._totals.get(name, done)
+
+        if self.progress is not None:
+            self.progress(name, done, total)
+
+    @property
+    def wall_time(self) -> float:
+        """
+        Время с создания (или сброса) статистики в секундах.
+        """
+
+        return time.perf_counter() - self.started
+
+    def throughput(self, counter: str = "pairs") -> float:
+        """
+        Количество единиц счётчика (по умолчанию - сравнённых пар) в секунду времени выполнения.
+        """
+
+        wall_time = self.wall_time
+
+        return self.counters.get(counter, 0) / wall_time if wall_time > 0 else 0.0
+
+    def as_dict(self) -> dict:
+        """
+        Возвращает статистику в виде словаря, сериализуемого в JSON.
+
+        Returns:
+            - dict: время выполнения, этапы, счётчики, пропускная способность
+            (пар в секунду) и пиковый объём памяти процесса в байтах (или None).
+        """
+
+        with self._lock:
+            stages = {
+                name: {"calls": calls, "seconds": total, "self_seconds": own}
+                for name, (calls, total, own) in self.timers.items()
+            }
+            counters = dict(self.counters)
+
+        return {
+            "wall_time": self.wall_time,
+            "stages": stages,
+            "counters": counters,
+            "throughput": self.throughput(),
+            "peak_rss": peak_rss(),
+        }
+
+    def save(self, path: str) -> str:
+        """
+        Сохраняет статистику в файл JSON.
+
+        Parameters:
+            - path (str): путь к файлу.
+
+        Returns:
+            - str: путь к сохранённому файлу.
+        """
+
+        with open(path, "w", encoding="utf-8") as file:
+            json.dump(self.as_dict(), file, ensure_ascii=False, indent=4)
+
+        return path
+
+    def report(self) -> None:
+        """
+        Выводит статистику в консоль.
+        """
+
+        summary = self.as_dict()
+
+        color_print("done", "done", "Статистика выполнения:")
+        color_print("log", "log", f"Время выполнения: {summary['wall_time']:.3f} с")
+
+        for name, timer in sorted(
+            summary["stages"].items(), key=lambda item: -item[1]["self_seconds"]
+        ):
+            color_print(
+                "log",
+                "log",
+                f"{name}: {timer['self_seconds']:.3f} с "
+                f"(всего {timer['seconds']:.3f} с, вызовов: {timer['calls']})",
+            )
+
+        for name, value in sorted(summary["counters"].items()):
+            color_print("log", "log", f"{name}: {value}")
+
+        color_print("log", "log", f"Пар в секунду: {summary['throughput']:.1f}")
+
+        if summary["peak_rss"] is not None:
+            color_print(
+                "log", "log", f"Пиковый объём памяти: {summary['peak_rss'] / 2**20:.1f} МБ"
+            )
+
+    def _add(self, name: str, elapsed: float, own: float) -> None:
+        with self._lock:
+            timer = self.timers.get(name)
+
+            if timer is None:
+                self.timers[name] = [1, elapsed, own]
+            else:
+                timer[0] += 1
+                timer[1] += elapsed
+                timer[2] += own
+
+
+class _Stage(object):
+    """
+    Замер времени одного этапа; время вложенных этапов того же потока вычитается
+    из собственного времени внешнего этапа.
+    """
+
+    __slots__ = ("stats", "name", "started", "nested")
+
+    def __init__(self, stats: Stats, name: str):
+        self.stats = stats
+        self.name = name
+
+    def __enter__(self) -> "_Stage":
+        local = self.stats._local
+        stack = getattr(local, "stack", None)
+
+        if stack is None:
+            stack = local.stack = []
+
+        stack.append(self)
+        self.nested = 0.0
+        self.started = time.perf_counter()
+
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        elapsed = time.perf_counter() - self.started
+        stack = self.stats._local.stack
+        stack.pop()
+
+        if stack:
+            stack[-1].nested += elapsed
+
+        self.stats._add(self.name, elapsed, elapsed - self.nested)
+
+
+# ==================================================================================================================================
+
+
+_stats: Stats = None
+
+
+def set_stats(stats: object = True) -> Stats:
+    """
+    Включает сбор статистики выполнения для всего процесса (или выключает его при stats=None
+    или False). Пока статистика выключена, замеры в движках ничего не делают.
+
+    Parameters:
+        - stats (Stats | bool): объект статистики или True для создания нового.
+
+    Returns:
+        - Stats: текущая статистика или None, если сбор выключен.
+    """
+
+    global _stats
+
+    if stats is True:
+        stats = Stats()
+
+    _stats = stats or None
+
+    return _stats
+
+
+def get_stats() -> Stats:
+    """
+    Возвращает текущую статистику выполнения или None, если сбор выключен.
+    """
+
+    return _stats
+
+
+def stage(name: str) -> object:
+    """
+    Контекстный менеджер для замера времени этапа в текущей статистике
+    (при выключенной статистике - пустой контекст).
+    """
+
+    stats = _stats
+
+    if stats is None:
+        return _NULL_STAGE
+
+    return stats.stage(name)
+
+
+def count(name: str, value: int = 1) -> None:
+    """
+    Увеличивает счётчик текущей статистики (при выключенной статистике ничего не делает).
+    """
+
+    stats = _stats
+
+    if stats is not None:
+        stats.count(name, value)
+
+
+def timed(name: str) -> Callable:
+    """
+    Декоратор, замеряющий время выполнения функции как этап текущей статистики.
+
+    Parameters:
+        - name (str): название этапа.
+    """
+
+    def decorator(func: Callable) -> Callable:
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            with stage(name):
+                return func(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
+
+
+def peak_rss() -> int:
+    """
+    Возвращает пиковый объём резидентной памяти процесса в байтах или None, если модуль
+    resource недоступен (Windows).
+    """
+
+    if resource is None:
+        return None
+
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+    # В macOS ru_maxrss в байтах, в Linux - в килобайтах
+    return peak if sys.platform == "darwin" else peak * 1024
@@ -1,21 +1,41 @@
+import os
+import cv2
+import time
 import numpy as np
-import pandas as pd
 from functools import partial
-from matplotlib import pyplot as plt
 from concurrent.futures import ThreadPoolExecutor
+from matplotlib import pyplot as plt
 from sklearn.metrics import mean_squared_error as mse_sklearn
 from skimage.metrics import normalized_root_mse as nrmse_skimage
 from skimage.metrics import structural_similarity as ssim_skimage
 from skimage.metrics import peak_signal_noise_ratio as psnr_skimage
 from sklearn.metrics import mean_absolute_error as mae_skimage
 from skimage.metrics import normalized_mutual_information as nmi_skimage
+from skimage.util.dtype import dtype_range
+from scipy.ndimage import uniform_filter1d
 
-from visdatcompy.image_handler import Dataset
+from visdatcompy.cache import FeatureCache
+from visdatcompy.checkpoint import Checkpoint
+from visdatcompy.image_handler import Image, Dataset
+from visdatcompy.instrumentation import stage, count
+from visdatcompy.results import allocate_matrix, save_matrix, RESULT_FORMATS
+from visdatcompy.pairwise import (
+    TopK,
+    run_tiles,
+    limit_threads,
+    run_top_k,
+    run_blocks,
+    is_self_comparison,
+    mirror_normalized,
+)
 from visdatcompy.utils import color_print
 
 
 __all__ = ["Metrics"]
 
+# Ограничение на размер промежуточного массива при поблочных вычислениях (в байтах).
+_TILE_BYTES = 64 * 1024 * 1024
+
 
 # ==================================================================================================================================
 # |                                                              METRICS                                                           |
@@ -31,7 +51,28 @@ class Metrics(object):
     Parameters:
         - Dataset1 (Dataset): объект класса Dataset первого датасета.
         - Dataset2 (Dataset): объект класса Dataset второго датасета.
-        - results_path (str): путь для сохранения файлов .csv с результатами.
+        - results_path (str): путь для сохранения файлов с результатами.
+        - cache (FeatureCache): кэш уменьшенных копий изображений между запусками.
+        - backend (str): способ вычисления метрик:
+            - "pairwise": вызов функции метрики для каждой пары изображений.
+            - "batched": каждое изображение декодируется один раз в общий массив float32,
+            матрицы MSE, PSNR и NRMSE считаются одним матричным умножением
+            (‖a‖² + ‖b‖² − 2ab), MAE - поблочно, SSIM - по заранее посчитанным локальным
+            средним и дисперсиям каждого изображения. Остальные метрики считаются попарно.
+        - n_workers (int): количество потоков для параллельного вычисления тайлов матрицы
+        (по умолчанию - количество ядер процессора).
+        - tile_size (int): размер стороны тайла матрицы, распределяемого между потоками.
+        - dtype (object): тип элементов матриц метрик (PixToPix - всегда bool).
+        - memmap_path (str): директория для матриц, отображённых в память (np.memmap,
+        файлы <метрика>.npy) - для матриц, не помещающихся в оперативную память.
+        - results_format (str): формат сохранения результатов ("csv", "npy", "npz", "parquet").
+        - memory_budget (int): допустимый объём загруженных изображений в байтах. Если задан,
+        датасеты сравниваются блоками, умещающимися в этот объём (см. pairwise.run_blocks),
+        и полностью в память не загружаются.
+        - state_path (str): директория для сохранения промежуточных результатов. Матрица
+        каждой метрики сохраняется по тайлам в <state_path>/<метрика> (см. Checkpoint).
+        - resume (bool): продолжить прерванные вычисления по сохранённому состоянию
+        (готовые тайлы не пересчитываются, если датасеты и параметры не изменились).
 
     Метрики:
     --------
@@ -47,23 +88,44 @@ class Metrics(object):
 
     Методы:
     -------
-    - pix2pix(self, resize_images: bool = True, to_csv: bool = False, echo: bool = False) -> list[bool]
+    - pix2pix(self, resize_images: bool = True, to_csv: bool = False, echo: bool = False) -> np.ndarray
       Попиксельное сравнение двух изображений.
-    - mse(self, resize_images: bool = True, to_csv: bool = False, echo: bool = False) -> list[float]
+    - mse(self, resize_images: bool = True, to_csv: bool = False, echo: bool = False) -> np.ndarray
       Вычисляет среднеквадратичную ошибку между изображениями.
-    - nrmse(self, resize_images: bool = True, to_csv: bool = False, echo: bool = False) -> list[float]
+    - nrmse(self, resize_images: bool = True, to_csv: bool = False, echo: bool = False) -> np.ndarray
       Вычисляет нормализованную среднеквадратическую ошибку.
-    - ssim(self, resize_images: bool = True, to_csv: bool = False, echo: bool = False) -> list[float]
+    - ssim(self, resize_images: bool = True, to_csv: bool = False, echo: bool = False) -> np.ndarray
       Вычисляет структурное сходство изображений.
-    - psnr(self, resize_images: bool = True, to_csv: bool = False, echo: bool = False) -> list[float]
+    - psnr(self, resize_images: bool = True, to_csv: bool = False, echo: bool = False) -> np.ndarray
       Вычисляет отношение максимального значения сигнала к шуму.
-    - mae(self, resize_images: bool = True, to_csv: bool = False, echo: bool = False) -> list[float]
+    - mae(self, resize_images: bool = True, to_csv: bool = False, echo: bool = False) -> np.ndarray
       Вычисляет среднюю абсолютную ошибку между изображениями.
-    - nmi(self, resize_images: bool = True, to_csv: bool = False, echo: bool = False) -> list[float]
+    - nmi(self, resize_images: bool = True, to_csv: bool = False, echo: bool = False) -> np.ndarray
       Вычисляет нормализованный показатель взаимной информации.
     """
 
-    def __init__(self, Dataset1: Dataset, Dataset2: Dataset, results_path: str = ""):
+    def __init__(
+        self,
+        Dataset1: Dataset,
+        Dataset2: Dataset,
+        results_path: str = "",
+        cache: FeatureCache = None,
+        backend: str = "pairwise",
+        n_workers: int = None,
+        tile_size: int = 32,
+        dtype: object = np.float32,
+        memmap_path: str = None,
+        results_format: str = "csv",
+        memory_budget: int = None,
+        state_path: str = None,
+        resume: bool = False,
+    ):
+        if backend not in ("pairwise", "batched"):
+            raise ValueError(f"Неизвестный способ вычисления метрик: {backend}")
+
+        if results_format not in RESULT_FORMATS:
+            raise ValueError(f"Неизвестный формат сохранения: {results_format}")
+
         self.methods = {
             "pix2pix": self.pix2pix,
             "mae": self.mae,
@@ -78,6 +140,16 @@ class Metrics(object):
         self.Dataset2 = Dataset2
 
         self.results_path = results_path
+        self.cache = cache
+        self.backend = backend
+        self.n_workers = n_workers
+        self.tile_size = tile_size
+        self.dtype = dtype
+        self.memmap_path = memmap_path
+        self.results_format = results_format
+        self.memory_budget = memory_budget
+        self.state_path = state_path
+        self.resume = resume
 
         self.ranges = {
             "mae": {
@@ -111,137 +183,829 @@ class Metrics(object):
         resize_images: bool = True,
         to_csv: bool = False,
         echo: bool = False,
-    ) -> list[bool]:
+    ) -> np.ndarray:
 
-        return self._calculate(np.array_equal, resize_images, to_csv, echo)
+        return self._calculate(
+            np.array_equal, resize_images, to_csv, echo, diagonal=True, dtype=np.bool_
+        )
 
     def mae(
         self,
         resize_images: bool = True,
         to_csv: bool = False,
         echo: bool = False,
-    ) -> list[float]:
+    ) -> np.ndarray:
 
-        return self._calculate(mae_skimage, resize_images, to_csv, echo)
+        return self._calculate(
+            mae_skimage,
+            resize_images,
+            to_csv,
+            echo,
+            batched_kernel=_mae_kernel,
+            diagonal=0.0,
+        )
 
     def mse(
         self,
         resize_images: bool = True,
         to_csv: bool = False,
         echo: bool = False,
-    ) -> list[float]:
+    ) -> np.ndarray:
 
-        return self._calculate(mse_sklearn, resize_images, to_csv, echo)
+        return self._calculate(
+            mse_sklearn,
+            resize_images,
+            to_csv,
+            echo,
+            batched_kernel=_mse_kernel,
+            diagonal=0.0,
+        )
 
     def nrmse(
         self,
         resize_images: bool = True,
         to_csv: bool = False,
         echo: bool = False,
-    ) -> list[float]:
+    ) -> np.ndarray:
 
-        return self._calculate(nrmse_skimage, resize_images, to_csv, echo)
+        return self._calculate(
+            nrmse_skimage,
+            resize_images,
+            to_csv,
+            echo,
+            batched_kernel=_nrmse_kernel,
+            diagonal=0.0,
+            normalized=True,
+        )
 
     def ssim(
         self,
         resize_images: bool = True,
         to_csv: bool = False,
         echo: bool = False,
-    ) -> list[float]:
+    ) -> np.ndarray:
 
         ssim_partial = partial(ssim_skimage, win_size=3)
         ssim_partial.__name__ = "structural_similarity_index"
 
-        return self._calculate(ssim_partial, resize_images, to_csv, echo)
+        return self._calculate(
+            ssim_partial,
+            resize_images,
+            to_csv,
+            echo,
+            batched_kernel=_ssim_kernel,
+            diagonal=1.0,
+        )
 
     def psnr(
         self,
         resize_images: bool = True,
         to_csv: bool = False,
         echo: bool = False,
-    ) -> list[float]:
+    ) -> np.ndarray:
 
-        return self._calculate(psnr_skimage, resize_images, to_csv, echo)
+        return self._calculate(
+            psnr_skimage,
+            resize_images,
+            to_csv,
+            echo,
+            batched_kernel=_psnr_kernel,
+            diagonal=np.inf,
+        )
 
     def nmi(
         self,
         resize_images: bool = True,
         to_csv: bool = False,
         echo: bool = False,
-    ) -> list[float]:
+    ) -> np.ndarray:
 
         return self._calculate(nmi_skimage, resize_images, to_csv, echo)
 
+    def compare_pairs(
+        self,
+        metric_name: str,
+        pairs: np.ndarray,
+        resize_images: bool = True,
+        echo: bool = False,
+    ) -> np.ndarray:
+        """
+        Вычисляет метрику только для указанных пар изображений (например, для пар-кандидатов,
+        найденных по хэшам), не перебирая всю матрицу. Каждое изображение читается один раз.
+
+        Parameters:
+            - metric_name (str): название метрики (см. methods).
+            - pairs (np.ndarray): массив размера (кол-во пар, 2) с индексами изображений
+            первого и второго датасетов.
+            - resize_images (bool): уменьшать ли изображения перед сравнением.
+            - echo (bool): логирование в консоль.
+
+        Returns:
+            - np.ndarray: значения метрики для каждой пары.
+        """
+
+        started = time.perf_counter()
+        metric_function = _PAIR_FUNCTIONS[metric_name]
+        pairs = np.asarray(pairs, dtype=np.int64).reshape(-1, 2)
+
+        images1, images2 = self.Dataset1.images, self.Dataset2.images
+        needed1 = np.unique(pairs[:, 0]).tolist()
+        needed2 = np.unique(pairs[:, 1]).tolist()
+
+        cpu_count = os.cpu_count() or 1
+        n_workers = self.n_workers or cpu_count
+
+        # Как и в run_tiles: потоки пула делят ядра с потоками OpenCV и BLAS
+        with limit_threads(max(1, cpu_count // n_workers)):
+            with ThreadPoolExecutor(max_workers=n_workers) as executor:
+
+                def read(images: list[Image], indices: np.ndarray) -> dict:
+                    arrays = executor.map(
+                        lambda i: self._read(images[i], resize_images), indices
+                    )
+                    return dict(zip(indices, arrays))
+
+                arrays1, arrays2 = read(images1, needed1), read(images2, needed2)
+
+                def compare(pair):
+                    i, j = pair
+                    first, second = arrays1[i], arrays2[j]
+
+                    if first.shape != second.shape:
+                        first, second = self._read_pair(
+                            images1[i], images2[j], resize_images
+                        )
+
+                    with stage("compare"):
+                        return metric_function(first, second)
+
+                values = list(executor.map(compare, pairs.tolist()))
+
+        count("pairs", len(pairs))
+
+        if echo:
+            _echo_compared(len(pairs), started)
+
+        return np.array(values, dtype=bool if metric_name == "pix2pix" else np.float64)
+
+    def top_k(
+        self,
+        k: int = 5,
+        threshold: float = None,
+        metric_name: str = "ssim",
+        resize_images: bool = True,
+        echo: bool = False,
+    ) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """
+        Находит для каждого изображения первого датасета k наиболее похожих изображений
+        второго датасета по метрике. Матрица метрики не хранится целиком: она вычисляется
+        по тайлам, и после каждого тайла остаются только k лучших совпадений для каждого
+        изображения.
+
+        Parameters:
+            - k (int): количество наиболее похожих изображений.
+            - threshold (float): пороговое значение метрики: минимальное для метрик сходства
+            (PixToPix, SSIM, PSNR, NMI) и максимальное для метрик ошибки (MAE, MSE, NRMSE).
+            - metric_name (str): название метрики (см. methods).
+            - resize_images (bool): уменьшать ли изображения перед сравнением.
+            - echo (bool): логирование в консоль.
+
+        Returns:
+            - tuple[np.ndarray, np.ndarray, np.ndarray]: индексы изображений первого датасета,
+            индексы найденных изображений второго датасета и значения метрики, от наиболее
+            к наименее похожему для каждого изображения. При сравнении датасета с самим
+            собой изображение не считается совпадением с самим собой.
+        """
+
+        started = time.perf_counter()
+        symmetric = is_self_comparison(self.Dataset1, self.Dataset2)
+        normalized = metric_name in _NORMALIZED_METRICS
+        batched_kernel = _BATCHED_KERNELS.get(metric_name)
+        largest = metric_name in _SIMILARITY_METRICS
+
+        if self.memory_budget is not None:
+            top = TopK(len(self.Dataset1.images), k, largest, threshold)
+
+            self._run_blocks(
+                _PAIR_FUNCTIONS[metric_name],
+                batched_kernel,
+                normalized,
+                resize_images,
+                echo,
+                lambda rows, cols, values: top.push(rows, cols, values, symmetric),
+            )
+
+            matches = top.result()
+
+        else:
+            if self.backend == "batched" and batched_kernel is not None:
+                calculate_tile, symmetric, mirror = self._batched_tiles(
+                    batched_kernel, resize_images, echo, normalized
+                )
+            else:
+                calculate_tile, mirror = self._pairwise_tiles(
+                    _PAIR_FUNCTIONS[metric_name],
+                    resize_images,
+                    _IDENTITY_VALUES.get(metric_name),
+                    normalized,
+                    symmetric,
+                )
+
+            matches = run_top_k(
+                calculate_tile,
+                len(self.Dataset1.images),
+                len(self.Dataset2.images),
+                k,
+                self.tile_size,
+                self.n_workers,
+                largest=largest,
+                threshold=threshold,
+                symmetric=symmetric,
+                mirror=mirror,
+                exclude_diagonal=symmetric,
+            )
+
+        if echo:
+            _echo_compared(len(self.Dataset1.images) * len(self.Dataset2.images), started)
+
+        return matches
+
     def _calculate(
         self,
         metric_function: object,
         resize_images: bool = True,
         to_csv: bool = False,
         echo: bool = False,
-    ) -> list[list]:
+        batched_kernel: object = None,
+        diagonal: object = None,
+        normalized: bool = False,
+        dtype: object = None,
+    ) -> np.ndarray:
+        """
+        Вычисляет матрицу метрики для всех пар изображений. При сравнении датасета с самим
+        собой вычисляются только пары над главной диагональью, остальные заполняются отражением.
 
-        result_matrix = []
+        Parameters:
+            - metric_function (object): функция метрики для пары изображений.
+            - resize_images (bool): уменьшать ли изображения перед сравнением.
+            - to_csv (bool): опция сохранения результатов в файл (в формате results_format).
+            - echo (bool): логирование в консоль.
+            - batched_kernel (object): пакетное ядро метрики для backend="batched".
+            - diagonal (object): значение метрики для изображения с самим собой
+            (None - вычисляется).
+            - normalized (bool): метрика нормирована по первому изображению пары (NRMSE),
+            отражённые значения пересчитываются по отношению норм изображений.
+            - dtype (object): тип элементов матрицы (по умолчанию - self.dtype).
 
-        with ThreadPoolExecutor() as executor:
-            for first_image in self.Dataset1.images:
+        Returns:
+            - np.ndarray: матрица значений метрики размера (кол-во изображений 1,
+            кол-во изображений 2); np.memmap, если задан memmap_path.
+        """
 
-                row = []
+        started = time.perf_counter()
+        name = metric_function.__name__
+        shape = (len(self.Dataset1.images), len(self.Dataset2.images))
+        checkpoint = self._checkpoint(name, shape, dtype or self.dtype, resize_images)
 
-                for second_image in self.Dataset2.images:
-                    if echo:
-                        color_print(
-                            "log",
-                            "log",
-                            f"Сравниваем изображения: {first_image.filename} и {second_image.filename}.",
-                        )
+        if checkpoint is not None:
+            result_matrix = checkpoint.matrix
+        else:
+            path = None
 
-                    # Субмитим задачу в ThreadPoolExecutor
-                    if resize_images:
-                        value = metric_function(
-                            first_image.read_and_resize(),
-                            second_image.read_and_resize(),
-                        )
-                    else:
-                        value = metric_function(
-                            first_image._read_flatten(),
-                            second_image._read_flatten(),
-                        )
+            if self.memmap_path:
+                path = os.path.join(self.memmap_path, f"{name}.npy")
+
+            result_matrix = allocate_matrix(shape, dtype or self.dtype, path)
+
+        if self.memory_budget is not None:
+
+            def store(rows: slice, cols: slice, values: np.ndarray) -> None:
+                result_matrix[rows, cols] = values
 
-                    row.append(value)
+            self._run_blocks(
+                metric_function,
+                batched_kernel,
+                normalized,
+                resize_images,
+                echo,
+                store,
+                checkpoint,
+            )
 
-                result_matrix.append(row)
+        elif self.backend == "batched" and batched_kernel is not None:
+            self._calculate_batched(
+                batched_kernel,
+                resize_images,
+                echo,
+                normalized,
+                out=result_matrix,
+                checkpoint=checkpoint,
+            )
+
+        else:
+            symmetric = is_self_comparison(self.Dataset1, self.Dataset2)
+            calculate_tile, mirror = self._pairwise_tiles(
+                metric_function, resize_images, diagonal, normalized, symmetric
+            )
+
+            run_tiles(
+                calculate_tile,
+                len(self.Dataset1.images),
+                len(self.Dataset2.images),
+                self.tile_size,
+                self.n_workers,
+                symmetric=symmetric,
+                mirror=mirror,
+                out=result_matrix,
+                checkpoint=checkpoint,
+            )
+
+        if echo:
+            _echo_compared(result_matrix.size, started)
 
         if to_csv:
-            self.save(metric_function.__name__, result_matrix)
+            self.save(name, result_matrix)
 
         return result_matrix
 
-    def show(self, metric_values: list[list]) -> None:
+    def _checkpoint(
+        self, name: str, shape: tuple, dtype: object, resize_images: bool
+    ) -> Checkpoint:
+        """
+        Создаёт состояние вычисления матрицы метрики (или None, если state_path не задан).
+        Отпечаток включает состав обоих датасетов и все параметры, влияющие на разбиение
+        матрицы на тайлы и на значения метрики.
+        """
+
+        if self.state_path is None:
+            return None
+
+        fingerprint = {
+            "datasets": [self.Dataset1.fingerprint(), self.Dataset2.fingerprint()],
+            "metric": name,
+            "resize_images": resize_images,
+            "backend": self.backend,
+            "tile_size": self.tile_size,
+            "memory_budget": self.memory_budget,
+        }
+
+        return Checkpoint(
+            os.path.join(self.state_path, name), shape, dtype, fingerprint, self.resume
+        )
+
+    def _pairwise_tiles(
+        self,
+        metric_function: object,
+        resize_images: bool,
+        diagonal: object,
+        normalized: bool,
+        symmetric: bool,
+    ) -> tuple:
+        """
+        Создаёт функцию вычисления тайла матрицы метрики вызовом metric_function для каждой
+        пары изображений и функцию отражения тайлов для нормированных метрик.
+
+        Returns:
+            - tuple: (функция тайла по срезам строк и столбцов, функция отражения или None).
+        """
+
+        # Нормы изображений для отражения нормированных метрик
+        norms = {}
+        mirror = mirror_normalized(norms) if normalized else None
+
+        def calculate_tile(rows: slice, cols: slice) -> np.ndarray:
+            # Каждое изображение тайла читается один раз
+            first_images = self.Dataset1.images[rows]
+            second_images = self.Dataset2.images[cols]
+            second_arrays = [self._read(image, resize_images) for image in second_images]
+
+            diagonal_tile = symmetric and rows == cols
+            tile = np.empty((len(first_images), len(second_images)), dtype=object)
+
+            for i, first_image in enumerate(first_images):
+                if diagonal_tile:
+                    first_array = second_arrays[i]
+                else:
+                    first_array = self._read(first_image, resize_images)
+
+                if normalized:
+                    norms[rows.start + i] = _rms(first_array)
+
+                for j, second_image in enumerate(second_images):
+                    if diagonal_tile and j <= i:
+                        if j == i:
+                            tile[i, j] = (
+                                diagonal
+                                if diagonal is not None
+                                else metric_function(first_array, first_array)
+                            )
+
+                        continue
+
+                    second_array = second_arrays[j]
+
+                    # Изображения разного размера приводятся к размеру первого
+                    if first_array.shape != second_array.shape:
+                        tile[i, j] = metric_function(
+                            *self._read_pair(first_image, second_image, resize_images)
+                        )
+                        continue
+
+                    tile[i, j] = metric_function(first_array, second_array)
+
+            if normalized:
+                for j, second_array in enumerate(second_arrays):
+                    norms[cols.start + j] = _rms(second_array)
+
+            if diagonal_tile:
+                # Нижний треугольник диагонального тайла - отражение верхнего
+                lower = np.tril_indices(len(tile), k=-1)
+                mirrored = tile.T.copy()
+                mirrored[np.triu_indices(len(tile))] = 0
+
+                if mirror is not None:
+                    mirrored = mirror(mirrored, rows, cols)
+
+                tile[lower] = mirrored[lower]
+
+            return tile
+
+        return calculate_tile, mirror
+
+    def _calculate_batched(
+        self,
+        batched_kernel: object,
+        resize_images: bool,
+        echo: bool = False,
+        normalized: bool = False,
+        out: np.ndarray = None,
+        checkpoint: Checkpoint = None,
+    ) -> np.ndarray:
+        """
+        Вычисляет матрицу метрики для всех пар изображений сразу.
+
+        Parameters:
+            - batched_kernel (object): функция, принимающая два стека изображений
+            и диапазон значений пикселей, один раз подготавливающая общие для всех пар
+            данные и возвращающая функцию вычисления тайла матрицы по срезам строк и столбцов.
+            - resize_images (bool): уменьшать ли изображения перед сравнением.
+            - echo (bool): логирование в консоль.
+            - normalized (bool): метрика нормирована по первому изображению пары.
+            - out (np.ndarray): матрица для записи результата.
+            - checkpoint (Checkpoint): состояние вычисления.
+
+        Returns:
+            - np.ndarray: матрица значений метрики.
+        """
+
+        calculate_tile, symmetric, mirror = self._batched_tiles(
+            batched_kernel, resize_images, echo, normalized
+        )
+
+        return run_tiles(
+            calculate_tile,
+            len(self.Dataset1.images),
+            len(self.Dataset2.images),
+            self.tile_size,
+            self.n_workers,
+            symmetric=symmetric,
+            mirror=mirror,
+            out=out,
+            checkpoint=checkpoint,
+        )
+
+    def _batched_tiles(
+        self,
+        batched_kernel: object,
+        resize_images: bool,
+        echo: bool = False,
+        normalized: bool = False,
+    ) -> tuple:
+        """
+        Загружает стеки изображений и создаёт функцию вычисления тайла пакетным ядром.
+
+        Returns:
+            - tuple: (функция тайла, признак сравнения датасета с самим собой,
+            функция отражения или None).
+        """
+
+        stack1, stack2, data_range = self._load_stacks(resize_images)
+
+        if echo:
+            color_print(
+                "log",
+                "log",
+                f"Сравниваем {len(stack1)} x {len(stack2)} изображений ({stack1.shape[1]} значений в каждом).",
+            )
+
+        symmetric = stack1 is stack2
+        mirror = None
+
+        if symmetric and normalized:
+            mirror = mirror_normalized(
+                np.sqrt(
+                    np.einsum("ij,ij->i", stack1, stack1, dtype=np.float64)
+                    / stack1.shape[1]
+                )
+            )
+
+        return batched_kernel(stack1, stack2, data_range), symmetric, mirror
+
+    def _run_blocks(
+        self,
+        metric_function: object,
+        batched_kernel: object,
+        normalized: bool,
+        resize_images: bool,
+        echo: bool,
+        sink: object,
+        checkpoint: Checkpoint = None,
+    ) -> None:
+        """
+        Вычисляет матрицу метрики блоками изображений, умещающимися в memory_budget,
+        и передаёт значения тайлов в sink. Изображения блока декодируются один раз:
+        в стек float32 для пакетного ядра или в список массивов для попарного вычисления.
+
+        Parameters:
+            - metric_function (object): функция метрики для пары изображений.
+            - batched_kernel (object): пакетное ядро метрики (для backend="batched").
+            - normalized (bool): метрика нормирована по первому изображению пары.
+            - resize_images (bool): уменьшать ли изображения перед сравнением.
+            - echo (bool): логирование в консоль.
+            - sink (object): функция, принимающая срезы строк и столбцов и значения тайла.
+            - checkpoint (Checkpoint): состояние вычисления.
+        """
+
+        images1, images2 = self.Dataset1.images, self.Dataset2.images
+
+        if not images1 or not images2:
+            return
+
+        symmetric = is_self_comparison(self.Dataset1, self.Dataset2)
+        batched = self.backend == "batched" and batched_kernel is not None
+        shape = self._common_size(resize_images)
+
+        reference = self._read_resized(images1[0], resize_images, shape)
+        data_range = dtype_range[reference.dtype.type][1]
+
+        # Величины изображений, не зависящие от пары (см. _STACK_STATISTICS)
+        statistics = _STACK_STATISTICS.get(batched_kernel) if batched else None
+
+        # Нормы изображений первого датасета для отражения нормированных метрик
+        norms = {}
+
+        def loader(images: list[Image]) -> object:
+            def load(block: slice) -> object:
+                arrays = []
+
+                for i, image in zip(range(block.start, block.stop), images[block]):
+                    array = self._read_resized(image, resize_images, shape)
+
+                    if normalized and symmetric:
+                        norms[i] = _rms(array)
+
+                    arrays.append(array)
+
+                if not batched:
+                    return arrays
+
+                stack = np.empty((len(arrays), reference.size), dtype=np.float32)
+                for i, array in enumerate(arrays):
+                    stack[i] = array
+
+                if statistics is None:
+                    return stack
+
+                # Величины изображений блока считаются один раз на загрузку блока
+                return stack, statistics(stack, data_range)
+
+            return load
+
+        def prepare(first: object, second: object) -> object:
+            if batched and statistics is not None:
+                # Для диагональной пары блоков first и second - один и тот же объект
+                (first, statistics1), (second, statistics2) = first, second
+
+                return batched_kernel(
+                    first,
+                    second,
+                    data_range,
+                    statistics1=statistics1,
+                    statistics2=statistics2,
+                )
+
+            if batched:
+                return batched_kernel(first, second, data_range)
+
+            def calculate_tile(rows: slice, cols: slice) -> np.ndarray:
+                first_arrays, second_arrays = first[rows], second[cols]
+                tile = np.empty((len(first_arrays), len(second_arrays)), dtype=object)
+
+                for i, first_array in enumerate(first_arrays):
+                    for j, second_array in enumerate(second_arrays):
+                        tile[i, j] = metric_function(first_array, second_array)
+
+                return tile
+
+            return calculate_tile
+
+        item_bytes = reference.size * (4 if batched else reference.itemsize)
+
+        loads = run_blocks(
+            loader(images1),
+            loader(images2),
+            prepare,
+            len(images1),
+            len(images2),
+            item_bytes,
+            item_bytes,
+            self.memory_budget,
+            sink,
+            self.tile_size,
+            self.n_workers,
+            symmetric=symmetric,
+            mirror=mirror_normalized(norms) if normalized and symmetric else None,
+            checkpoint=checkpoint,
+        )
+
+        if echo:
+            color_print(
+                "log",
+                "log",
+                f"Сравнено {len(images1)} x {len(images2)} изображений, загрузок блоков: {loads}.",
+            )
+
+    def _common_size(self, resize_images: bool) -> tuple:
+        """
+        Определяет по заголовкам файлов форму, с которой строятся стеки изображений
+        обоих датасетов: общую форму декодированных изображений или, если формы
+        различаются, форму _target_size.
+
+        Returns:
+            - tuple: (высота, ширина, каналы) изображений в стеках.
+        """
+
+        images = self.Dataset1.images + self.Dataset2.images
+        shapes = {self._decoded_shape(image, resize_images) for image in images}
+
+        if len(shapes) == 1:
+            return shapes.pop()
+
+        return self._target_size(resize_images)
+
+    def _target_size(self, resize_images: bool) -> tuple:
+        """
+        Форма (высота, ширина, каналы), к которой приводятся изображения разной формы:
+        размер первого изображения первого датасета (после уменьшения до высоты 600)
+        с тремя каналами.
+        """
+
+        height, width, _ = self._decoded_shape(self.Dataset1.images[0], resize_images)
+
+        return height, width, 3
+
+    def _decoded_shape(self, image: Image, resize_images: bool) -> tuple:
+        """
+        Форма (высота, ширина, каналы) изображения, прочитанного _read, по заголовку файла.
+        """
+
+        if resize_images:
+            return 600, int(image.width * 600 / image.height), image.channel
+
+        return image.height, image.width, 3
+
+    def _read_resized(
+        self, image: Image, resize_images: bool, shape: tuple
+    ) -> np.ndarray:
+        """
+        Читает изображение в виде одномерного массива формы shape (высота, ширина, каналы):
+        изображения другой формы приводятся к ней.
+        """
+
+        if self._decoded_shape(image, resize_images) == shape:
+            array = self._read(image, resize_images)
+
+            # Размер из заголовка может не совпасть с декодированным изображением
+            if array is not None and array.size == np.prod(shape):
+                return array
+
+        height, width, channels = shape
+
+        with stage("resize"):
+            array = cv2.resize(
+                image.read_reduced(width, height, grayscale=channels == 1),
+                (width, height),
+            )
+
+        # Уменьшенные изображения _read возвращает в порядке каналов RGB
+        if resize_images and channels == 3:
+            array = cv2.cvtColor(array, cv2.COLOR_BGR2RGB)
+
+        return array.ravel()
+
+    def _load_stacks(self, resize_images: bool) -> tuple:
+        """
+        Декодирует каждое изображение обоих датасетов один раз и складывает их в массивы
+        float32 размера (кол-во изображений, кол-во значений). Если формы изображений
+        различаются, все изображения приводятся к форме _common_size.
+
+        Returns:
+            - tuple: (стек первого датасета, стек второго датасета, диапазон значений пикселей).
+        """
+
+        same_dataset = is_self_comparison(self.Dataset1, self.Dataset2)
+        images = self.Dataset1.images + ([] if same_dataset else self.Dataset2.images)
+
+        shape = self._common_size(resize_images)
+        arrays = [self._read_resized(image, resize_images, shape) for image in images]
+
+        data_range = dtype_range[arrays[0].dtype.type][1]
+
+        stack = np.empty((len(arrays), arrays[0].size), dtype=np.float32)
+        for i, array in enumerate(arrays):
+            stack[i] = array
+
+        count1 = len(self.Dataset1.images)
+
+        if same_dataset:
+            return stack, stack, data_range
+
+        return stack[:count1], stack[count1:], data_range
+
+    def _read(self, image: Image, resize_images: bool) -> np.ndarray:
+        """
+        Читает изображение в виде одномерного массива, уменьшенные копии берутся из кэша.
+        """
+
+        if not resize_images:
+            return image._read_flatten()
+
+        if self.cache is None:
+            return image.read_and_resize()
+
+        return self.cache.get_or_compute(
+            image, "thumbnail", image.read_and_resize, {"decode": "draft"}
+        )
+
+    def _read_pair(
+        self, first: Image, second: Image, resize_images: bool
+    ) -> tuple[np.ndarray, np.ndarray]:
+        """
+        Читает пару изображений разного размера, приводя второе к размеру первого.
+        """
+
+        height, width = first.height, first.width
+
+        if resize_images:
+            width, height = int(width * 600 / height), 600
+
+        with stage("resize"):
+            return tuple(
+                cv2.resize(image.read_reduced(width, height), (width, height)).ravel()
+                for image in (first, second)
+            )
+
+    def show(self, metric_values: np.ndarray) -> None:
         """
         Функция для отображения результата сравнения по метрике в виде тепловой матрицы.
 
         Parameters:
-            - metric_values (list[list]): матрица сравнения по выбранной метрике.
-            - filename (string): название файла для сохранения.
+            - metric_values (np.ndarray): матрица сравнения по выбранной метрике.
         """
 
         plt.imshow(metric_values, cmap="viridis", interpolation="nearest")
         plt.colorbar()
         plt.show()
 
-    def save(self, filename: str, metric_values: list[list]) -> None:
+    def save(
+        self, filename: str, metric_values: np.ndarray, file_format: str = None
+    ) -> str:
         """
-        Сохраняет матрицу с результатами сравнения по метрике в csv файл.
+        Сохраняет матрицу с результатами сравнения по метрике. Строки матрицы соответствуют
+        изображениям первого датасета, столбцы - второго, как и в возвращаемой матрице.
+
+        В ранних версиях CSV подписывался наоборот (столбцы - названия изображений первого
+        датасета, строки - второго), хотя значения в строках относились к первому датасету;
+        при датасетах разного размера сохранение завершалось ошибкой. Теперь подписи
+        строк и столбцов совпадают с расположением значений.
 
         Parameters:
-            - filename (string): название файла .csv без расширения.
-            - metric_values (list[list]): матрица сравнения по выбранной метрике.
+            - filename (string): название файла без расширения.
+            - metric_values (np.ndarray): матрица сравнения по выбранной метрике.
+            - file_format (str): формат файла ("csv", "npy", "npz", "parquet");
+            по умолчанию - results_format.
+
+        Returns:
+            - str: путь к сохранённому файлу.
         """
-        columns = [image.filename for image in self.Dataset1.images]
-        index = [image.filename for image in self.Dataset2.images]
 
-        df = pd.DataFrame(metric_values, columns=columns, index=index)
-        df.to_csv(rf"{self.results_path}/{filename}.csv")
+        return save_matrix(
+            f"{self.results_path}/{filename}",
+            metric_values,
+            self.Dataset1.relpaths,
+            self.Dataset2.relpaths,
+            file_format or self.results_format,
+        )
 
     class RangeMask:
         def __init__(self, lower_bound=None, upper_bound=None):
@@ -249,7 +1013,7 @@ class Metrics(object):
             self.upper_bound = upper_bound
 
         def __call__(self, value):
-            if (type(value) == bool) and (value == True):
+            if isinstance(value, (bool, np.bool_)) and value:
                 return True
 
             if ((self.lower_bound != None) and (value <= self.lower_bound)) or (
@@ -260,6 +1024,318 @@ class Metrics(object):
             return True
 
 
+# ==================================================================================================================================
+
+
+# Функции метрик для сравнения отдельных пар изображений
+_PAIR_FUNCTIONS = {
+    "pix2pix": np.array_equal,
+    "mae": mae_skimage,
+    "mse": mse_sklearn,
+    "nrmse": nrmse_skimage,
+    "ssim": partial(ssim_skimage, win_size=3),
+    "psnr": psnr_skimage,
+    "nmi": nmi_skimage,
+}
+
+
+def _echo_compared(pairs: int, started: float) -> None:
+    """
+    Выводит в консоль количество сравнённых пар изображений и время сравнения
+    (одна строка на вычисление вместо строки на каждую пару).
+    """
+
+    elapsed = time.perf_counter() - started
+
+    color_print(
+        "log",
+        "log",
+        f"Сравнено пар изображений: {pairs} за {elapsed:.2f} с "
+        f"({pairs / elapsed if elapsed > 0 else 0:.1f} пар/с).",
+    )
+
+
+def _rms(array: np.ndarray) -> float:
+    """
+    Среднеквадратичное значение изображения (знаменатель NRMSE с нормировкой "euclidean").
+    """
+
+    return float(np.sqrt(np.mean(np.square(array, dtype=np.float64))))
+
+
+def _row_blocks(count: int, size: int, itemsize: int = 8):
+    """
+    Генератор срезов строк, размер которых ограничен _TILE_BYTES.
+    """
+
+    step = max(1, _TILE_BYTES // (itemsize * size))
+
+    for start in range(0, count, step):
+        yield slice(start, min(start + step, count))
+
+
+def _squared_distances_kernel(stack1: np.ndarray, stack2: np.ndarray) -> object:
+    """
+    Квадраты евклидовых расстояний через тождество ‖a‖² + ‖b‖² − 2ab.
+    Из стеков вычитается общее среднее изображение, чтобы уменьшить потерю точности
+    float32 (разности при этом не меняются); нормы считаются один раз для всех тайлов.
+    """
+
+    same = stack2 is stack1
+
+    mean = stack1.sum(axis=0, dtype=np.float64)
+    if not same:
+        mean += stack2.sum(axis=0, dtype=np.float64)
+    mean = (mean / (len(stack1) + (0 if same else len(stack2)))).astype(np.float32)
+
+    def centered_squares(stack):
+        squares = np.empty(len(stack), dtype=np.float64)
+
+        for rows in _row_blocks(len(stack), stack.shape[1]):
+            centered = stack[rows] - mean
+            squares[rows] = np.einsum("ij,ij->i", centered, centered, dtype=np.float64)
+
+        return squares
+
+    squares1 = centered_squares(stack1)
+    squares2 = squares1 if same else centered_squares(stack2)
+
+    def tile(rows: slice, cols: slice) -> np.ndarray:
+        gram = (stack1[rows] - mean) @ (stack2[cols] - mean).T
+
+        sums = squares1[rows, None] + squares2[None, cols]
+        squared = np.maximum(sums - 2.0 * gram, 0.0)
+
+        # Для почти совпадающих изображений ошибка округления сравнима с самим расстоянием,
+        # поэтому такие пары пересчитываются напрямую в float64 (совпадающие дают ровно 0)
+        for i, j in zip(*np.nonzero(squared <= 1e-4 * sums)):
+            difference = stack1[rows][i].astype(np.float64) - stack2[cols][j]
+            squared[i, j] = difference @ difference
+
+        return squared
+
+    return tile
+
+
+def _mse_kernel(stack1: np.ndarray, stack2: np.ndarray, data_range: float) -> object:
+    squared = _squared_distances_kernel(stack1, stack2)
+    size = stack1.shape[1]
+
+    return lambda rows, cols: squared(rows, cols) / size
+
+
+def _psnr_kernel(stack1: np.ndarray, stack2: np.ndarray, data_range: float) -> object:
+    mse = _mse_kernel(stack1, stack2, data_range)
+
+    def tile(rows: slice, cols: slice) -> np.ndarray:
+        with np.errstate(divide="ignore"):
+            return 10 * np.log10((data_range**2) / mse(rows, cols))
+
+    return tile
+
+
+def _nrmse_kernel(stack1: np.ndarray, stack2: np.ndarray, data_range: float) -> object:
+    mse = _mse_kernel(stack1, stack2, data_range)
+
+    # Нормировка "euclidean" из skimage: по среднеквадратичному значению первого изображения
+    denominator = np.sqrt(
+        np.einsum("ij,ij->i", stack1, stack1, dtype=np.float64) / stack1.shape[1]
+    )
+
+    return lambda rows, cols: np.sqrt(mse(rows, cols)) / denominator[rows, None]
+
+
+def _mae_kernel(stack1: np.ndarray, stack2: np.ndarray, data_range: float) -> object:
+    size = stack1.shape[1]
+
+    def tile(rows: slice, cols: slice) -> np.ndarray:
+        block1, block2 = stack1[rows], stack2[cols]
+        result = np.empty((len(block1), len(block2)), dtype=np.float64)
+
+        # Массив разностей (строки, столбцы, size) ограничен _TILE_BYTES
+        for i in _row_blocks(len(block1), len(block2) * size, itemsize=4):
+            difference = np.abs(block1[i, None, :] - block2[None, :, :])
+            result[i] = difference.mean(axis=2, dtype=np.float64)
+
+        return result
+
+    return tile
+
+
+def _ssim_statistics(
+    stack: np.ndarray, data_range: float, win_size: int = 3
+) -> tuple:
+    """
+    Локальные величины SSIM каждого изображения стека, не зависящие от второго
+    изображения пары: средние μ и слагаемые знаменателя μ² + C1/2 и σ² + C2/2 (float32).
+    Считаются один раз на стек разделимым равномерным фильтром по всем осям, кроме первой.
+    """
+
+    axes = tuple(range(1, stack.ndim))
+    points = win_size ** len(axes)
+    cov_norm = points / (points - 1)
+
+    c1 = (0.01 * data_range) ** 2
+    c2 = (0.03 * data_range) ** 2
+
+    means = np.empty(stack.shape, dtype=np.float32)
+    squares = np.empty(stack.shape, dtype=np.float32)
+    variances = np.empty(stack.shape, dtype=np.float32)
+
+    for rows in _row_blocks(len(stack), stack[0].size):
+        block = stack[rows].astype(np.float64)
+        mean = _local_mean(block, win_size, axes)
+        square = mean * mean
+        variance = cov_norm * (_local_mean(block * block, win_size, axes) - square)
+
+        means[rows] = mean
+        squares[rows] = square + c1 / 2
+        variances[rows] = variance + c2 / 2
+
+    return means, squares, variances
+
+
+def _ssim_kernel(
+    stack1: np.ndarray,
+    stack2: np.ndarray,
+    data_range: float,
+    win_size: int = 3,
+    statistics1: tuple = None,
+    statistics2: tuple = None,
+) -> object:
+    """
+    Пакетный SSIM, совпадающий с skimage.metrics.structural_similarity при равномерном окне
+    и выборочной ковариации. Локальные величины изображений (см. _ssim_statistics)
+    считаются один раз на стек или передаются готовыми (statistics1, statistics2 -
+    для блоков run_blocks); для каждой пары вычисляется только взаимный член.
+    В диагональном тайле сравнения стека с самим собой считаются только пары
+    над диагональю.
+    """
+
+    axes = tuple(range(1, stack1.ndim))
+    points = win_size ** len(axes)
+    cov_norm = points / (points - 1)
+    pad = (win_size - 1) // 2
+
+    c1 = (0.01 * data_range) ** 2
+    c2 = (0.03 * data_range) ** 2
+
+    same = stack2 is stack1
+
+    if statistics1 is None:
+        statistics1 = _ssim_statistics(stack1, data_range, win_size)
+
+    if statistics2 is None:
+        statistics2 = (
+            statistics1 if same else _ssim_statistics(stack2, data_range, win_size)
+        )
+
+    means1, squares1, variances1 = statistics1
+    means2, squares2, variances2 = statistics2
+
+    crop = (slice(None), slice(None)) + tuple(slice(pad, -pad or None) for _ in axes)
+
+    def tile(rows: slice, cols: slice) -> np.ndarray:
+        block1, block2 = stack1[rows], stack2[cols]
+        result = np.empty((len(block1), len(block2)), dtype=np.float64)
+
+        # SSIM симметричен: нижний треугольник диагонального тайла - отражение верхнего
+        diagonal = same and rows == cols
+
+        for i in _row_blocks(len(block1), len(block2) * block1[0].size):
+            j = slice(i.start + 1 if diagonal else 0, len(block2))
+
+            if j.start >= j.stop:
+                continue
+
+            first, second = block1[i, None], block2[None, j]
+
+            covariance = _local_mean(
+                np.multiply(first, second, dtype=np.float64), win_size, axes
+            )
+            means_product = np.multiply(
+                means1[rows][i, None], means2[cols][None, j], dtype=np.float64
+            )
+
+            # (2 μ1 μ2 + C1) * (2 σ12 + C2)
+            covariance -= means_product
+            covariance *= 2 * cov_norm
+            covariance += c2
+            means_product *= 2
+            means_product += c1
+            numerator = means_product
+            numerator *= covariance
+
+            # (μ1² + μ2² + C1) * (σ1² + σ2² + C2)
+            denominator = np.add(
+                squares1[rows][i, None], squares2[cols][None, j], dtype=np.float64
+            )
+            denominator *= np.add(
+                variances1[rows][i, None], variances2[cols][None, j], dtype=np.float64
+            )
+
+            numerator /= denominator
+            similarity = numerator[crop]
+            result[i, j] = similarity.reshape(*similarity.shape[:2], -1).mean(
+                axis=2, dtype=np.float64
+            )
+
+        if diagonal:
+            lower = np.tril_indices(len(result), k=-1)
+            result[lower] = result.T[lower]
+            np.fill_diagonal(result, _IDENTITY_VALUES["ssim"])
+
+        return result
+
+    return tile
+
+
+def _local_mean(array: np.ndarray, win_size: int, axes: tuple) -> np.ndarray:
+    """
+    Среднее в равномерном окне win_size по указанным осям стека (оси отсчитываются
+    с конца массива, поэтому подходят и для массивов пар с дополнительной осью).
+    """
+
+    ndim = len(axes) + 1
+
+    for axis in axes:
+        array = uniform_filter1d(array, win_size, axis=axis + array.ndim - ndim)
+
+    return array
+
+
+# Пакетные ядра метрик для backend="batched"
+_BATCHED_KERNELS = {
+    "mae": _mae_kernel,
+    "mse": _mse_kernel,
+    "nrmse": _nrmse_kernel,
+    "ssim": _ssim_kernel,
+    "psnr": _psnr_kernel,
+}
+
+# Величины изображений стека, которые пакетное ядро может получить готовыми
+# (statistics1, statistics2), чтобы не пересчитывать их для каждой пары блоков
+_STACK_STATISTICS = {
+    _ssim_kernel: _ssim_statistics,
+}
+
+# Значения метрик для изображения с самим собой (NMI вычисляется)
+_IDENTITY_VALUES = {
+    "pix2pix": True,
+    "mae": 0.0,
+    "mse": 0.0,
+    "nrmse": 0.0,
+    "ssim": 1.0,
+    "psnr": np.inf,
+}
+
+# Метрики, нормированные по первому изображению пары
+_NORMALIZED_METRICS = {"nrmse"}
+
+# Метрики сходства: большее значение означает более похожие изображения
+_SIMILARITY_METRICS = {"pix2pix", "ssim", "psnr", "nmi"}
+
+
 # ==================================================================================================================================
 
 if __name__ == "__main__":
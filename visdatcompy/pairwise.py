@@ -0,0 +1,677 @@
+import os
+import cv2
+import threading
+import numpy as np
+from typing import Callable
+from contextlib import contextmanager
+from threadpoolctl import threadpool_limits
+from concurrent.futures import ThreadPoolExecutor
+
+from visdatcompy.instrumentation import get_stats
+
+
+__all__ = [
+    "iter_tiles",
+    "run_tiles",
+    "run_top_k",
+    "run_blocks",
+    "plan_blocks",
+    "iter_block_pairs",
+    "TopK",
+    "limit_threads",
+    "is_self_comparison",
+    "condense",
+    "mirror_normalized",
+]
+
+
+# ==================================================================================================================================
+# |                                                            PAIRWISE                                                            |
+# ==================================================================================================================================
+
+
+def iter_tiles(n_rows: int, n_cols: int, tile_size: int, upper: bool = False):
+    """
+    Генератор для разбиения матрицы попарных сравнений на прямоугольные блоки (тайлы).
+
+    Parameters:
+        - n_rows (int): количество строк матрицы (изображений первого датасета).
+        - n_cols (int): количество столбцов матрицы (изображений второго датасета).
+        - tile_size (int): размер стороны тайла.
+        - upper (bool): только тайлы на главной диагонали и выше неё.
+
+    Returns:
+        - tuple[slice, slice]: срезы строк и столбцов очередного тайла.
+    """
+
+    for row in range(0, n_rows, tile_size):
+        for col in range(row if upper else 0, n_cols, tile_size):
+            yield (
+                slice(row, min(row + tile_size, n_rows)),
+                slice(col, min(col + tile_size, n_cols)),
+            )
+
+
+# ==================================================================================================================================
+
+
+# Количество потоков OpenCV и BLAS/OpenMP задаётся для всего процесса, поэтому
+# вложенные и одновременные вызовы limit_threads учитываются счётчиком под блокировкой.
+_threads_lock = threading.Lock()
+_threads_users = 0
+_threads_limit = None
+_threads_previous = None
+_threads_limiter = None
+
+
+@contextmanager
+def limit_threads(n_threads: int):
+    """
+    Контекстный менеджер, ограничивающий количество потоков OpenCV и BLAS/OpenMP,
+    чтобы параллельные обработчики не перегружали процессор.
+
+    Ограничение действует на весь процесс (cv2.setNumThreads, threadpoolctl), а не только
+    на вызывающий поток. Вложенные и одновременные вызовы из разных потоков допустимы:
+    пока активен хотя бы один из них, действует наименьшее из запрошенных ограничений,
+    а исходные значения восстанавливаются при выходе из последнего.
+
+    Parameters:
+        - n_threads (int): количество потоков, доступное каждой библиотеке.
+    """
+
+    global _threads_users, _threads_limit, _threads_previous, _threads_limiter
+
+    with _threads_lock:
+        if _threads_users == 0:
+            _threads_previous = cv2.getNumThreads()
+            _threads_limit = n_threads
+            cv2.setNumThreads(n_threads)
+            _threads_limiter = threadpool_limits(limits=n_threads)
+
+        elif n_threads < _threads_limit:
+            _threads_limit = n_threads
+            cv2.setNumThreads(n_threads)
+            # Исходные значения уже сохранены в _threads_limiter
+            threadpool_limits(limits=n_threads)
+
+        _threads_users += 1
+
+    try:
+        yield
+    finally:
+        with _threads_lock:
+            _threads_users -= 1
+
+            if _threads_users == 0:
+                _threads_limiter.restore_original_limits()
+                cv2.setNumThreads(_threads_previous)
+                _threads_limit = _threads_previous = _threads_limiter = None
+
+
+# ==================================================================================================================================
+
+
+def run_tiles(
+    tile_function: Callable[[slice, slice], np.ndarray],
+    n_rows: int,
+    n_cols: int,
+    tile_size: int = 32,
+    n_workers: int = None,
+    dtype: object = np.float64,
+    symmetric: bool = False,
+    mirror: Callable[[np.ndarray, slice, slice], np.ndarray] = None,
+    out: np.ndarray = None,
+    checkpoint: object = None,
+) -> np.ndarray:
+    """
+    Вычисляет матрицу попарных сравнений по тайлам в пуле потоков. Численные ядра
+    (NumPy, OpenCV, BLAS) освобождают GIL, поэтому тайлы считаются параллельно,
+    а количество внутренних потоков библиотек делится между обработчиками.
+
+    Parameters:
+        - tile_function (Callable): функция, принимающая срезы строк и столбцов
+        и возвращающая блок матрицы соответствующего размера.
+        - n_rows (int): количество строк матрицы.
+        - n_cols (int): количество столбцов матрицы.
+        - tile_size (int): размер стороны тайла.
+        - n_workers (int): количество потоков (по умолчанию - количество ядер процессора).
+        - dtype (object): тип элементов результирующей матрицы.
+        - symmetric (bool): матрица сравнения датасета с самим собой - вычисляются только
+        тайлы на диагонали и выше неё, остальные заполняются отражением.
+        - mirror (Callable): для несимметричных мер - функция, получающая транспонированный
+        блок и его срезы строк и столбцов и возвращающая значения для отражённого блока.
+        - out (np.ndarray): матрица для записи результата (например, np.memmap);
+        по умолчанию создаётся новая матрица типа dtype.
+        - checkpoint (Checkpoint): состояние вычисления - готовые тайлы пропускаются,
+        результат записывается в checkpoint.matrix, а каждый тайл отмечается после записи.
+
+    Returns:
+        - np.ndarray: матрица размера (n_rows, n_cols).
+    """
+
+    if checkpoint is not None:
+        out = checkpoint.matrix
+
+    result = np.empty((n_rows, n_cols), dtype=dtype) if out is None else out
+
+    def store(rows: slice, cols: slice, values: np.ndarray) -> None:
+        result[rows, cols] = values
+
+    _start_progress(n_rows, n_cols)
+
+    try:
+        _for_each_tile(
+            tile_function,
+            n_rows,
+            n_cols,
+            tile_size,
+            n_workers,
+            store,
+            symmetric,
+            mirror,
+            skip=checkpoint.is_done if checkpoint is not None else None,
+            commit=checkpoint.commit if checkpoint is not None else None,
+        )
+    finally:
+        # Готовые тайлы сохраняются и при прерывании вычисления
+        if checkpoint is not None:
+            checkpoint.close()
+
+    return result
+
+
+def run_top_k(
+    tile_function: Callable[[slice, slice], np.ndarray],
+    n_rows: int,
+    n_cols: int,
+    k: int,
+    tile_size: int = 32,
+    n_workers: int = None,
+    largest: bool = False,
+    threshold: float = None,
+    symmetric: bool = False,
+    mirror: Callable[[np.ndarray, slice, slice], np.ndarray] = None,
+    exclude_diagonal: bool = False,
+) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Вычисляет матрицу попарных сравнений по тайлам, как run_tiles, но не хранит её целиком:
+    после каждого тайла для каждой строки остаются только k лучших значений.
+
+    Parameters:
+        - tile_function (Callable): функция вычисления блока матрицы по срезам строк и столбцов.
+        - n_rows (int): количество строк матрицы.
+        - n_cols (int): количество столбцов матрицы.
+        - k (int): количество лучших совпадений для каждой строки.
+        - tile_size (int): размер стороны тайла.
+        - n_workers (int): количество потоков (по умолчанию - количество ядер процессора).
+        - largest (bool): лучшими считаются наибольшие значения (мера сходства),
+        иначе - наименьшие (мера расстояния).
+        - threshold (float): минимальное (для largest) или максимальное значение совпадения.
+        - symmetric (bool): матрица сравнения датасета с самим собой (см. run_tiles).
+        - mirror (Callable): функция отражения для несимметричных мер (см. run_tiles).
+        - exclude_diagonal (bool): не учитывать пары с одинаковым индексом.
+
+    Returns:
+        - tuple[np.ndarray, np.ndarray, np.ndarray]: индексы строк, индексы столбцов
+        и значения совпадений, отсортированные по строкам и от лучшего к худшему.
+    """
+
+    top = TopK(n_rows, k, largest, threshold)
+
+    def store(rows: slice, cols: slice, values: np.ndarray) -> None:
+        top.push(rows, cols, values, exclude_diagonal)
+
+    _start_progress(n_rows, n_cols)
+    _for_each_tile(
+        tile_function, n_rows, n_cols, tile_size, n_workers, store, symmetric, mirror
+    )
+
+    return top.result()
+
+
+def _for_each_tile(
+    tile_function: Callable[[slice, slice], np.ndarray],
+    n_rows: int,
+    n_cols: int,
+    tile_size: int,
+    n_workers: int,
+    store: Callable[[slice, slice, np.ndarray], None],
+    symmetric: bool = False,
+    mirror: Callable[[np.ndarray, slice, slice], np.ndarray] = None,
+    skip: Callable[[slice, slice], bool] = None,
+    commit: Callable[[slice, slice], None] = None,
+    mirrored: bool = False,
+) -> None:
+    """
+    Вычисляет тайлы матрицы в пуле потоков и передаёт каждый блок (и его отражение
+    для симметричной матрицы) в функцию store. Тайлы, для которых skip возвращает True,
+    не вычисляются; после сохранения тайла вызывается commit.
+
+    Если включена статистика выполнения (см. instrumentation.set_stats), время тайлов
+    учитывается в этапе "compare", а заполненные пары - в счётчике "pairs"
+    (пропущенные - в "pairs_resumed") и в ходе этапа "compare". Флаг mirrored означает,
+    что store сам отражает каждый тайл (пары блоков вне диагонали в run_blocks).
+    """
+
+    cpu_count = os.cpu_count() or 1
+    n_workers = n_workers or cpu_count
+
+    tiles = list(iter_tiles(n_rows, n_cols, max(1, tile_size), upper=symmetric))
+
+    stats = get_stats()
+
+    if skip is not None:
+        done = [skip(*tile) for tile in tiles]
+        skipped = [tile for tile, is_done in zip(tiles, done) if is_done]
+        tiles = [tile for tile, is_done in zip(tiles, done) if not is_done]
+
+        if stats is not None and skipped:
+            pairs = sum(_tile_pairs(rows, cols, symmetric) for rows, cols in skipped)
+            pairs *= 2 if mirrored else 1
+            stats.count("pairs_resumed", pairs)
+            stats.advance("compare", pairs)
+
+    def run(tile):
+        rows, cols = tile
+
+        if stats is None:
+            values = tile_function(rows, cols)
+        else:
+            with stats.stage("compare"):
+                values = tile_function(rows, cols)
+
+        store(rows, cols, values)
+
+        if symmetric and rows != cols:
+            values = np.asarray(values).T
+            store(cols, rows, values if mirror is None else mirror(values, cols, rows))
+
+        if commit is not None:
+            commit(rows, cols)
+
+        if stats is not None:
+            pairs = _tile_pairs(rows, cols, symmetric) * (2 if mirrored else 1)
+            stats.count("pairs", pairs)
+            stats.advance("compare", pairs)
+
+    if n_workers == 1 or len(tiles) <= 1:
+        for tile in tiles:
+            run(tile)
+
+        return
+
+    with limit_threads(max(1, cpu_count // n_workers)):
+        with ThreadPoolExecutor(max_workers=n_workers) as executor:
+            # list() пробрасывает исключения из потоков
+            list(executor.map(run, tiles))
+
+
+def _tile_pairs(rows: slice, cols: slice, symmetric: bool) -> int:
+    """
+    Количество элементов матрицы, заполняемых тайлом (вместе с отражением).
+    """
+
+    pairs = (rows.stop - rows.start) * (cols.stop - cols.start)
+
+    return pairs * 2 if symmetric and rows != cols else pairs
+
+
+def _start_progress(n_rows: int, n_cols: int) -> None:
+    stats = get_stats()
+
+    if stats is not None:
+        stats.start("compare", n_rows * n_cols)
+
+
+# ==================================================================================================================================
+
+
+def plan_blocks(n_items: int, item_bytes: int, memory_budget: int) -> list[slice]:
+    """
+    Разбивает датасет на блоки подряд идущих изображений, данные которых помещаются
+    в заданный объём памяти.
+
+    Parameters:
+        - n_items (int): количество изображений.
+        - item_bytes (int): объём подготовленных данных одного изображения в байтах.
+        - memory_budget (int): допустимый объём данных блока в байтах.
+
+    Returns:
+        - list[slice]: срезы блоков (не менее одного изображения в блоке).
+    """
+
+    size = max(1, int(memory_budget // max(1, item_bytes)))
+
+    return [slice(start, min(start + size, n_items)) for start in range(0, n_items, size)]
+
+
+def iter_block_pairs(n_row_blocks: int, n_col_blocks: int, symmetric: bool = False):
+    """
+    Генератор пар блоков в "змеевидном" порядке: чётные строки блоков проходятся слева
+    направо, нечётные - справа налево, поэтому последний блок столбцов строки совпадает
+    с первым блоком следующей строки и не загружается повторно.
+
+    Parameters:
+        - n_row_blocks (int): количество блоков строк.
+        - n_col_blocks (int): количество блоков столбцов.
+        - symmetric (bool): только пары на главной диагонали и выше неё.
+
+    Returns:
+        - tuple[int, int]: номера блока строк и блока столбцов.
+    """
+
+    for row in range(n_row_blocks):
+        cols = range(row if symmetric else 0, n_col_blocks)
+
+        for col in cols if row % 2 == 0 else reversed(cols):
+            yield row, col
+
+
+def run_blocks(
+    load_rows: Callable[[slice], object],
+    load_cols: Callable[[slice], object],
+    prepare: Callable[[object, object], Callable[[slice, slice], np.ndarray]],
+    n_rows: int,
+    n_cols: int,
+    row_bytes: int,
+    col_bytes: int,
+    memory_budget: int,
+    sink: Callable[[slice, slice, np.ndarray], None],
+    tile_size: int = 32,
+    n_workers: int = None,
+    symmetric: bool = False,
+    mirror: Callable[[np.ndarray, slice, slice], np.ndarray] = None,
+    checkpoint: object = None,
+) -> int:
+    """
+    Вычисляет матрицу попарных сравнений датасетов, подготовленные данные которых не
+    помещаются в память. Оба датасета разбиваются на блоки, умещающиеся в memory_budget
+    (по половине на блок строк и блок столбцов); в памяти одновременно находятся только
+    два блока. Пары блоков обходятся в змеевидном порядке (см. iter_block_pairs), блок строк
+    загружается один раз, а каждая пара блоков считается по тайлам в пуле потоков.
+    Результаты тайлов передаются в sink и не накапливаются.
+
+    Parameters:
+        - load_rows (Callable): функция, загружающая данные изображений первого датасета
+        по срезу (массив или список, поддерживающий срезы).
+        - load_cols (Callable): то же для второго датасета.
+        - prepare (Callable): функция, принимающая данные блока строк и блока столбцов
+        (для диагонального блока - один и тот же объект) и возвращающая функцию
+        вычисления тайла по срезам строк и столбцов внутри пары блоков.
+        - n_rows (int): количество изображений первого датасета.
+        - n_cols (int): количество изображений второго датасета.
+        - row_bytes (int): объём данных одного изображения первого датасета в байтах.
+        - col_bytes (int): объём данных одного изображения второго датасета в байтах.
+        - memory_budget (int): допустимый объём загруженных данных в байтах.
+        - sink (Callable): функция, принимающая срезы строк и столбцов тайла
+        и его значения (например, запись в np.memmap или TopK.push).
+        - tile_size (int): размер стороны тайла.
+        - n_workers (int): количество потоков (по умолчанию - количество ядер процессора).
+        - symmetric (bool): сравнение датасета с самим собой - считаются только пары
+        блоков на диагонали и выше неё, остальные передаются в sink отражением.
+        - mirror (Callable): функция отражения для несимметричных мер (см. run_tiles).
+        - checkpoint (Checkpoint): состояние вычисления - готовые тайлы пропускаются
+        (пары блоков, все тайлы которых готовы, не загружаются), каждый тайл отмечается
+        после передачи в sink.
+
+    Returns:
+        - int: количество загрузок блоков.
+    """
+
+    row_blocks = plan_blocks(n_rows, row_bytes, memory_budget // 2)
+    col_blocks = (
+        row_blocks if symmetric else plan_blocks(n_cols, col_bytes, memory_budget // 2)
+    )
+
+    # Загруженные блоки: ключ - (датасет, номер блока); хранятся только текущие два
+    resident: dict[tuple, object] = {}
+    loads = 0
+
+    _start_progress(n_rows, n_cols)
+    stats = get_stats()
+
+    def get(key: tuple, load: Callable[[slice], object], block: slice) -> object:
+        nonlocal loads
+
+        if key not in resident:
+            resident[key] = load(block)
+            loads += 1
+
+        return resident[key]
+
+    def shift(local: slice, block: slice) -> slice:
+        return slice(block.start + local.start, block.start + local.stop)
+
+    try:
+        for i, j in iter_block_pairs(len(row_blocks), len(col_blocks), symmetric):
+            row_block, col_block = row_blocks[i], col_blocks[j]
+            diagonal = symmetric and i == j
+
+            def skip(rows: slice, cols: slice) -> bool:
+                return checkpoint.is_done(
+                    shift(rows, row_block), shift(cols, col_block)
+                )
+
+            def commit(rows: slice, cols: slice) -> None:
+                checkpoint.commit(shift(rows, row_block), shift(cols, col_block))
+
+            if checkpoint is not None and all(
+                skip(rows, cols)
+                for rows, cols in iter_tiles(
+                    row_block.stop - row_block.start,
+                    col_block.stop - col_block.start,
+                    max(1, tile_size),
+                    upper=diagonal,
+                )
+            ):
+                if stats is not None:
+                    pairs = _tile_pairs(
+                        row_block, col_block, symmetric and not diagonal
+                    )
+                    stats.count("pairs_resumed", pairs)
+                    stats.advance("compare", pairs)
+
+                continue
+
+            # Для сравнения датасета с самим собой блок столбцов может быть загружен как блок строк
+            row_key = ("rows", i)
+            col_key = ("rows", j) if symmetric else ("cols", j)
+
+            # Ненужные блоки освобождаются до загрузки новых
+            for key in list(resident):
+                if key not in (row_key, col_key):
+                    del resident[key]
+
+            rows_data = get(row_key, load_rows, row_block)
+            cols_data = get(col_key, load_cols, col_block)
+
+            def store(rows: slice, cols: slice, values: np.ndarray) -> None:
+                rows, cols = shift(rows, row_block), shift(cols, col_block)
+                sink(rows, cols, values)
+
+                if symmetric and not diagonal:
+                    values = np.asarray(values).T
+                    sink(
+                        cols,
+                        rows,
+                        values if mirror is None else mirror(values, cols, rows),
+                    )
+
+            def local_mirror(
+                values: np.ndarray, rows: slice, cols: slice
+            ) -> np.ndarray:
+                return mirror(values, shift(rows, row_block), shift(cols, col_block))
+
+            _for_each_tile(
+                prepare(rows_data, cols_data),
+                row_block.stop - row_block.start,
+                col_block.stop - col_block.start,
+                tile_size,
+                n_workers,
+                store,
+                symmetric=diagonal,
+                mirror=local_mirror if mirror is not None else None,
+                skip=skip if checkpoint is not None else None,
+                commit=commit if checkpoint is not None else None,
+                mirrored=symmetric and not diagonal,
+            )
+    finally:
+        # Готовые тайлы сохраняются и при прерывании вычисления
+        if checkpoint is not None:
+            checkpoint.close()
+
+    return loads
+
+
+# ==================================================================================================================================
+
+
+class TopK(object):
+    """
+    Накопитель k лучших совпадений для каждой строки матрицы попарных сравнений.
+    Блоки матрицы добавляются по мере вычисления и сразу сокращаются до k значений
+    на строку с помощью np.argpartition, поэтому память не зависит от количества столбцов.
+
+    Parameters:
+        - n_rows (int): количество строк матрицы.
+        - k (int): количество лучших совпадений для каждой строки.
+        - largest (bool): лучшими считаются наибольшие значения, иначе - наименьшие.
+        - threshold (float): минимальное (для largest) или максимальное значение совпадения.
+    """
+
+    def __init__(
+        self, n_rows: int, k: int, largest: bool = False, threshold: float = None
+    ):
+        if k < 1:
+            raise ValueError(f"Количество совпадений должно быть положительным: {k}")
+
+        self.k = k
+        self.largest = largest
+        self.threshold = threshold
+
+        # Ключи сортировки (меньше - лучше) и индексы столбцов; -1 - пустая позиция
+        self._keys = np.full((n_rows, k), np.inf, dtype=np.float64)
+        self._indices = np.full((n_rows, k), -1, dtype=np.int64)
+        self._lock = threading.Lock()
+
+    def push(
+        self,
+        rows: slice,
+        cols: object,
+        values: np.ndarray,
+        exclude_diagonal: bool = False,
+    ) -> None:
+        """
+        Добавляет блок матрицы со строками rows и столбцами cols.
+
+        Parameters:
+            - rows (slice): срез строк блока.
+            - cols (slice | np.ndarray): срез столбцов блока или индексы столбцов
+            каждого значения (например, для списков кандидатов).
+            - values (np.ndarray): значения блока.
+            - exclude_diagonal (bool): не учитывать пары с одинаковым индексом.
+        """
+
+        keys = np.asarray(values, dtype=np.float64)
+        keys = -keys if self.largest else keys.copy()
+        keys[np.isnan(keys)] = np.inf
+
+        if isinstance(cols, slice):
+            cols = np.arange(cols.start, cols.stop, dtype=np.int64)
+
+        indices = np.broadcast_to(np.asarray(cols, dtype=np.int64), keys.shape)
+
+        if self.threshold is not None:
+            limit = -self.threshold if self.largest else self.threshold
+            keys[keys > limit] = np.inf
+
+        if exclude_diagonal:
+            diagonal = np.arange(rows.start, rows.stop)[:, None] == indices
+            keys[diagonal] = np.inf
+
+        with self._lock:
+            keys = np.concatenate([self._keys[rows], keys], axis=1)
+            indices = np.concatenate([self._indices[rows], indices], axis=1)
+            indices[np.isposinf(keys)] = -1
+
+            if keys.shape[1] > self.k:
+                best = np.argpartition(keys, self.k - 1, axis=1)[:, : self.k]
+                keys = np.take_along_axis(keys, best, axis=1)
+                indices = np.take_along_axis(indices, best, axis=1)
+
+            self._keys[rows] = keys
+            self._indices[rows] = indices
+
+    def result(self) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """
+        Возвращает найденные совпадения в виде трёх массивов одинаковой длины.
+
+        Returns:
+            - tuple[np.ndarray, np.ndarray, np.ndarray]: индексы строк, индексы столбцов
+            и значения совпадений, отсортированные по строкам и от лучшего к худшему.
+        """
+
+        with self._lock:
+            # Пустые позиции (ключ inf) оказываются в конце строки
+            order = np.argsort(self._keys, axis=1, kind="stable")
+            keys = np.take_along_axis(self._keys, order, axis=1)
+            indices = np.take_along_axis(self._indices, order, axis=1)
+
+        valid = indices >= 0
+        query_indices = np.nonzero(valid)[0]
+        scores = -keys[valid] if self.largest else keys[valid]
+
+        return query_indices, indices[valid], scores
+
+
+# ==================================================================================================================================
+
+
+def is_self_comparison(dataset1: object, dataset2: object) -> bool:
+    """
+    Проверяет, сравнивается ли датасет с самим собой (один объект или одинаковые списки файлов).
+    """
+
+    if dataset1 is dataset2:
+        return True
+
+    return [image.path for image in dataset1.images] == [
+        image.path for image in dataset2.images
+    ]
+
+
+def condense(matrix: np.ndarray) -> np.ndarray:
+    """
+    Преобразует симметричную матрицу сравнения датасета с самим собой в сжатый вектор
+    значений над главной диагональью в порядке scipy.spatial.distance.pdist.
+
+    Parameters:
+        - matrix (np.ndarray): квадратная матрица (N, N).
+
+    Returns:
+        - np.ndarray: вектор длины N * (N - 1) / 2.
+    """
+
+    matrix = np.asarray(matrix)
+    rows, cols = np.triu_indices(len(matrix), k=1)
+
+    return matrix[rows, cols]
+
+
+def mirror_normalized(norms: object) -> Callable[[np.ndarray, slice, slice], np.ndarray]:
+    """
+    Функция отражения для мер, нормированных по первому изображению пары (например,
+    NRMSE): f(j, i) = f(i, j) * norm(i) / norm(j).
+
+    Parameters:
+        - norms (object): нормы изображений, индексируемые номером изображения.
+    """
+
+    def mirror(values: np.ndarray, rows: slice, cols: slice) -> np.ndarray:
+        row_norms = np.array([norms[i] for i in range(rows.start, rows.stop)])
+        col_norms = np.array([norms[i] for i in range(cols.start, cols.stop)])
+
+        with np.errstate(divide="ignore", invalid="ignore"):
+            return values * col_norms[None, :] / row_norms[:, None]
+
+    return mirror
@@ -0,0 +1,150 @@
+import os
+import json
+import importlib.util
+import numpy as np
+import pandas as pd
+
+from visdatcompy.instrumentation import timed
+
+
+__all__ = ["allocate_matrix", "save_matrix", "load_matrix", "RESULT_FORMATS"]
+
+# Форматы сохранения матриц результатов.
+RESULT_FORMATS = ("csv", "npy", "npz", "parquet")
+
+
+# ==================================================================================================================================
+# |                                                         RESULT MATRICES                                                        |
+# ==================================================================================================================================
+
+
+def allocate_matrix(shape: tuple, dtype: object, path: str = None) -> np.ndarray:
+    """
+    Создаёт матрицу результатов в памяти или, если указан путь, файл .npy,
+    отображённый в память (np.memmap), для матриц, не помещающихся в оперативную память.
+
+    Parameters:
+        - shape (tuple): размер матрицы.
+        - dtype (object): тип элементов матрицы.
+        - path (str): путь к файлу .npy для отображения в память.
+
+    Returns:
+        - np.ndarray: матрица (np.memmap, если указан путь).
+    """
+
+    if path is None:
+        return np.empty(shape, dtype=dtype)
+
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+
+    return np.lib.format.open_memmap(path, mode="w+", dtype=dtype, shape=shape)
+
+
+@timed("export")
+def save_matrix(
+    path: str,
+    matrix: np.ndarray,
+    index: list[str],
+    columns: list[str],
+    file_format: str = "npy",
+) -> str:
+    """
+    Сохраняет матрицу результатов вместе с названиями изображений строк и столбцов.
+
+    Parameters:
+        - path (str): путь к файлу без расширения.
+        - matrix (np.ndarray): матрица результатов.
+        - index (list[str]): названия изображений строк (первый датасет).
+        - columns (list[str]): названия изображений столбцов (второй датасет).
+        - file_format (str): формат файла:
+            - "csv": текстовая таблица (медленно для больших матриц).
+            - "npy": бинарный массив NumPy, названия изображений сохраняются рядом
+            в файле <path>.index.json.
+            - "npz": архив NumPy с массивами "matrix", "index" и "columns".
+            - "parquet": таблица Parquet (требуется pyarrow или fastparquet).
+
+    Returns:
+        - str: путь к сохранённому файлу.
+    """
+
+    if file_format not in RESULT_FORMATS:
+        raise ValueError(f"Неизвестный формат сохранения: {file_format}")
+
+    filename = f"{path}.{file_format}"
+
+    if file_format == "npy":
+        if not (
+            isinstance(matrix, np.memmap)
+            and os.path.abspath(matrix.filename) == os.path.abspath(filename)
+        ):
+            np.save(filename, matrix)
+        else:
+            matrix.flush()
+
+        with open(f"{path}.index.json", "w", encoding="utf-8") as file:
+            json.dump({"index": list(index), "columns": list(columns)}, file)
+
+    elif file_format == "npz":
+        np.savez(
+            filename,
+            matrix=matrix,
+            index=np.array(index, dtype=str),
+            columns=np.array(columns, dtype=str),
+        )
+
+    elif file_format == "parquet":
+        if not any(
+            importlib.util.find_spec(engine) for engine in ("pyarrow", "fastparquet")
+        ):
+            raise ImportError(
+                "Для сохранения в формате Parquet требуется пакет pyarrow или fastparquet."
+            )
+
+        pd.DataFrame(matrix, index=index, columns=columns).to_parquet(filename)
+
+    else:
+        pd.DataFrame(matrix, index=index, columns=columns).to_csv(filename)
+
+    return filename
+
+
+def load_matrix(path: str, mmap_mode: str = None) -> tuple:
+    """
+    Загружает матрицу результатов, сохранённую функцией save_matrix.
+
+    Parameters:
+        - path (str): путь к файлу с расширением .csv, .npy, .npz или .parquet.
+        - mmap_mode (str): режим отображения файла .npy в память (например, "r").
+
+    Returns:
+        - tuple: (матрица, названия изображений строк, названия изображений столбцов).
+    """
+
+    root, extension = os.path.splitext(path)
+
+    if extension == ".npy":
+        with open(f"{root}.index.json", encoding="utf-8") as file:
+            names = json.load(file)
+
+        return (
+            np.load(path, mmap_mode=mmap_mode, allow_pickle=False),
+            names["index"],
+            names["columns"],
+        )
+
+    if extension == ".npz":
+        with np.load(path, allow_pickle=False) as archive:
+            return (
+                archive["matrix"],
+                archive["index"].tolist(),
+                archive["columns"].tolist(),
+            )
+
+    if extension == ".parquet":
+        df = pd.read_parquet(path)
+    elif extension == ".csv":
+        df = pd.read_csv(path, index_col=0)
+    else:
+        raise ValueError(f"Неизвестный формат файла: {path}")
+
+    return df.to_numpy(), df.index.tolist(), df.columns.tolist()
@@ -1,11 +1,21 @@
 import os
-import time
 import sys
+import hashlib
+import queue
+import threading
+from typing import Iterator
 from colorama import Fore, Style, init
+from concurrent.futures import ThreadPoolExecutor
 
 init()
 
-__all__ = ["get_time", "color_print", "scan_directory"]
+__all__ = [
+    "get_time",
+    "color_print",
+    "scan_directory",
+    "walk_files",
+    "file_digest",
+]
 
 colors = {
     "none": "",
@@ -37,27 +47,23 @@ images = []
 # ==================================================================================================================================
 
 
-def get_time(func) -> None:
+def get_time(func):
     """
-    Декоратор для замера времени выполнения функции.
+    Декоратор для замера времени выполнения функции: псевдоним
+    instrumentation.timed(func.__name__). Время записывается как этап статистики,
+    включённой через instrumentation.set_stats, и ничего не выводится.
 
     Parameters:
         - func (function): функция, время выполнения которой требуется замерить
 
     Returns:
-        - None
+        - function: обёрнутая функция
     """
 
-    def wrapper(*args, **kwargs):
-        start_time = time.time()
-        result = func(*args, **kwargs)
-        end_time = time.time() - start_time
-
-        color_print("log", "log", f"Время выполнения: {end_time}", True)
+    # Импорт внутри функции: модуль instrumentation сам использует utils
+    from visdatcompy.instrumentation import timed
 
-        return result
-
-    return wrapper
+    return timed(func.__name__)(func)
 
 
 # ==================================================================================================================================
@@ -122,12 +128,12 @@ def scan_directory(dataset_path: str, echo: bool = False) -> list[str]:
     image_paths = []
 
     try:
-        for address, _, files in os.walk(dataset_path):
-            for name in files:
-                image_paths.append((address, name))
+        for path in walk_files(dataset_path):
+            address, name = os.path.split(path)
+            image_paths.append((address, name))
 
-                if echo:
-                    color_print("log", "log", f"{address} - - - {name}")
+            if echo:
+                color_print("log", "log", f"{address} - - - {name}")
 
     except Exception as e:
         color_print("fail", "fail", f"Ошибка сканирования директории: {e}")
@@ -138,6 +144,129 @@ def scan_directory(dataset_path: str, echo: bool = False) -> list[str]:
 # ==================================================================================================================================
 
 
+def walk_files(
+    directory: str, recursive: bool = True, n_workers: int = 1
+) -> Iterator[str]:
+    """
+    Генератор путей ко всем файлам директории на основе os.scandir. Пути выдаются
+    по мере обхода, не дожидаясь окончания сканирования всей директории.
+
+    Parameters:
+        - directory (str): путь к директории.
+        - recursive (bool): обходить вложенные директории.
+        - n_workers (int): количество потоков для параллельного обхода вложенных
+        директорий верхнего уровня (порядок файлов при этом не сохраняется).
+
+    Returns:
+        - str: путь к очередному файлу.
+    """
+
+    if not recursive or n_workers <= 1:
+        yield from _walk(directory, recursive)
+        return
+
+    subdirectories = []
+
+    with os.scandir(directory) as entries:
+        for entry in entries:
+            if entry.is_dir(follow_symlinks=False):
+                subdirectories.append(entry.path)
+            elif entry.is_file():
+                yield entry.path
+
+    if not subdirectories:
+        return
+
+    # Потоки обходят поддиректории и передают пути через ограниченную очередь
+    found = queue.Queue(maxsize=10000)
+    stop = threading.Event()
+    done = object()
+
+    def put(item):
+        while not stop.is_set():
+            try:
+                found.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+
+        return False
+
+    def walk(subdirectory):
+        try:
+            for path in _walk(subdirectory, True):
+                if not put(path):
+                    return
+        finally:
+            put(done)
+
+    with ThreadPoolExecutor(max_workers=n_workers) as executor:
+        futures = [executor.submit(walk, subdirectory) for subdirectory in subdirectories]
+        remaining = len(subdirectories)
+
+        try:
+            while remaining:
+                path = found.get()
+
+                if path is done:
+                    remaining -= 1
+                else:
+                    yield path
+        finally:
+            # Останавливает обход, если генератор закрыт до его окончания
+            stop.set()
+
+        for future in futures:
+            future.result()
+
+
+def file_digest(path: str, digest_size: int = 32) -> str:
+    """
+    Вычисляет BLAKE2-дайджест содержимого файла, читая его блоками.
+
+    Parameters:
+        - path (str): путь к файлу.
+        - digest_size (int): размер дайджеста в байтах.
+
+    Returns:
+        - str: шестнадцатеричная строка дайджеста.
+    """
+
+    with open(path, "rb") as file:
+        return hashlib.file_digest(
+            file, lambda: hashlib.blake2b(digest_size=digest_size)
+        ).hexdigest()
+
+
+def _walk(directory: str, recursive: bool) -> Iterator[str]:
+    stack = [directory]
+
+    while stack:
+        current = stack.pop()
+        subdirectories = []
+
+        try:
+            with os.scandir(current) as entries:
+                for entry in entries:
+                    if entry.is_dir(follow_symlinks=False):
+                        subdirectories.append(entry.path)
+                    elif entry.is_file():
+                        yield entry.path
+
+        except PermissionError as e:
+            color_print("warning", "warning", f"Нет доступа к директории: {e}")
+
+        if recursive:
+            stack.extend(reversed(subdirectories))
+
+
+# ==================================================================================================================================
+
+
 # Проверка на скорость выполнения функции для сканирования директории
 if __name__ == "__main__":
+    from visdatcompy.instrumentation import set_stats
+
+    stats = set_stats()
     print(get_time(scan_directory)("dataset"))
+    stats.report()
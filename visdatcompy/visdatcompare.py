@@ -1,6 +1,12 @@
-from typing import Dict, List
-
-from visdatcompy.hash import Hash
+import os
+import time
+import numpy as np
+import pandas as pd
+from typing import Callable, Dict, List
+from concurrent.futures import ThreadPoolExecutor
+
+from visdatcompy.hash import Hash, HashIndex
+from visdatcompy.cache import FeatureCache
 from visdatcompy.metrics import Metrics
 from visdatcompy.utils import color_print
 from visdatcompy.feature_extractor import FeatureExtractor
@@ -22,6 +28,7 @@ class VisDatCompare(object):
     Parameters:
         - dataset1 (Dataset): Исходный набор данных.
         - dataset2 (Dataset): Набор данных для сравнения. (Если пути совпадают, используется dataset1).
+        - cache (FeatureCache): Кэш хэшей, дескрипторов и уменьшенных копий между запусками.
 
     Attributes:
         - dataset1 (Dataset): Исходный набор данных.
@@ -29,14 +36,189 @@ class VisDatCompare(object):
         - duplicate_finder (DuplicateFinder): Объект класса DuplicateFinder для поиска дубликатов
         на основе EXIF данных и метода Pixel to Pixel.
         - similars_finder (SimilarsFinder): Объект класса SimilarsFinder для поиска схожих изображений.
+        - cascade_duplicates (dict): Дубликаты, найденные последним вызовом run_cascade.
+        - cascade_report (pd.DataFrame): Количество пар-кандидатов на каждом этапе run_cascade.
     """
 
-    def __init__(self, dataset1: Dataset, dataset2: Dataset):
+    def __init__(
+        self, dataset1: Dataset, dataset2: Dataset, cache: FeatureCache = None
+    ):
         self.dataset1 = dataset1
         self.dataset2 = dataset2 if dataset2.path != dataset1.path else dataset1
+        self.cache = cache
+
+        self.duplicates_finder = self.DuplicatesFinder(
+            self.dataset1, self.dataset2, cache
+        )
+        self.similars_finder = self.SimilarsFinder(self.dataset1, self.dataset2, cache)
+
+        self.cascade_duplicates: Dict[Image, List[Image]] = {}
+        self.cascade_report: pd.DataFrame = None
+
+    def run_cascade(
+        self,
+        pixel_digest: bool = False,
+        hash_method: str = "p",
+        hash_radius: float = 10,
+        metric_name: str = "ssim",
+        metric_range: str = "duplicate",
+        extractor_name: str = None,
+        min_feature_score: float = 0.6,
+        resize_images: bool = True,
+        echo: bool = True,
+    ) -> Dict[Image, List[Image]]:
+        """
+        Каскадный поиск дубликатов: от дешёвых проверок к дорогим. Каждый следующий этап
+        проверяет только пары-кандидаты, отобранные предыдущим, вместо всех N x M пар.
+
+        Этапы:
+            1. exact: точные дубликаты по размеру и дайджесту файла (и пикселей при
+            pixel_digest=True), подтверждаются сразу.
+            2. hash: пары, расстояние между перцептивными хэшами которых не превышает
+            hash_radius (поиск по HashIndex).
+            3. metric: проверка пар-кандидатов метрикой metric_name.
+            4. features: (если указан extractor_name) проверка оставшихся пар
+            сопоставлением дескрипторов SIFT, ORB или FAST.
+
+        Parameters:
+            - pixel_digest (bool): сравнивать дайджесты декодированных пикселей на этапе exact.
+            - hash_method (str): метод хэширования (кроме "radial_variance").
+            - hash_radius (float): максимальное расстояние между хэшами кандидатов.
+            - metric_name (str): метрика проверки кандидатов (см. Metrics.methods).
+            Для "pix2pix" этап metric не выполняется: попиксельно равные изображения
+            находит этап exact (дайджесты пикселей сравниваются всегда).
+            - metric_range (str): диапазон метрики, в который должна попасть пара
+            ("duplicate" или "similar").
+            - extractor_name (str): метод извлечения признаков для последнего этапа
+            (None - этап не выполняется).
+            - min_feature_score (float): минимальная доля сопоставленных дескрипторов.
+            - resize_images (bool): уменьшать ли изображения перед вычислением метрики.
+            - echo (bool): вывод количества пар на каждом этапе.
+
+        Returns:
+            - dict: Словарь, где ключи - это изображения из первого набора,
+            а значения - списки изображений из второго набора, являющиеся дубликатами.
+        """
+
+        metrics = Metrics(self.dataset1, self.dataset2, cache=self.cache)
+
+        if metric_name not in metrics.methods:
+            raise ValueError(f"Неизвестная метрика: {metric_name}")
+
+        if metric_range not in ("duplicate", "similar"):
+            raise ValueError(f"Неизвестный диапазон метрики: {metric_range}")
+
+        # У PixToPix нет диапазонов: равенство пикселей проверяется дайджестами
+        if metric_name == "pix2pix":
+            pixel_digest = True
+
+        same_dataset = self.dataset1 is self.dataset2
+        count1, count2 = self.dataset1.image_count, self.dataset2.image_count
+        total = count1 * (count1 - 1) // 2 if same_dataset else count1 * count2
+
+        report = []
+
+        def record(stage: str, pairs_in: int, pairs_out: int, started: float):
+            report.append(
+                {
+                    "stage": stage,
+                    "pairs_in": pairs_in,
+                    "pairs_out": pairs_out,
+                    "pruned": pairs_in - pairs_out,
+                    "seconds": time.perf_counter() - started,
+                }
+            )
+
+            if echo:
+                color_print(
+                    "log",
+                    "log",
+                    f"{stage}: {pairs_in} -> {pairs_out} пар (отсеяно {pairs_in - pairs_out}).",
+                )
+
+        def canonical(i: int, j: int) -> tuple:
+            # При сравнении датасета с самим собой пара (i, j) совпадает с (j, i)
+            return (min(i, j), max(i, j)) if same_dataset else (i, j)
+
+        # 1. Точные дубликаты
+        started = time.perf_counter()
+        exact = set()
+
+        for original, duplicates in self.duplicates_finder.find_exact_duplicates(
+            pixel_digest
+        ).items():
+            i = self.dataset1.index_of(original.relpath)
+
+            for duplicate in duplicates:
+                exact.add(canonical(i, self.dataset2.index_of(duplicate.relpath)))
+
+        record("exact", total, len(exact), started)
+
+        # 2. Кандидаты по перцептивным хэшам. Пары отбираются по индексам изображений:
+        # изображения разных датасетов с одинаковыми именами тоже являются кандидатами
+        started = time.perf_counter()
+        hasher = Hash(self.dataset1, self.dataset2, cache=self.cache)
+        index = HashIndex(self.dataset2, hash_method, hasher)
+
+        candidates = set()
+
+        for i, image_hash in enumerate(hasher.compute(hash_method, self.dataset1)):
+            for j, _ in index.query_indices(image_hash, hash_radius):
+                if same_dataset and i == j:
+                    continue
+
+                pair = canonical(i, j)
+
+                if pair not in exact:
+                    candidates.add(pair)
+
+        candidates = np.array(sorted(candidates), dtype=np.int64).reshape(-1, 2)
+        record("hash", total - len(exact), len(candidates), started)
 
-        self.duplicates_finder = self.DuplicatesFinder(self.dataset1, self.dataset2)
-        self.similars_finder = self.SimilarsFinder(self.dataset1, self.dataset2)
+        # 3. Проверка метрикой
+        started = time.perf_counter()
+        pairs_in = len(candidates)
+
+        if metric_name == "pix2pix":
+            # Попиксельно равные пары уже подтверждены этапом exact
+            candidates = candidates[:0]
+
+        elif pairs_in > 0:
+            values = metrics.compare_pairs(metric_name, candidates, resize_images)
+            in_range = metrics.ranges[metric_name][metric_range]
+            candidates = candidates[[bool(in_range(value)) for value in values]]
+
+        record("metric", pairs_in, len(candidates), started)
+
+        # 4. Проверка сопоставлением дескрипторов
+        if extractor_name is not None:
+            started = time.perf_counter()
+            pairs_in = len(candidates)
+
+            if pairs_in > 0:
+                extractor = FeatureExtractor(
+                    self.dataset1,
+                    self.dataset2,
+                    extractor_name,
+                    cache=self.cache,
+                    lazy=True,
+                )
+                scores = extractor.match_pairs(candidates)
+                candidates = candidates[scores >= min_feature_score]
+
+            record("features", pairs_in, len(candidates), started)
+
+        duplicates: Dict[Image, List[Image]] = {}
+
+        for i, j in sorted(exact | set(map(tuple, candidates.tolist()))):
+            duplicates.setdefault(self.dataset1.images[i], []).append(
+                self.dataset2.images[j]
+            )
+
+        self.cascade_duplicates = duplicates
+        self.cascade_report = pd.DataFrame(report)
+
+        return self.cascade_duplicates
 
     class DuplicatesFinder(object):
         """
@@ -45,6 +227,7 @@ class VisDatCompare(object):
         Parameters:
             - dataset1 (Dataset): Исходный набор данных.
             - dataset2 (Dataset): Набор данных для сравнения. Если пути совпадают, используется dataset1.
+            - cache (FeatureCache): Кэш признаков изображений между запусками.
 
         Attributes:
             - dataset1 (Dataset): Исходный набор данных.
@@ -53,45 +236,198 @@ class VisDatCompare(object):
             а значения - списки изображений из второго набора, являющиеся дубликатами.
             - metrics_duplicates (dict): Словарь дубликатов на основе выбранной метрики, где ключи - оригинальные изображения,
             а значения - списки изображений, являющиеся их дубликатами.
+            - exact_duplicates (dict): Словарь точных дубликатов (совпадающих файлов или пикселей).
         """
 
-        def __init__(self, dataset1, dataset2):
+        def __init__(self, dataset1, dataset2, cache: FeatureCache = None):
 
             self.dataset1: Dataset = dataset1
             self.dataset2: Dataset = dataset2
+            self.cache = cache
 
             self.exif_duplicates: Dict[Image, List[Image]] = {}
             self.metrics_duplicates: Dict[Image, List[Image]] = {}
+            self.exact_duplicates: Dict[Image, List[Image]] = {}
 
-        def find_exif_duplicates(self) -> Dict[Image, List[Image]]:
+        def find_exif_duplicates(
+            self, n_workers: int = None
+        ) -> Dict[Image, List[Image]]:
             """
             Функция для нахождения дублей изображений на основе EXIF данных.
 
+            Метаданные каждого изображения сводятся к отпечатку (без учёта тегов
+            EXIF_IGNORED_TAGS), а дубликаты находятся группировкой по отпечатку за O(N + M).
+            При сравнении датасета с самим собой оригиналом группы считается первое
+            изображение, а дубликатами - остальные.
+
+            Parameters:
+                - n_workers (int): количество потоков для чтения метаданных.
+
             Returns:
                 - dict: Словарь, где ключи - это изображения из первого набора,
                 а значения - списки изображений из второго набора, являющиеся дубликатами.
             """
 
-            try:
-                self.dataset1.get_exif_data()
-                self.dataset2.get_exif_data()
+            same_dataset = self.dataset1 is self.dataset2
+
+            fingerprints1 = self.dataset1.exif_fingerprints(n_workers)
+            fingerprints2 = (
+                fingerprints1
+                if same_dataset
+                else self.dataset2.exif_fingerprints(n_workers)
+            )
+
+            groups: Dict[str, List[Image]] = {}
+
+            for image, fingerprint in zip(self.dataset2.images, fingerprints2):
+                if fingerprint is not None:
+                    groups.setdefault(fingerprint, []).append(image)
 
-                for i1, exif1 in self.dataset1.exif_data.iterrows():
-                    for i2, exif2 in self.dataset2.exif_data.iterrows():
-                        if self._exif_equal(exif1, exif2):
-                            original_image = self.dataset1.images[i1]
-                            match_image = self.dataset2.images[i2]
+            self.exif_duplicates = {}
 
-                            if original_image not in self.exif_duplicates:
-                                self.exif_duplicates[original_image] = []
+            for image, fingerprint in zip(self.dataset1.images, fingerprints1):
+                matches = groups.get(fingerprint)
 
-                            self.exif_duplicates[original_image].append(match_image)
+                if not matches:
+                    continue
 
-                return self.exif_duplicates
+                if same_dataset:
+                    if matches[0] is not image:
+                        continue
 
-            except AttributeError:
+                    matches = matches[1:]
+
+                if matches:
+                    self.exif_duplicates[image] = list(matches)
+
+            if not any(fingerprint is not None for fingerprint in fingerprints1):
                 color_print("warning", "warning", f"Метаданные не найдены.")
 
+            return self.exif_duplicates
+
+        def find_exact_duplicates(
+            self, pixel_digest: bool = False, n_workers: int = None, echo: bool = False
+        ) -> Dict[Image, List[Image]]:
+            """
+            Функция для нахождения точных дубликатов изображений без попарного сравнения.
+
+            Изображения группируются по размеру файла, затем внутри групп, где есть
+            кандидаты, - по BLAKE2-дайджесту содержимого файла. При pixel_digest=True
+            дополнительно группируются по дайджесту декодированных пикселей (кандидаты
+            отбираются по разрешению из заголовка), что находит попиксельно одинаковые
+            изображения в разных форматах или с разными метаданными.
+
+            Parameters:
+                - pixel_digest (bool): сравнивать также декодированные пиксели.
+                - n_workers (int): количество потоков для чтения файлов.
+                - echo (bool): логирование количества кандидатов на каждом этапе.
+
+            Returns:
+                - dict: Словарь, где ключи - это изображения из первого набора,
+                а значения - списки изображений из второго набора, являющиеся дубликатами.
+            """
+
+            same_dataset = self.dataset1 is self.dataset2
+            images1 = self.dataset1.images
+            images2 = [] if same_dataset else self.dataset2.images
+
+            def group(indices: List[int], key: Callable) -> Dict[object, List[int]]:
+                # Группирует индексы изображений по ключу, вычисляемому параллельно
+                groups = {}
+
+                for i, value in zip(indices, self._map(key, indices, images, n_workers)):
+                    if value is not None:
+                        groups.setdefault(value, []).append(i)
+
+                return groups
+
+            def candidates(groups: Dict[object, List[int]]) -> List[int]:
+                # Оставляет группы, где есть изображения обоих датасетов (или хотя бы два)
+                selected = []
+
+                for indices in groups.values():
+                    if same_dataset:
+                        if len(indices) > 1:
+                            selected.extend(indices)
+
+                    elif indices[0] < len(images1) <= indices[-1]:
+                        selected.extend(indices)
+
+                return sorted(selected)
+
+            images = images1 + images2
+
+            by_size = group(range(len(images)), _file_size)
+            selected = candidates(by_size)
+
+            by_digest = group(selected, _file_key)
+            groups = list(by_digest.values())
+
+            if echo:
+                color_print(
+                    "log",
+                    "log",
+                    f"Изображений: {len(images)}, кандидатов по размеру файла: {len(selected)}.",
+                )
+
+            if pixel_digest:
+                by_resolution = group(
+                    range(len(images)), lambda image: (image.width, image.height)
+                )
+                selected = candidates(by_resolution)
+
+                # Одинаковые файлы имеют одинаковые пиксели: декодируется один файл группы
+                representative = {i: i for i in selected}
+                for indices in groups:
+                    for i in indices:
+                        representative[i] = indices[0]
+
+                decoded = sorted({representative[i] for i in selected})
+                digests = dict(
+                    zip(decoded, self._map(Image.pixel_digest, decoded, images, n_workers))
+                )
+
+                by_pixels = {}
+                for i in selected:
+                    digest = digests[representative[i]]
+
+                    if digest is not None:
+                        by_pixels.setdefault(digest, []).append(i)
+
+                groups = list(by_pixels.values())
+
+                if echo:
+                    color_print(
+                        "log",
+                        "log",
+                        f"Кандидатов по разрешению: {len(selected)}, декодировано: {len(decoded)}.",
+                    )
+
+            duplicates = {}
+
+            for indices in groups:
+                first = [i for i in indices if i < len(images1)]
+                second = [images[i] for i in indices if i >= len(images1)]
+
+                if same_dataset:
+                    if len(first) > 1:
+                        duplicates[images[first[0]]] = [images[i] for i in first[1:]]
+
+                elif first and second:
+                    for i in first:
+                        duplicates[images[i]] = list(second)
+
+            self.exact_duplicates = duplicates
+
+            if echo:
+                color_print(
+                    "done",
+                    "done",
+                    f"Найдено точных дубликатов: {sum(map(len, duplicates.values()))}.",
+                )
+
+            return self.exact_duplicates
+
         def find_metrics_duplicates(
             self, metric_name: str = "pix2pix"
         ) -> Dict[Image, List[Image]]:
@@ -106,7 +442,7 @@ class VisDatCompare(object):
                 а значения - списки изображений, являющиеся их дубликатами.
 
             metric_names:
-                - pix2pix: Попиксельное сравнение двух изображений.
+                - pix2pix: Попиксельное сравнение двух изображений (через find_exact_duplicates).
                 - mse: Вычисляет среднеквадратичную ошибку между изображениями.
                 - nrmse: Вычисляет нормализованную среднеквадратическую ошибку.
                 - ssim: Вычисляет структурное сходство изображений.
@@ -115,7 +451,15 @@ class VisDatCompare(object):
                 - nmi: Вычисляет нормализованный показатель взаимной информации.
             """
 
-            metrics = Metrics(self.dataset1, self.dataset2)
+            if metric_name == "pix2pix":
+                # Попиксельное равенство проверяется по дайджестам пикселей без перебора пар
+                self.metrics_duplicates = dict(
+                    self.find_exact_duplicates(pixel_digest=True, echo=True)
+                )
+
+                return self.metrics_duplicates
+
+            metrics = Metrics(self.dataset1, self.dataset2, cache=self.cache)
             datasets_unique = self.dataset1.path == self.dataset2.path
 
             metric_func = metrics.methods[metric_name]
@@ -140,21 +484,32 @@ class VisDatCompare(object):
             return self.metrics_duplicates
 
         def clear_duplicates(self):
+            duplicates = []
+
             for duplicates_list in self.metrics_duplicates.values():
-                for duplicate in duplicates_list:
-                    self.dataset2.delete_image(duplicate)
+                duplicates.extend(duplicates_list)
 
             for duplicates_list in self.exif_duplicates.values():
-                for duplicate in duplicates_list:
-                    self.dataset2.delete_image(duplicate)
+                duplicates.extend(duplicates_list)
+
+            for duplicates_list in self.exact_duplicates.values():
+                duplicates.extend(duplicates_list)
 
-        def _exif_equal(self, exif1, exif2):
-            ignore_columns = {"Filename", "FileExtension", "DateTimeDigitized"}
+            self.dataset2.remove_many(duplicates)
 
-            filtered_exif1 = {k: v for k, v in exif1.items() if k not in ignore_columns}
-            filtered_exif2 = {k: v for k, v in exif2.items() if k not in ignore_columns}
+        def _map(
+            self,
+            function: Callable,
+            indices: List[int],
+            images: List[Image],
+            n_workers: int,
+        ) -> List[object]:
+            """
+            Применяет функцию к изображениям с указанными индексами в пуле потоков.
+            """
 
-            return filtered_exif1 == filtered_exif2
+            with ThreadPoolExecutor(max_workers=n_workers) as executor:
+                return list(executor.map(function, (images[i] for i in indices)))
 
     class SimilarsFinder(object):
         """
@@ -163,6 +518,7 @@ class VisDatCompare(object):
         Parameters:
             - dataset1 (Dataset): Первый набор данных изображений.
             - dataset2 (Dataset): Второй набор данных изображений.
+            - cache (FeatureCache): Кэш признаков изображений между запусками.
 
         Attributes:
             - dataset1 (Dataset): Первый набор данных изображений.
@@ -173,9 +529,10 @@ class VisDatCompare(object):
 
         """
 
-        def __init__(self, dataset1, dataset2):
+        def __init__(self, dataset1, dataset2, cache: FeatureCache = None):
             self.dataset1: Dataset = dataset1
             self.dataset2: Dataset = dataset2
+            self.cache = cache
 
             self.hash_similars: Dict[Image, Image] = {}
             self.features_similars: Dict[Image, Image] = {}
@@ -206,17 +563,14 @@ class VisDatCompare(object):
                 представленного в той же статье, что и RadialVarianceHash.
             """
 
-            hash = Hash(self.dataset1, self.dataset2)
+            hash = Hash(self.dataset1, self.dataset2, cache=self.cache)
             hash_similars_df = hash.find_similars(method, echo=True)
 
-            if len(self.hash_similars.keys()) > 0:
-                del self.hash_similars
-
-            for im1_name, im2_row in hash_similars_df.iterrows():
-                im2_name = im2_row["similar_image_name"]
+            self.hash_similars = {}
 
-                im1 = self.dataset1.images[self.dataset1.filenames.index(im1_name)]
-                im2 = self.dataset2.images[self.dataset2.filenames.index(im2_name)]
+            for im1_name, im2_name in hash_similars_df["similar_image_name"].items():
+                im1 = self.dataset1.get_image(im1_name)
+                im2 = self.dataset2.get_image(im2_name)
 
                 self.hash_similars[im1] = im2
 
@@ -238,7 +592,9 @@ class VisDatCompare(object):
                 а значения - списки объектов изображений из второго датасета, являющихся схожими.
             """
 
-            fext = FeatureExtractor(self.dataset1, self.dataset2, extractor_name)
+            fext = FeatureExtractor(
+                self.dataset1, self.dataset2, extractor_name, cache=self.cache
+            )
 
             self.features_similars = fext.find_similars()
 
@@ -268,7 +624,7 @@ class VisDatCompare(object):
                 - nmi: Вычисляет нормализованный показатель взаимной информации.
             """
 
-            metrics = Metrics(self.dataset1, self.dataset2)
+            metrics = Metrics(self.dataset1, self.dataset2, cache=self.cache)
             datasets_unique = self.dataset1.path == self.dataset2.path
 
             similars_matrix = metrics.methods[metric_name](
@@ -288,15 +644,27 @@ class VisDatCompare(object):
             return self.metrics_similars
 
         def clear_similars(self):
-            for duplicate in self.hash_similars.values():
-                self.dataset2.delete_image(duplicate)
-
-            for duplicate in self.features_similars.values():
-                self.dataset2.delete_image(duplicate)
+            similars = list(self.hash_similars.values())
+            similars.extend(self.features_similars.values())
 
             for duplicate_list in self.metrics_similars.values():
-                for duplicate in duplicate_list:
-                    self.dataset2.delete_image(duplicate)
+                similars.extend(duplicate_list)
+
+            self.dataset2.remove_many(similars)
+
+
+def _file_size(image: Image) -> int:
+    try:
+        return os.stat(image.path).st_size
+    except OSError:
+        return None
+
+
+def _file_key(image: Image) -> tuple:
+    try:
+        return (_file_size(image), image.file_digest())
+    except OSError:
+        return None
 
 
 if __name__ == "__main__":
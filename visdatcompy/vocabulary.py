@@ -0,0 +1,358 @@
+import numpy as np
+from scipy import sparse
+from sklearn.cluster import MiniBatchKMeans
+
+from visdatcompy.utils import color_print
+
+
+__all__ = ["VisualVocabulary", "similarity_shortlist"]
+
+# Количество визуальных слов по умолчанию для каждого способа кодирования.
+_DEFAULT_WORDS = {"bovw": 1024, "vlad": 64}
+
+# Количество дескрипторов, обрабатываемых за один шаг при назначении слов и кодировании.
+_CHUNK_DESCRIPTORS = 65536
+
+# Ограничение на размер блока сигнатур VLAD при кодировании и блока сходств
+# при отборе кандидатов (в байтах).
+_BLOCK_BYTES = 64 * 1024 * 1024
+
+
+# ==================================================================================================================================
+# |                                                        VISUAL VOCABULARY                                                       |
+# ==================================================================================================================================
+
+
+class VisualVocabulary(object):
+    """
+    Визуальный словарь для построения глобальных сигнатур изображений по локальным дескрипторам.
+
+    Словарь обучается мини-пакетным k-means на выборке дескрипторов, после чего дескрипторы
+    каждого изображения кодируются в вектор фиксированной длины. Сходство изображений
+    считается скалярным произведением нормализованных сигнатур.
+
+    Дескрипторы назначаются словам частями, а сигнатуры VLAD
+    накапливаются блоками изображений, поэтому память на промежуточные массивы
+    не зависит от размера датасета.
+
+    Parameters:
+        - n_words (int): количество визуальных слов (кластеров); по умолчанию 1024
+        для "bovw" и 64 для "vlad".
+        - encoding (str): способ кодирования:
+            - "bovw": гистограмма визуальных слов с весами TF-IDF (разреженная матрица,
+            поиск по которой работает как инвертированный индекс).
+            - "vlad": сумма отклонений дескрипторов от центров кластеров (VLAD), плотный
+            вектор длины n_words * размер дескриптора (обычно используется 64-256 слов:
+            сигнатуры занимают n_images * n_words * размер дескриптора * 4 байт).
+        - sample_size (int): максимальное количество дескрипторов для обучения словаря.
+        - random_state (int): зерно генератора случайных чисел.
+
+    Attributes:
+        - centers (np.ndarray): центры визуальных слов.
+        - idf (np.ndarray): обратная документная частота слов (для "bovw").
+    """
+
+    def __init__(
+        self,
+        n_words: int = None,
+        encoding: str = "bovw",
+        sample_size: int = 100000,
+        random_state: int = 0,
+    ):
+        if encoding not in _DEFAULT_WORDS:
+            raise ValueError(f"Неизвестный способ кодирования: {encoding}")
+
+        self.n_words = n_words if n_words is not None else _DEFAULT_WORDS[encoding]
+        self.encoding = encoding
+        self.sample_size = sample_size
+        self.random_state = random_state
+
+        self.centers: np.ndarray = None
+        self.idf: np.ndarray = None
+
+    def fit(self, descriptors: np.ndarray, offsets: np.ndarray) -> "VisualVocabulary":
+        """
+        Обучает словарь на дескрипторах датасета.
+
+        Parameters:
+            - descriptors (np.ndarray): дескрипторы всех изображений датасета.
+            - offsets (np.ndarray): смещения дескрипторов изображений (формат CSR).
+
+        Returns:
+            - VisualVocabulary: обученный словарь.
+        """
+
+        if len(descriptors) == 0:
+            raise ValueError("Нет дескрипторов для обучения визуального словаря")
+
+        rng = np.random.default_rng(self.random_state)
+        sample = descriptors
+
+        if len(sample) > self.sample_size:
+            sample = sample[
+                np.sort(rng.choice(len(sample), self.sample_size, replace=False))
+            ]
+
+        # Бинарные дескрипторы раскладываются на биты только для выборки
+        features = _as_features(sample)
+
+        n_words = min(self.n_words, len(features))
+
+        kmeans = MiniBatchKMeans(
+            n_clusters=n_words,
+            batch_size=max(1024, 3 * n_words),
+            n_init=3,
+            random_state=self.random_state,
+        )
+        kmeans.fit(features)
+
+        self._kmeans = kmeans
+        self.centers = kmeans.cluster_centers_.astype(np.float32)
+
+        # Обратная документная частота слов по изображениям обучающего датасета
+        words = self._assign(descriptors)
+        images = np.repeat(np.arange(len(offsets) - 1), np.diff(offsets))
+        document_frequency = np.zeros(len(self.centers), dtype=np.float64)
+
+        if words.size > 0:
+            pairs = np.unique(images * len(self.centers) + words)
+            np.add.at(document_frequency, pairs % len(self.centers), 1)
+
+        self.idf = np.log((len(offsets) - 1 + 1) / (document_frequency + 1)) + 1
+
+        color_print(
+            "done",
+            "done",
+            f"Визуальный словарь обучен: {len(self.centers)} слов, {len(features)} дескрипторов.",
+        )
+
+        return self
+
+    def encode(self, descriptors: np.ndarray, offsets: np.ndarray):
+        """
+        Кодирует дескрипторы каждого изображения в L2-нормализованную сигнатуру.
+
+        Parameters:
+            - descriptors (np.ndarray): дескрипторы всех изображений датасета.
+            - offsets (np.ndarray): смещения дескрипторов изображений (формат CSR).
+
+        Returns:
+            - sparse.csr_matrix | np.ndarray: сигнатуры изображений, по строке на изображение
+            (разреженная матрица для "bovw", плотная float32 для "vlad").
+        """
+
+        if self.centers is None:
+            raise RuntimeError("Визуальный словарь не обучен: вызовите fit().")
+
+        n_images = len(offsets) - 1
+
+        if self.encoding == "bovw":
+            words = self._assign(descriptors)
+            images = np.repeat(np.arange(n_images), np.diff(offsets))
+
+            histogram = sparse.csr_matrix(
+                (np.ones(len(words), dtype=np.float64), (images, words)),
+                shape=(n_images, len(self.centers)),
+            )
+            histogram.sum_duplicates()
+
+            signatures = histogram @ sparse.diags(self.idf)
+            norms = np.sqrt(np.asarray(signatures.multiply(signatures).sum(axis=1)))
+            norms[norms == 0] = 1
+
+            return sparse.csr_matrix(signatures.multiply(1 / norms))
+
+        n_words, dimension = self.centers.shape
+        signatures = np.zeros((n_images, n_words * dimension), dtype=np.float32)
+        max_images = max(1, _BLOCK_BYTES // (4 * n_words * dimension))
+
+        for start, end in _image_blocks(offsets, max_images, _CHUNK_DESCRIPTORS):
+            features = _as_features(descriptors[offsets[start] : offsets[end]])
+
+            if len(features) == 0:
+                continue
+
+            words = self._kmeans.predict(features).astype(np.int64)
+            images = np.repeat(np.arange(end - start), np.diff(offsets[start : end + 1]))
+
+            # Сумма отклонений по (изображение, слово): разреженная матрица назначения
+            # дескрипторов умножается на отклонения от центров слов
+            assignment = sparse.csr_matrix(
+                (
+                    np.ones(len(words), dtype=np.float32),
+                    (images * n_words + words, np.arange(len(words))),
+                ),
+                shape=((end - start) * n_words, len(words)),
+            )
+            block = assignment @ (features - self.centers[words])
+
+            # Степенная нормализация и L2-нормализация VLAD
+            block = np.sign(block) * np.sqrt(np.abs(block))
+            block = block.reshape(end - start, -1)
+            norms = np.linalg.norm(block, axis=1, keepdims=True)
+            norms[norms == 0] = 1
+
+            signatures[start:end] = block / norms
+
+        return signatures
+
+    def _assign(self, descriptors: np.ndarray) -> np.ndarray:
+        words = np.empty(len(descriptors), dtype=np.int64)
+
+        for start in range(0, len(descriptors), _CHUNK_DESCRIPTORS):
+            chunk = descriptors[start : start + _CHUNK_DESCRIPTORS]
+            words[start : start + len(chunk)] = self._kmeans.predict(_as_features(chunk))
+
+        return words
+
+
+# ==================================================================================================================================
+
+
+def similarity_shortlist(
+    signatures1, signatures2, shortlist: int, exclude_diagonal: bool = False
+) -> np.ndarray:
+    """
+    Для каждой сигнатуры первого набора находит индексы shortlist наиболее похожих
+    сигнатур второго набора (по убыванию сходства). Сходства считаются блоками строк
+    объёмом не более _BLOCK_BYTES; произведения разреженных сигнатур остаются разреженными.
+
+    Parameters:
+        - signatures1: сигнатуры первого набора (плотные или разреженные).
+        - signatures2: сигнатуры второго набора.
+        - shortlist (int): количество кандидатов для каждого изображения.
+        - exclude_diagonal (bool): исключать пары с одинаковым индексом (сравнение датасета с самим собой).
+
+    Returns:
+        - np.ndarray: индексы кандидатов размера (кол-во изображений 1, shortlist).
+    """
+
+    n1, n2 = signatures1.shape[0], signatures2.shape[0]
+    shortlist = max(0, min(shortlist, n2 - (1 if exclude_diagonal else 0)))
+    candidates = np.zeros((n1, shortlist), dtype=np.int64)
+
+    if shortlist == 0:
+        return candidates
+
+    if sparse.issparse(signatures1) and sparse.issparse(signatures2):
+        # Произведение остаётся разреженным: ненулевое значение занимает
+        # значение и индекс столбца
+        signatures1, signatures2 = signatures1.tocsr(), signatures2.tocsr()
+        value_bytes = np.result_type(signatures1.dtype, signatures2.dtype).itemsize + 4
+    else:
+        value_bytes = 4
+
+    block = max(1, _BLOCK_BYTES // (value_bytes * n2))
+
+    for start in range(0, n1, block):
+        end = min(start + block, n1)
+        similarities = signatures1[start:end] @ signatures2.T
+
+        if sparse.issparse(similarities):
+            # Почти плотный блок дешевле обработать как плотный массив float32
+            if similarities.nnz * value_bytes < 4 * (end - start) * n2:
+                candidates[start:end] = _sparse_top(
+                    similarities.tocsr(), start, shortlist, exclude_diagonal
+                )
+                continue
+
+            similarities = similarities.astype(np.float32).toarray()
+
+        similarities = np.asarray(similarities, dtype=np.float32)
+
+        if exclude_diagonal:
+            rows = np.arange(start, end)
+            similarities[rows - start, rows] = -np.inf
+
+        top = np.argpartition(-similarities, shortlist - 1, axis=1)[:, :shortlist]
+        order = np.argsort(-np.take_along_axis(similarities, top, axis=1), axis=1)
+        candidates[start:end] = np.take_along_axis(top, order, axis=1)
+
+    return candidates
+
+
+def _sparse_top(
+    similarities: sparse.csr_matrix, start: int, shortlist: int, exclude_diagonal: bool
+) -> np.ndarray:
+    """
+    Выбирает shortlist наибольших сходств в каждой строке разреженного блока по его
+    indptr/indices/data. Строки, в которых меньше shortlist положительных значений,
+    дополняются столбцами с нулевым сходством (отсутствующими в строке) и затем
+    отрицательными значениями.
+    """
+
+    n_rows, n2 = similarities.shape
+    indptr, indices, data = similarities.indptr, similarities.indices, similarities.data
+    candidates = np.zeros((n_rows, shortlist), dtype=np.int64)
+
+    # Положительные значения каждой строки по убыванию
+    rows = np.repeat(np.arange(n_rows), np.diff(indptr))
+    keep = data > 0
+
+    if exclude_diagonal:
+        keep &= indices != rows + start
+
+    rows, columns, values = rows[keep], indices[keep], data[keep]
+    order = np.lexsort((-values, rows))
+    rows, columns = rows[order], columns[order]
+
+    positive = np.bincount(rows, minlength=n_rows)
+    rank = np.arange(len(rows)) - (np.cumsum(positive) - positive)[rows]
+    top = rank < shortlist
+    candidates[rows[top], rank[top]] = columns[top]
+
+    for row in np.flatnonzero(positive < shortlist):
+        columns = indices[indptr[row] : indptr[row + 1]]
+        values = data[indptr[row] : indptr[row + 1]]
+        excluded = columns
+
+        if exclude_diagonal:
+            keep = columns != start + row
+            columns, values = columns[keep], values[keep]
+            excluded = np.append(columns, start + row)
+
+        zeros = np.setdiff1d(
+            np.arange(min(n2, shortlist + len(excluded))), excluded
+        )[:shortlist]
+
+        columns = np.concatenate([columns, zeros])
+        values = np.concatenate([values, np.zeros(len(zeros), dtype=values.dtype)])
+        candidates[row] = columns[np.argsort(-values, kind="stable")[:shortlist]]
+
+    return candidates
+
+
+def _image_blocks(offsets: np.ndarray, max_images: int, max_descriptors: int):
+    """
+    Генератор блоков подряд идущих изображений (начало и конец), в каждом из которых
+    не более max_images изображений и не более max_descriptors дескрипторов (кроме
+    блоков из одного изображения с большим количеством дескрипторов).
+    """
+
+    n_images = len(offsets) - 1
+    start = 0
+
+    while start < n_images:
+        end = start + 1
+
+        while (
+            end < n_images
+            and end - start < max_images
+            and offsets[end + 1] - offsets[start] <= max_descriptors
+        ):
+            end += 1
+
+        yield start, end
+        start = end
+
+
+def _as_features(descriptors: np.ndarray) -> np.ndarray:
+    """
+    Приводит дескрипторы к вещественным признакам: бинарные дескрипторы (uint8)
+    раскладываются на биты, чтобы евклидово расстояние соответствовало расстоянию Хэмминга.
+    """
+
+    if descriptors.dtype == np.uint8:
+        return np.unpackbits(descriptors, axis=1).astype(np.float32)
+
+    return descriptors.astype(np.float32, copy=False)